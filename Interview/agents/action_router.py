@@ -1,55 +1,495 @@
 import time
-import requests
+import heapq
+import queue
+import random
 import threading
+from collections import deque
+from urllib.parse import urlsplit
+
+from metrics import ACTION_DISPATCH_SECONDS, ACTION_ATTEMPTS
+from tracing import current_trace_id
+
+DEFAULT_BASE_URL = "http://example.com"
+ENDPOINT_PATHS = {
+    "crm_escalate": "/crm/escalate",
+    "crm_log": "/crm/log",
+    "risk_alert": "/risk_alert",
+    "ticket_create": "/ticket/create"
+}
+
+_STOP = object()
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30, max_parked=1000):
+        """
+        Per-endpoint circuit breaker:
+        - closed: deliveries go through; failure_threshold consecutive failures open it
+        - open: deliveries fail fast and are parked until reset_timeout has passed
+        - half_open: a single trial delivery decides whether to close or re-open
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_parked = max_parked
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self.parked = deque()
+        self.probe_scheduled = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() >= self.opened_at + self.reset_timeout:
+                self.state = "half_open"
+                return True
+            return False
+
+    def record_success(self):
+        """Close the breaker and hand back the jobs parked while it was open."""
+        with self.lock:
+            self.state = "closed"
+            self.failures = 0
+            parked = list(self.parked)
+            self.parked.clear()
+            return parked
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def park(self, job):
+        with self.lock:
+            if len(self.parked) >= self.max_parked:
+                return False
+            self.parked.append(job)
+            return True
+
+    def take_parked(self):
+        with self.lock:
+            self.probe_scheduled = False
+            return self.parked.popleft() if self.parked else None
+
+    def retry_in(self):
+        """
+        Seconds until a blocked delivery should be tried again: until the breaker lets a
+        trial through when open, a whole reset_timeout while a trial is already in flight.
+        """
+        with self.lock:
+            if self.state == "open":
+                return max(0, self.opened_at + self.reset_timeout - time.monotonic())
+            if self.state == "half_open":
+                return self.reset_timeout
+            return 0
+
+    def probe_due(self):
+        """Return when a parked job should be retried, or None if a probe is already scheduled."""
+        with self.lock:
+            if self.probe_scheduled or self.state == "closed":
+                return None
+            self.probe_scheduled = True
+            if self.state == "half_open":
+                # The trial in flight closes the breaker (handing back parked jobs) or re-opens it
+                return time.monotonic() + self.reset_timeout
+            return self.opened_at + self.reset_timeout
+
+    def stats(self):
+        with self.lock:
+            return {"state": self.state, "failures": self.failures, "parked": len(self.parked)}
+
 
 class ActionRouter:
-    def __init__(self, memory, max_retries=3, retry_delay=2):
+    def __init__(self, memory, max_retries=3, retry_delay=2, max_workers=4, max_queue=1000,
+                 max_backoff=30, endpoints=None, batching=None, breaker_failures=5, breaker_reset=30,
+                 outbox=False, outbox_batch=100, outbox_poll=0.25, outbox_lease=60, base_url=None):
+        """
+        Dispatches follow-up actions to REST endpoints:
+        - A bounded queue drained by a fixed pool of worker threads (started on first use)
+        - One keep-alive requests.Session per target host
+        - Failed attempts are rescheduled with exponential backoff and jitter by a
+          scheduler thread, so no worker sleeps while waiting for a retry
+        - batching: {action_type: {"max_items": N, "max_wait": seconds}} coalesces payloads
+          of that type into one bulk POST whose body is a JSON array
+        - A circuit breaker per endpoint fails fast and parks actions while it is open
+        - outbox=True makes delivery durable: actions are written to the SharedMemory
+          action outbox and a drainer thread claims due rows in batches, so pending
+          actions and their retry schedule survive restarts
+        - base_url replaces the host of every default endpoint (e.g. a local stub);
+          endpoints overrides individual action types
+        - every action keeps the trace id of the request that triggered it: it is sent as
+          X-Trace-ID and the delivery outcome is logged under it
+        """
         self.memory = memory
         self.max_retries = max_retries
         self.retry_delay = retry_delay
+        self.max_workers = max_workers
+        self.max_backoff = max_backoff
+        base_url = (base_url or DEFAULT_BASE_URL).rstrip("/")
+        self.endpoints = {action_type: base_url + path for action_type, path in ENDPOINT_PATHS.items()}
+        self.endpoints.update(endpoints or {})
+        self.batching = dict(batching or {})
+        self.breaker_failures = breaker_failures
+        self.breaker_reset = breaker_reset
+        self.outbox = outbox
+        self.outbox_batch = outbox_batch
+        self.outbox_poll = outbox_poll
+        self.outbox_lease = outbox_lease
+        self._wake = threading.Event()
+        self._batches = {}
+        self._batch_generation = 0
+        self._batches_lock = threading.Lock()
+        self._breakers = {}
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._retries = []
+        self._retry_seq = 0
+        self._retry_cond = threading.Condition()
+        self._sessions = {}
+        self._sessions_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._threads = []
+        self._running = False
+        self._shut_down = False
+        self._in_flight = 0
+        self._counts = {"delivered": 0, "failed": 0, "retried": 0, "rejected": 0}
+        self._counts_lock = threading.Lock()
+
+    def _start(self):
+        with self._start_lock:
+            # Commit hooks still firing while shared memory closes must not restart the workers
+            if self._running or self._shut_down:
+                return
+            self._running = True
+            for i in range(self.max_workers):
+                thread = threading.Thread(target=self._worker_loop, name=f"action-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            scheduler = threading.Thread(target=self._scheduler_loop, name="action-retry-scheduler", daemon=True)
+            scheduler.start()
+            self._threads.append(scheduler)
+            if self.outbox:
+                drainer = threading.Thread(target=self._drain_loop, name="action-outbox-drainer", daemon=True)
+                drainer.start()
+                self._threads.append(drainer)
+
+    def _count(self, key, delta=1):
+        with self._counts_lock:
+            self._counts[key] += delta
+
+    def _session(self, url):
+        host = urlsplit(url).netloc
+        with self._sessions_lock:
+            session = self._sessions.get(host)
+            if session is None:
+                # Imported on the first delivery, keeping requests out of the app's cold start
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[host] = session
+            return session
+
+    def _backoff(self, attempt):
+        # Exponential backoff with jitter: half the delay fixed, half random
+        delay = min(self.max_backoff, self.retry_delay * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _post(self, url, payload, action_type=None, trace_ids=()):
+        started = time.perf_counter()
+        trace_ids = [trace_id for trace_id in dict.fromkeys(trace_ids) if trace_id]
+        headers = {"X-Trace-ID": ",".join(trace_ids)} if trace_ids else None
+        try:
+            response = self._session(url).post(url, json=payload, headers=headers, timeout=5)
+            ok = response.status_code == 200
+        except Exception:
+            ok = False
+        ACTION_DISPATCH_SECONDS.observe(time.perf_counter() - started, action_type, "success" if ok else "error")
+        return ok
+
+    def _record(self, result, trace_id=None):
+        self.memory.add_extracted_fields("ActionRouter", result, trace_id=trace_id)
+        return result
 
     def _trigger_action_sync(self, action_type, payload):
         """
         Simulate triggering a follow-up action via REST call.
-        Retries on failure up to max_retries.
+        Retries on failure up to max_retries, blocking the calling thread between attempts.
         Logs action and result in shared memory.
         """
-        url_map = {
-            "crm_escalate": "http://example.com/crm/escalate",
-            "crm_log": "http://example.com/crm/log",
-            "risk_alert": "http://example.com/risk_alert",
-            "ticket_create": "http://example.com/ticket/create"
-        }
+        url = self.endpoints.get(action_type)
+        if not url:
+            return self._record({"error": f"Unknown action type: {action_type}"})
+
+        for attempt in range(self.max_retries):
+            if self._post(url, payload, action_type, [current_trace_id()]):
+                return self._record({"status": "success", "action": action_type, "payload": payload})
+            if attempt + 1 < self.max_retries:
+                time.sleep(self._backoff(attempt))
+
+        # After retries failed
+        return self._record({"status": "failed", "action": action_type, "payload": payload})
+
+    def _breaker(self, url):
+        with self._sessions_lock:
+            breaker = self._breakers.get(url)
+            if breaker is None:
+                breaker = CircuitBreaker(self.breaker_failures, self.breaker_reset)
+                self._breakers[url] = breaker
+            return breaker
+
+    def _job_result(self, status, job):
+        if job["bulk"]:
+            return {"status": status, "action": job["action_type"], "count": len(job["payloads"]),
+                    "payloads": job["payloads"]}
+        return {"status": status, "action": job["action_type"], "payload": job["payloads"][0]}
+
+    def _record_job(self, status, job):
+        """
+        Log a job's outcome under the trace of the request behind it, with the seconds since
+        it was triggered. A bulk job carrying several requests' payloads is logged once per
+        request, each row with that request's payloads.
+        """
+        by_trace = {}
+        for trace_id, payload in zip(job["trace_ids"], job["payloads"]):
+            by_trace.setdefault(trace_id, []).append(payload)
+        for trace_id, payloads in by_trace.items():
+            result = self._job_result(status, dict(job, payloads=payloads))
+            if "queued_at" in job:
+                result["elapsed"] = round(time.time() - job["queued_at"], 4)
+            self._record(result, trace_id)
 
-        url = url_map.get(action_type)
+    def _deliver(self, job):
+        """Make one delivery attempt, rescheduling the job if it failed and has retries left."""
+        url = self.endpoints.get(job["action_type"])
         if not url:
-            result = {"error": f"Unknown action type: {action_type}"}
-            self.memory.add_extracted_fields("ActionRouter", result)
-            return result
+            self._record({"error": f"Unknown action type: {job['action_type']}"}, job["trace_ids"][0])
+            return
+
+        outbox_ids = job.get("outbox_ids")
+        breaker = self._breaker(url)
+        if not breaker.allow():
+            ACTION_ATTEMPTS.inc(job["action_type"], "circuit_open")
+            if outbox_ids:
+                # Leave durable actions in the outbox until the breaker lets a trial through
+                self.memory.update_actions(outbox_ids, "pending", time.time() + breaker.retry_in(),
+                                           error="circuit open", count_attempt=False)
+            else:
+                self._park(breaker, job)
+            return
+
+        body = job["payloads"] if job["bulk"] else job["payloads"][0]
+        if self._post(url, body, job["action_type"], job["trace_ids"]):
+            for parked in breaker.record_success():
+                self._queue.put(parked)
+            self._count("delivered")
+            ACTION_ATTEMPTS.inc(job["action_type"], "delivered")
+            if outbox_ids:
+                self.memory.update_actions(outbox_ids, "delivered")
+            self._record_job("success", job)
+            return
+
+        breaker.record_failure()
+        job["attempt"] += 1
+        if job["attempt"] < self.max_retries:
+            self._count("retried")
+            ACTION_ATTEMPTS.inc(job["action_type"], "retried")
+            delay = self._backoff(job["attempt"] - 1)
+            if outbox_ids:
+                self.memory.update_actions(outbox_ids, "pending", time.time() + delay, error="delivery failed")
+            else:
+                self._schedule(time.monotonic() + delay, "deliver", job)
+        else:
+            # After retries failed
+            self._count("failed")
+            ACTION_ATTEMPTS.inc(job["action_type"], "failed")
+            if outbox_ids:
+                self.memory.update_actions(outbox_ids, "failed", error="delivery failed")
+            self._record_job("failed", job)
+        self._schedule_probe(breaker)
+
+    def _park(self, breaker, job):
+        if breaker.park(job):
+            self._schedule_probe(breaker)
+        else:
+            self._count("failed")
+            self._record_job("failed", job)
+
+    def _schedule_probe(self, breaker):
+        due = breaker.probe_due()
+        if due is not None:
+            self._schedule(due, "probe", breaker)
+
+    def _schedule(self, due, kind, item):
+        with self._retry_cond:
+            self._retry_seq += 1
+            heapq.heappush(self._retries, (due, self._retry_seq, kind, item))
+            self._retry_cond.notify()
 
-        attempt = 0
-        while attempt < self.max_retries:
+    def _scheduler_loop(self):
+        while self._running:
+            with self._retry_cond:
+                while self._running and (not self._retries or self._retries[0][0] > time.monotonic()):
+                    timeout = self._retries[0][0] - time.monotonic() if self._retries else None
+                    self._retry_cond.wait(timeout)
+                if not self._running:
+                    return
+                _, _, kind, item = heapq.heappop(self._retries)
+            if kind == "deliver":
+                self._queue.put(item)
+            elif kind == "flush":
+                self._flush_batch(*item)
+            elif kind == "probe":
+                # Send one parked job through as the half-open trial
+                job = item.take_parked()
+                if job is not None:
+                    self._queue.put(job)
+
+    def _worker_loop(self):
+        while True:
+            job = self._queue.get()
+            if job is _STOP:
+                return
+            with self._counts_lock:
+                self._in_flight += 1
             try:
-                response = requests.post(url, json=payload, timeout=5)
-                if response.status_code == 200:
-                    result = {"status": "success", "action": action_type, "payload": payload}
-                    self.memory.add_extracted_fields("ActionRouter", result)
-                    return result
-                else:
-                    attempt += 1
-                    time.sleep(self.retry_delay)
+                self._deliver(job)
             except Exception as e:
-                attempt += 1
-                time.sleep(self.retry_delay)
+                print(f"Warning: Action delivery failed: {e}")
+            finally:
+                with self._counts_lock:
+                    self._in_flight -= 1
 
-        # After retries failed
-        result = {"status": "failed", "action": action_type, "payload": payload}
-        self.memory.add_extracted_fields("ActionRouter", result)
-        return result
+    def _jobs_from_outbox(self, rows):
+        """Turn claimed outbox rows into delivery jobs, coalescing batched action types."""
+        by_type = {}
+        for row in rows:
+            by_type.setdefault(row["action_type"], []).append(row)
+        jobs = []
+        for action_type, typed_rows in by_type.items():
+            size = self.batching[action_type].get("max_items", 50) if action_type in self.batching else 1
+            for start in range(0, len(typed_rows), size):
+                chunk = typed_rows[start:start + size]
+                jobs.append({
+                    "action_type": action_type,
+                    "payloads": [row["payload"] for row in chunk],
+                    "bulk": action_type in self.batching,
+                    "attempt": max(row["attempts"] for row in chunk),
+                    "outbox_ids": [row["id"] for row in chunk],
+                    "trace_ids": [row.get("trace_id") for row in chunk]
+                })
+        return jobs
+
+    def _drain_loop(self):
+        while self._running:
+            try:
+                rows = self.memory.claim_actions(self.outbox_batch, self.outbox_lease)
+            except Exception as e:
+                print(f"Warning: Failed to claim outbox actions: {e}")
+                rows = []
+            if not rows:
+                self._wake.wait(self.outbox_poll)
+                self._wake.clear()
+                continue
+            for job in self._jobs_from_outbox(rows):
+                # Blocks while the worker queue is full, leaving the rest in the outbox
+                self._queue.put(job)
+
+    def notify(self):
+        """Wake the outbox drainer once actions added to the outbox are committed (passed as on_commit)."""
+        self._start()
+        self._wake.set()
+
+    def _enqueue(self, job):
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self._count("rejected")
+            self._record_job("rejected", job)
+            return False
+        return True
+
+    def _add_to_batch(self, action_type, payload):
+        config = self.batching[action_type]
+        with self._batches_lock:
+            batch = self._batches.get(action_type)
+            if batch is None:
+                self._batch_generation += 1
+                batch = {"payloads": [], "trace_ids": [], "generation": self._batch_generation,
+                         "queued_at": time.time()}
+                self._batches[action_type] = batch
+                self._schedule(time.monotonic() + config.get("max_wait", 0.2), "flush",
+                               (action_type, batch["generation"]))
+            batch["payloads"].append(payload)
+            batch["trace_ids"].append(current_trace_id())
+            full = len(batch["payloads"]) >= config.get("max_items", 50)
+        if full:
+            self._flush_batch(action_type, batch["generation"])
+
+    def _flush_batch(self, action_type, generation):
+        with self._batches_lock:
+            batch = self._batches.get(action_type)
+            if batch is None or batch["generation"] != generation:
+                return
+            del self._batches[action_type]
+        self._enqueue({"action_type": action_type, "payloads": batch["payloads"], "bulk": True, "attempt": 0,
+                       "trace_ids": batch["trace_ids"], "queued_at": batch["queued_at"]})
 
     def trigger_action(self, action_type, payload):
-        # Run the synchronous trigger in a background thread to avoid blocking
-        thread = threading.Thread(target=self._trigger_action_sync, args=(action_type, payload))
-        thread.daemon = True
-        thread.start()
+        """Queue an action for the worker pool without blocking the caller."""
+        self._start()
+        if self.outbox:
+            # The drainer is woken once the action is committed, not before it can be claimed
+            self.memory.enqueue_actions([(action_type, payload)], on_commit=self.notify)
+            return {"status": "queued", "action": action_type}
+        if action_type in self.batching:
+            self._add_to_batch(action_type, payload)
+            return {"status": "triggered_async", "action": action_type, "batched": True}
+        if not self._enqueue({"action_type": action_type, "payloads": [payload], "bulk": False, "attempt": 0,
+                              "trace_ids": [current_trace_id()], "queued_at": time.time()}):
+            return {"status": "rejected", "action": action_type, "reason": "Action queue is full"}
         return {"status": "triggered_async", "action": action_type}
+
+    def metrics(self):
+        with self._counts_lock:
+            counts = dict(self._counts)
+            in_flight = self._in_flight
+        with self._retry_cond:
+            scheduled_retries = sum(1 for entry in self._retries if entry[2] == "deliver")
+        with self._batches_lock:
+            pending_batches = {k: len(v["payloads"]) for k, v in self._batches.items()}
+        with self._sessions_lock:
+            breakers = {url: b.stats() for url, b in self._breakers.items()}
+        metrics = dict(counts, queue_depth=self._queue.qsize(), in_flight=in_flight,
+                       scheduled_retries=scheduled_retries, workers=self.max_workers,
+                       pending_batches=pending_batches, breakers=breakers)
+        if self.outbox:
+            metrics["outbox"] = self.memory.outbox_stats()
+        return metrics
+
+    def shutdown(self, timeout=5):
+        """
+        Stop the workers. Without the outbox, queued and scheduled actions that haven't been
+        delivered are dropped; with it they stay in the outbox and are resumed on restart.
+        """
+        with self._start_lock:
+            self._shut_down = True
+        if not self._running:
+            return
+        with self._retry_cond:
+            self._running = False
+            self._retry_cond.notify_all()
+        self._wake.set()
+        workers = [t for t in self._threads if t.name.startswith("action-worker")]
+        for _ in workers:
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        for session in self._sessions.values():
+            session.close()
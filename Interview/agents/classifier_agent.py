@@ -1,53 +1,43 @@
-import json
 from datetime import datetime
+from agents.intake_context import IntakeContext
+from agents.rule_engine import RuleEngine
 
 class ClassifierAgent:
-    def __init__(self, memory):
+    def __init__(self, memory, rule_engine=None):
         self.memory = memory
+        self.rule_engine = rule_engine or RuleEngine.default()
 
     def classify(self, raw_input):
         """
         Dummy classification logic:
-        - Detect format: PDF (bytes starting with %PDF), JSON (parseable), Email (text with typical email headers)
-        - Detect intent: simple keyword matching
+        - Detect format from the first few KB: PDF (bytes starting with %PDF), JSON (leading { or [
+          and parseable, or a JSON array / NDJSON record stream, which the JSONAgent validates
+          record by record), Email (typical email headers)
+        - Detect intent: keyword rules from the RuleEngine; for PDFs and JSON record streams only
+          the sniffed prefix is scanned, so large bodies are never decoded whole; MIME emails are
+          scanned by the decoded text of their first message
+        Accepts raw bytes/str or an IntakeContext, whose format is filled in.
         """
+        ctx = IntakeContext.wrap(raw_input)
         format_ = "Unknown"
-        intent = "Unknown"
 
         # Detect format
-        if isinstance(raw_input, bytes):
-            if raw_input.startswith(b'%PDF'):
-                format_ = "PDF"
-            else:
-                try:
-                    json.loads(raw_input.decode('utf-8'))
-                    format_ = "JSON"
-                except Exception:
-                    format_ = "Unknown"
-        elif isinstance(raw_input, str):
-            try:
-                json.loads(raw_input)
-                format_ = "JSON"
-            except Exception:
-                # Simple heuristic for email detection
-                if "From:" in raw_input or "Subject:" in raw_input:
-                    format_ = "Email"
-                else:
-                    format_ = "Unknown"
+        if ctx.looks_like_pdf:
+            format_ = "PDF"
+        elif ctx.looks_like_json and (ctx.looks_like_record_stream or ctx.is_json):
+            format_ = "JSON"
+        elif ctx.looks_like_email:
+            # Simple heuristic for email detection
+            format_ = "Email"
+        ctx.format = format_
 
-        # Detect intent by keyword matching
-        text = raw_input if isinstance(raw_input, str) else raw_input.decode('utf-8', errors='ignore')
-        text_lower = text.lower()
-        if "invoice" in text_lower:
-            intent = "Invoice"
-        elif "rfq" in text_lower:
-            intent = "RFQ"
-        elif "complaint" in text_lower:
-            intent = "Complaint"
-        elif "regulation" in text_lower:
-            intent = "Regulation"
+        # Detect intent with the shared keyword rules
+        if format_ == "Email" and ctx.looks_like_mime:
+            intent = self.rule_engine.match(ctx.message_text_lower)["intent"]
+        elif format_ == "PDF" or (format_ == "JSON" and ctx.looks_like_record_stream):
+            intent = self.rule_engine.match(ctx.prefix_text.lower())["intent"]
         else:
-            intent = "General"
+            intent = ctx.rule_matches(self.rule_engine)["intent"]
 
         return {"format": format_, "intent": intent}
 
@@ -1,27 +1,39 @@
 import re
+from contextlib import nullcontext
 from datetime import datetime
+from agents.intake_context import IntakeContext
+from agents.rule_engine import RuleEngine
+
+# Urgency levels that count toward escalating a long thread
+THREAD_ESCALATION_URGENCY = ("Medium", "High")
 
 class EmailParserAgent:
-    def __init__(self, memory, action_router=None):
+    def __init__(self, memory, action_router=None, rule_engine=None, escalate_after_messages=3):
         self.memory = memory
         self.action_router = action_router
+        self.rule_engine = rule_engine or RuleEngine.default()
+        self.escalate_after_messages = escalate_after_messages
 
-    def process(self, email_body):
+    def process(self, email_body, extra=None):
         """
         Process email body text (plain or HTML):
         - Extract sender name
         - Extract request intent (simple keyword matching)
         - Extract urgency (simple keyword matching)
         - Identify tone (escalation, polite, threatening)
-        - Trigger action based on tone + urgency
+        - Trigger action based on tone + urgency and the conversation so far
         - Return formatted CRM-style record
         - Store conversation ID + parsed metadata in memory
+        Accepts the email text or an IntakeContext; the text is lowercased and scanned
+        for intent, urgency and tone keywords once. extra fields are added to the record,
+        e.g. the message id and attachment list of a MIME message.
         """
-        sender = self.extract_sender(email_body)
-        intent = self.extract_intent(email_body)
-        urgency = self.extract_urgency(email_body)
-        tone = self.identify_tone(email_body)
-        conversation_id = self.extract_conversation_id(email_body)
+        ctx = IntakeContext.wrap(email_body)
+        sender = self.extract_sender(ctx)
+        intent = self.extract_intent(ctx)
+        urgency = self.extract_urgency(ctx)
+        tone = self.identify_tone(ctx)
+        conversation_id = self.extract_conversation_id(ctx)
 
         crm_record = {
             "sender": sender,
@@ -31,22 +43,47 @@ class EmailParserAgent:
             "conversation_id": conversation_id,
             "timestamp": datetime.utcnow().isoformat()
         }
+        if extra:
+            crm_record.update(extra)
 
-        # Store extracted fields and conversation metadata in shared memory
-        try:
-            self.memory.add_extracted_fields("EmailParserAgent", crm_record)
+        # Messages of one thread are handled one at a time in this process, from reading the
+        # thread's summary to storing the message, so each one counts the messages before it
+        lock = self.memory.conversation_lock(conversation_id) if conversation_id else nullcontext()
+        with lock:
+            # Look up the thread's summary (one indexed row) for thread-aware escalation
+            thread = None
             if conversation_id:
-                self.memory.add_conversation(conversation_id, crm_record)
-        except Exception as e:
-            print(f"Warning: Failed to store email data: {e}")
+                try:
+                    thread = self.memory.get_conversation_state(conversation_id)
+                except Exception as e:
+                    print(f"Warning: Failed to load conversation state: {e}")
+
+            # Decide the follow-up action based on tone, urgency and the thread
+            action_type = None
+            if self.action_router:
+                action_type, _ = self.follow_up_actions(crm_record, thread)[0]
+            durable = action_type is not None and self.action_router.outbox
+
+            # Store extracted fields and conversation metadata in shared memory.
+            # With a durable router the action goes into the outbox in the same transaction,
+            # and the drainer is woken once it is committed (at the end of a batch's write group).
+            try:
+                self.memory.add_extracted_fields("EmailParserAgent", crm_record,
+                                                 actions=[(action_type, crm_record)] if durable else None,
+                                                 on_commit=self.action_router.notify if durable else None)
+                if conversation_id:
+                    self.memory.add_conversation(conversation_id, crm_record,
+                                                 escalated=self.should_escalate(crm_record, thread))
+            except Exception as e:
+                print(f"Warning: Failed to store email data: {e}")
 
         # Trigger action based on tone and urgency
-        if self.action_router:
+        if action_type:
             try:
-                if tone == "escalation" or urgency == "High":
-                    action_result = self.action_router.trigger_action("crm_escalate", crm_record)
+                if durable:
+                    action_result = {"status": "queued", "action": action_type}
                 else:
-                    action_result = self.action_router.trigger_action("crm_log", crm_record)
+                    action_result = self.action_router.trigger_action(action_type, crm_record)
                 # Log action result in memory
                 self.memory.add_extracted_fields("EmailParserAgent_Action", action_result)
             except Exception as e:
@@ -54,9 +91,33 @@ class EmailParserAgent:
 
         return crm_record
 
+    def follow_up_actions(self, crm_record, thread=None):
+        """Return the (action_type, payload) pairs a CRM record should trigger."""
+        if self.should_escalate(crm_record, thread):
+            return [("crm_escalate", crm_record)]
+        return [("crm_log", crm_record)]
+
+    def should_escalate(self, crm_record, thread=None):
+        """
+        Escalate on an escalating tone or High urgency, and, given the thread's summary
+        from before this message, also when:
+        - the thread was already escalated, so follow-ups stay with the escalation team
+        - this message makes the thread escalate_after_messages long while it has been
+          at least Medium urgency
+        """
+        if crm_record["tone"] == "escalation" or crm_record["urgency"] == "High":
+            return True
+        if not thread:
+            return False
+        if thread["escalated"]:
+            return True
+        urgent = (crm_record["urgency"] in THREAD_ESCALATION_URGENCY
+                  or thread["max_urgency"] in THREAD_ESCALATION_URGENCY)
+        return urgent and thread["message_count"] + 1 >= self.escalate_after_messages
+
     def extract_sender(self, text):
         # Simple regex to extract sender from typical email header "From: Name <email>"
-        match = re.search(r"From:\s*(.*)", text, re.IGNORECASE)
+        match = re.search(r"From:\s*(.*)", IntakeContext.wrap(text).text, re.IGNORECASE)
         if match:
             sender_line = match.group(1).strip()
             # Extract name if in format Name <email>
@@ -67,39 +128,17 @@ class EmailParserAgent:
         return "Unknown"
 
     def extract_intent(self, text):
-        text_lower = text.lower()
-        if "invoice" in text_lower:
-            return "Invoice"
-        elif "rfq" in text_lower:
-            return "RFQ"
-        elif "complaint" in text_lower:
-            return "Complaint"
-        elif "regulation" in text_lower:
-            return "Regulation"
-        else:
-            return "General"
+        return IntakeContext.wrap(text).rule_matches(self.rule_engine)["intent"]
 
     def extract_urgency(self, text):
-        text_lower = text.lower()
-        if "urgent" in text_lower or "asap" in text_lower:
-            return "High"
-        elif "soon" in text_lower or "priority" in text_lower:
-            return "Medium"
-        else:
-            return "Low"
+        return IntakeContext.wrap(text).rule_matches(self.rule_engine)["urgency"]
 
     def identify_tone(self, text):
-        text_lower = text.lower()
-        if any(word in text_lower for word in ["angry", "threatening", "escalate", "complain"]):
-            return "escalation"
-        elif any(word in text_lower for word in ["please", "thank you", "kindly"]):
-            return "polite"
-        else:
-            return "neutral"
+        return IntakeContext.wrap(text).rule_matches(self.rule_engine)["tone"]
 
     def extract_conversation_id(self, text):
         # Simple heuristic: look for "Conversation-ID: <id>" in text
-        match = re.search(r"Conversation-ID:\s*(\S+)", text, re.IGNORECASE)
+        match = re.search(r"Conversation-ID:\s*(\S+)", IntakeContext.wrap(text).text, re.IGNORECASE)
         if match:
             return match.group(1)
         return None
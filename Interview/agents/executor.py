@@ -0,0 +1,129 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Concurrent requests allowed per input format, and how many more may wait for a slot
+DEFAULT_FORMAT_LIMITS = {"PDF": 2, "JSON": 32, "Email": 32, "default": 8}
+DEFAULT_QUEUE_LIMITS = {"PDF": 8, "JSON": 256, "Email": 256, "default": 32}
+
+
+class ExecutorSaturated(Exception):
+    """Raised when the executor refuses new work because a limit has been reached."""
+
+    def __init__(self, message, status_code=503):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class AgentExecutor:
+    def __init__(self, max_workers=8, max_processes=2, max_pending=128,
+                 format_limits=None, queue_limits=None):
+        """
+        Execution layer for agent work:
+        - Blocking agent calls and SharedMemory writes run on a bounded thread pool
+        - CPU heavy work (PDF parsing) runs on a process pool
+        - Per-format concurrency caps, with a bounded number of waiters per format (429 when full)
+        - Global backlog limit on submitted work (503 when full)
+        """
+        self.max_workers = max_workers
+        self.max_processes = max_processes
+        self.max_pending = max_pending
+        self.format_limits = dict(DEFAULT_FORMAT_LIMITS, **(format_limits or {}))
+        self.queue_limits = dict(DEFAULT_QUEUE_LIMITS, **(queue_limits or {}))
+        self._threads = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent")
+        self._processes = None
+        self._semaphores = {}
+        self._waiting = defaultdict(int)
+        self._active = defaultdict(int)
+        self._pending = 0
+
+    def _limit(self, limits, format_):
+        return limits.get(format_, limits["default"])
+
+    def _semaphore(self, format_):
+        if format_ not in self._semaphores:
+            self._semaphores[format_] = asyncio.Semaphore(self._limit(self.format_limits, format_))
+        return self._semaphores[format_]
+
+    @contextlib.asynccontextmanager
+    async def slot(self, format_, bounded=True):
+        """
+        Hold one of the concurrency slots for the given format while processing a request.
+        Raises ExecutorSaturated (429) if too many requests of this format are already waiting,
+        unless bounded is False (callers that limit their own concurrency, like batch intake).
+        """
+        semaphore = self._semaphore(format_)
+        if bounded and semaphore.locked() and self._waiting[format_] >= self._limit(self.queue_limits, format_):
+            raise ExecutorSaturated(f"Too many {format_} requests queued", status_code=429)
+
+        self._waiting[format_] += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self._waiting[format_] -= 1
+
+        self._active[format_] += 1
+        try:
+            yield
+        finally:
+            self._active[format_] -= 1
+            semaphore.release()
+
+    async def _submit(self, pool, fn, *args, **kwargs):
+        if self._pending >= self.max_pending:
+            raise ExecutorSaturated("Agent executor backlog is full", status_code=503)
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(pool, functools.partial(fn, *args, **kwargs))
+        finally:
+            self._pending -= 1
+
+    async def run(self, fn, *args, **kwargs):
+        """Run a blocking callable on the thread pool, with the caller's context variables."""
+        context = contextvars.copy_context()
+        return await self._submit(self._threads, context.run, fn, *args, **kwargs)
+
+    async def run_cpu(self, fn, *args, **kwargs):
+        """
+        Run a CPU bound callable on the process pool.
+        The callable and its arguments must be picklable (module-level functions, bytes, dicts).
+        Falls back to the thread pool when max_processes is 0.
+        A worker that dies (OOM kill, crash) breaks the pool: the calls it was running fail
+        with BrokenProcessPool and the next call starts a new pool.
+        """
+        if not self.max_processes:
+            return await self.run(fn, *args, **kwargs)
+        if self._processes is None:
+            self._processes = ProcessPoolExecutor(
+                max_workers=self.max_processes,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        pool = self._processes
+        try:
+            return await self._submit(pool, fn, *args, **kwargs)
+        except BrokenProcessPool:
+            # Concurrent calls fail together; only the first one replaces the pool
+            if self._processes is pool:
+                print("Warning: Process pool broke, starting a new one")
+                self._processes = None
+                pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    def stats(self):
+        return {
+            "pending": self._pending,
+            "active": dict(self._active),
+            "waiting": dict(self._waiting)
+        }
+
+    def shutdown(self, wait=True):
+        self._threads.shutdown(wait=wait)
+        if self._processes is not None:
+            self._processes.shutdown(wait=wait)
+            self._processes = None
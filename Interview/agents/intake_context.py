@@ -0,0 +1,282 @@
+import os
+import json
+import hashlib
+import tempfile
+from functools import cached_property
+
+_NOT_PARSED = object()
+_decoder = json.JSONDecoder()
+
+# Characters a JSON value can start with
+_JSON_VALUE_STARTS = set('{["-0123456789tfn')
+
+# Bytes read from the start of an input to sniff its format
+SNIFF_BYTES = 4096
+CHUNK_BYTES = 1024 * 1024
+
+
+class InputTooLarge(ValueError):
+    """Raised when an upload exceeds the configured maximum size."""
+
+
+class IntakeContext:
+    def __init__(self, raw_input, format_=None, json_data=_NOT_PARSED, path=None, size=None):
+        """
+        Single-pass view of one intake input, built once per request and shared by every agent:
+        - raw: the original bytes or str, or None for a file-backed input (see from_stream)
+        - prefix / prefix_text: the first SNIFF_BYTES, enough to sniff the format
+        - text / text_lower: decoded and lowercased text, computed on first use
+        - message_text_lower: for MIME inputs, the first message's decoded text, lowercased
+        - json_data: the parsed JSON document (only parsed once, see is_json)
+        - format: the sniffed format, filled in by the ClassifierAgent
+        json_data can be passed when the caller already parsed raw_input.
+        """
+        self.raw = raw_input
+        self.path = path
+        self.size = size if size is not None else (len(raw_input) if raw_input is not None else None)
+        self.format = format_
+        self.is_utf8 = True
+        self.json_error = None
+        self._json_data = json_data
+        self._rule_engine = None
+        self._rule_matches = None
+        self._fd = None
+
+    @classmethod
+    def wrap(cls, raw_input):
+        """Return raw_input unchanged if it already is a context, otherwise build one."""
+        if isinstance(raw_input, cls):
+            return raw_input
+        return cls(raw_input)
+
+    @classmethod
+    def from_stream(cls, stream, max_bytes=None, memory_bytes=CHUNK_BYTES):
+        """
+        Read an upload in chunks: inputs up to memory_bytes stay in memory, larger ones
+        are spooled to a named temp file (removed by close()) so memory use stays constant
+        and PDF workers can open it by path. An upload already spooled to disk is used in
+        place instead, see _from_disk. Raises InputTooLarge beyond max_bytes.
+        """
+        ctx = cls._from_disk(stream, max_bytes, memory_bytes)
+        if ctx is not None:
+            return ctx
+        head = stream.read(memory_bytes + 1)
+        if max_bytes is not None and len(head) > max_bytes:
+            raise InputTooLarge(f"Upload exceeds {max_bytes} bytes")
+        if len(head) <= memory_bytes:
+            return cls(head)
+
+        target = tempfile.NamedTemporaryFile(prefix="intake-", suffix=".upload", delete=False)
+        try:
+            size = 0
+            chunk = head
+            while chunk:
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise InputTooLarge(f"Upload exceeds {max_bytes} bytes")
+                target.write(chunk)
+                chunk = stream.read(CHUNK_BYTES)
+            target.close()
+        except BaseException:
+            target.close()
+            os.remove(target.name)
+            raise
+        return cls(None, path=target.name, size=size)
+
+    @classmethod
+    def _from_disk(cls, stream, max_bytes, memory_bytes):
+        """
+        Take over the file behind stream instead of copying it, e.g. the temp file a
+        SpooledTemporaryFile (Starlette's UploadFile.file) rolled over to:
+        - That file has no name, so a duplicate descriptor keeps it alive after the upload
+          is closed, and it is opened by its /proc path, also from PDF worker processes
+        - Returns None for in-memory streams, small inputs and without /proc; the stream is
+          then read as usual
+        """
+        if not getattr(stream, "_rolled", True):
+            return None
+        try:
+            if stream.tell() != 0:
+                return None
+            stream.flush()
+            fd = os.dup(stream.fileno())
+        except (AttributeError, OSError, ValueError):
+            return None
+        path = f"/proc/{os.getpid()}/fd/{fd}"
+        size = os.fstat(fd).st_size
+        if max_bytes is not None and size > max_bytes:
+            os.close(fd)
+            raise InputTooLarge(f"Upload exceeds {max_bytes} bytes")
+        if size <= memory_bytes or not os.path.exists(path):
+            os.close(fd)
+            return None
+        ctx = cls(None, path=path, size=size)
+        ctx._fd = fd
+        return ctx
+
+    def close(self):
+        """Remove the spooled temp file of a file-backed input (or release the upload's file)."""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+            self.path = None
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except OSError as e:
+                print(f"Warning: Failed to remove spooled upload: {e}")
+            self.path = None
+
+    @cached_property
+    def raw_bytes(self):
+        if self.path is not None:
+            with open(self.path, 'rb') as f:
+                return f.read()
+        if isinstance(self.raw, bytes):
+            return self.raw
+        return self.raw.encode('utf-8')
+
+    @cached_property
+    def prefix(self):
+        if self.path is not None:
+            with open(self.path, 'rb') as f:
+                return f.read(SNIFF_BYTES)
+        if isinstance(self.raw, bytes):
+            return self.raw[:SNIFF_BYTES]
+        return self.raw[:SNIFF_BYTES].encode('utf-8')
+
+    @cached_property
+    def prefix_text(self):
+        if isinstance(self.raw, str):
+            return self.raw[:SNIFF_BYTES]
+        return self.prefix.decode('utf-8', errors='ignore')
+
+    @property
+    def looks_like_pdf(self):
+        # Text fields are never PDFs, only uploaded bytes
+        return not isinstance(self.raw, str) and self.prefix.startswith(b'%PDF')
+
+    @property
+    def looks_like_json(self):
+        return self.prefix_text.lstrip('\ufeff \t\r\n')[:1] in ('{', '[')
+
+    @cached_property
+    def head_text(self):
+        """The first CHUNK_BYTES decoded, enough to hold the first record of a record stream."""
+        if isinstance(self.raw, str):
+            return self.raw[:CHUNK_BYTES]
+        if self.path is not None:
+            with open(self.path, 'rb') as f:
+                head = f.read(CHUNK_BYTES)
+        else:
+            head = self.raw[:CHUNK_BYTES]
+        return head.decode('utf-8', errors='ignore')
+
+    @property
+    def looks_like_record_stream(self):
+        """
+        A top-level JSON array, or NDJSON (one JSON object per line), processed record by record.
+        The first element (or line) must decode as JSON, so text that merely starts with a
+        bracket ("[External] Subject: ...") is not taken for one.
+        """
+        if self.prefix_text.lstrip('\ufeff \t\r\n')[:1] not in ('[', '{'):
+            return False
+        text = self.head_text.lstrip('\ufeff \t\r\n')
+        if text.startswith('['):
+            pos = len(text) - len(text[1:].lstrip(' \t\r\n'))
+            if text[pos:pos + 1] == ']':
+                return True
+            try:
+                _decoder.raw_decode(text, pos)
+                return True
+            except ValueError:
+                # A first element too large for the head is judged by how it starts
+                truncated = self.size is not None and self.size > CHUNK_BYTES
+                return truncated and text[pos:pos + 1] in _JSON_VALUE_STARTS
+        first, _, rest = text.partition('\n')
+        if not first.startswith('{') or not rest.lstrip('\r\n').startswith('{'):
+            return False
+        try:
+            return isinstance(json.loads(first), dict)
+        except ValueError:
+            return False
+
+    @property
+    def looks_like_email(self):
+        return "From:" in self.prefix_text or "Subject:" in self.prefix_text
+
+    @property
+    def looks_like_mime(self):
+        """A raw RFC 822 message with MIME headers, or an mbox bundle of messages."""
+        if self.prefix_text.startswith("From "):
+            return True
+        header = "\n" + self.prefix_text.replace("\r\n", "\n").split("\n\n", 1)[0].lower()
+        return "\nmime-version:" in header or "\ncontent-type:" in header
+
+    @property
+    def pdf_source(self):
+        """What the PDF extractor opens: the spooled file's path, or the bytes themselves."""
+        return self.path if self.path is not None else self.raw_bytes
+
+    @cached_property
+    def sha256(self):
+        if self.path is None:
+            return hashlib.sha256(self.raw_bytes).hexdigest()
+        digest = hashlib.sha256()
+        with open(self.path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_BYTES), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @cached_property
+    def text(self):
+        if isinstance(self.raw, str):
+            return self.raw
+        try:
+            return self.raw_bytes.decode('utf-8')
+        except UnicodeDecodeError:
+            self.is_utf8 = False
+            return self.raw_bytes.decode('utf-8', errors='ignore')
+
+    @cached_property
+    def text_lower(self):
+        return self.text.lower()
+
+    @cached_property
+    def message_text_lower(self):
+        """
+        Lowercased headers and decoded body of the first message of a MIME input, what its
+        intent and urgency are matched against (see mime_email.first_message_text).
+        """
+        from agents.mime_email import first_message_text
+        return first_message_text(self).lower()
+
+    def _parse_json(self):
+        if self._json_data is not _NOT_PARSED:
+            return
+        self._json_data = None
+        text = self.text
+        if not self.is_utf8:
+            self.json_error = "Input is not valid UTF-8"
+            return
+        try:
+            self._json_data = json.loads(text)
+        except (ValueError, RecursionError) as e:
+            self.json_error = str(e)
+
+    @property
+    def is_json(self):
+        self._parse_json()
+        return self.json_error is None
+
+    @property
+    def json_data(self):
+        self._parse_json()
+        return self._json_data
+
+    def rule_matches(self, engine):
+        """Scan the lowercased text with a RuleEngine once; every agent reuses the matched labels."""
+        if self._rule_engine is not engine:
+            self._rule_matches = engine.match(self.text_lower)
+            self._rule_engine = engine
+        return self._rule_matches
@@ -0,0 +1,232 @@
+import os
+import time
+import uuid
+import socket
+import asyncio
+import itertools
+from datetime import datetime
+from agents.executor import ExecutorSaturated
+from tracing import activate, deactivate, current_trace
+
+# Job priorities, most urgent first
+PRIORITIES = ("urgent", "normal", "bulk")
+
+# Statuses run_job answers with when the executor is saturated (see ExecutorSaturated)
+SATURATED_STATUSES = (429, 503)
+
+
+def job_priority(format_, intent, urgency=None):
+    """
+    Scheduling class of a classified document:
+    - urgent: complaints, and emails with High urgency
+    - bulk: Invoice and General traffic
+    - normal: everything else (RFQ, Regulation)
+    """
+    if intent == "Complaint" or (format_ == "Email" and urgency == "High"):
+        return "urgent"
+    if intent in ("Invoice", "General"):
+        return "bulk"
+    return "normal"
+
+
+class JobQueue:
+    def __init__(self, memory, run_job, workers=4, max_queued=1000, ttl=3600, tracer=None, stale_after=86400,
+                 retry_delay=0.5, max_retry_delay=30):
+        """
+        Asynchronous intake jobs:
+        - submit() queues a classified document and returns its job right away
+        - workers (asyncio tasks) take the most urgent job first, oldest first within a
+          priority, and call run_job(ctx, classification) -> (status_code, content)
+        - a job refused because the executor is saturated (429/503) is not failed: it is
+          queued again at its priority and place after retry_delay seconds, doubling per
+          refusal up to max_retry_delay; only processing errors fail a job
+        - job records are stored in SharedMemory so any app process can answer a status
+          query; this process's live jobs are answered from memory
+        - finished jobs are pruned after ttl seconds; queued or running ones not updated for
+          stale_after seconds were left by a process that died and are pruned too
+        - job records carry their owner (host and pid), so recover() can fail the jobs of
+          processes on this host that are gone
+        - a job keeps the trace id of the request that submitted it; with a tracer, each run
+          is traced as a "job" segment of that trace, stored if the request's trace was sampled
+        """
+        self.memory = memory
+        self.run_job = run_job
+        self.workers = workers
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self.tracer = tracer
+        self.stale_after = stale_after
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.hostname = socket.gethostname()
+        self.owner = f"{self.hostname}:{os.getpid()}"
+        self._queue = None
+        self._tasks = []
+        self._jobs = {}
+        self._sequence = itertools.count()
+        self._last_prune = 0
+
+    def start(self):
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Jobs that never ran are reported as failed rather than left queued forever
+        for job in list(self._jobs.values()):
+            job["ctx"].close()
+            await self._finish(job, "failed", error="Server shut down before the job finished")
+
+    def recover(self):
+        """
+        Mark the jobs a dead process on this host left queued or running as failed, instead
+        of reporting them queued forever; call once at startup, before taking jobs.
+        """
+        count = self.memory.fail_abandoned_jobs(self._abandoned, "Server stopped before the job finished")
+        if count:
+            print(f"Warning: Marked {count} unfinished jobs of stopped processes as failed")
+        return count
+
+    def _abandoned(self, owner):
+        if not owner:
+            # Stored before jobs recorded their owner
+            return True
+        host, _, pid = owner.rpartition(":")
+        if host != self.hostname:
+            # Can't tell from here; pruned once stale
+            return False
+        if not pid.isdigit() or int(pid) == os.getpid():
+            # A previous run with the same pid (e.g. pid 1 in a container)
+            return True
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            # Alive, under another user
+            return False
+        return False
+
+    async def submit(self, ctx, classification, priority):
+        """Queue a job; raises ExecutorSaturated (429) when max_queued jobs are already waiting."""
+        if self._queue.qsize() >= self.max_queued:
+            raise ExecutorSaturated("Job queue is full", status_code=429)
+        now = datetime.utcnow().isoformat()
+        trace = current_trace()
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "status": "queued",
+            "priority": priority,
+            "classification": dict(classification),
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+            "trace_id": trace.trace_id if trace is not None else None,
+            "ctx": ctx,
+            "sampled": trace is not None and trace.sampled,
+            "retries": 0
+        }
+        self._jobs[job["job_id"]] = job
+        await self._store(job)
+        self._queue.put_nowait((PRIORITIES.index(priority), next(self._sequence), job["job_id"]))
+        return self._record(job)
+
+    def get(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return self._record(job)
+        return self.memory.get_job(job_id)
+
+    def stats(self):
+        """Queued and running jobs of this process by priority."""
+        counts = {}
+        for job in list(self._jobs.values()):
+            key = (job["status"], job["priority"])
+            counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def _record(self, job):
+        return {key: value for key, value in job.items() if key not in ("ctx", "sampled", "retries")}
+
+    async def _store(self, job):
+        # SharedMemory calls stay off the event loop
+        try:
+            await asyncio.to_thread(self.memory.put_job, self._record(job), self.owner)
+        except Exception as e:
+            print(f"Warning: Failed to store job {job['job_id']}: {e}")
+
+    async def _finish(self, job, status, result=None, error=None):
+        job.update(status=status, result=result, error=error, updated_at=datetime.utcnow().isoformat())
+        await self._store(job)
+        self._jobs.pop(job["job_id"], None)
+
+    async def _requeue(self, job, entry):
+        """Put a job refused by a saturated executor back in the queue after a backoff delay."""
+        delay = min(self.retry_delay * 2 ** job["retries"], self.max_retry_delay)
+        job["retries"] += 1
+        job.update(status="queued", updated_at=datetime.utcnow().isoformat())
+        await self._store(job)
+        asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, entry)
+
+    async def _worker(self):
+        while True:
+            entry = await self._queue.get()
+            job_id = entry[2]
+            job = self._jobs.get(job_id)
+            if job is None:
+                continue
+            job.update(status="running", updated_at=datetime.utcnow().isoformat())
+            await self._store(job)
+            trace = token = None
+            if self.tracer is not None and job["trace_id"] is not None:
+                trace = self.tracer.start("job", job["trace_id"], sampled=job["sampled"])
+                token = activate(trace)
+            status_code = 500
+            requeued = False
+            try:
+                try:
+                    status_code, content = await self.run_job(job["ctx"], job["classification"])
+                except ExecutorSaturated as e:
+                    status_code, content = e.status_code, {"error": str(e)}
+                if status_code == 200:
+                    await self._finish(job, "done", result=content)
+                elif status_code in SATURATED_STATUSES:
+                    await self._requeue(job, entry)
+                    requeued = True
+                else:
+                    await self._finish(job, "failed", error=content.get("error", f"Status {status_code}"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Warning: Job {job_id} failed: {e}")
+                await self._finish(job, "failed", error=str(e))
+            finally:
+                # A requeued job keeps its input for the next run
+                if not requeued:
+                    job["ctx"].close()
+                if trace is not None:
+                    deactivate(token)
+                    await self._store_trace(trace, status_code)
+            await self._prune()
+
+    async def _store_trace(self, trace, status_code):
+        trace.finish(status_code)
+        if not self.tracer.should_store(trace):
+            return
+        try:
+            await asyncio.to_thread(self.tracer.store, trace)
+        except Exception as e:
+            print(f"Warning: Failed to store trace {trace.trace_id}: {e}")
+
+    async def _prune(self):
+        # At most once a minute
+        now = time.time()
+        if now - self._last_prune >= 60:
+            self._last_prune = now
+            cutoff = datetime.utcfromtimestamp(now - self.ttl).isoformat()
+            stale = datetime.utcfromtimestamp(now - self.stale_after).isoformat() if self.stale_after else None
+            await asyncio.to_thread(self.memory.prune_jobs, cutoff, stale)
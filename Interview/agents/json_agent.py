@@ -1,31 +1,81 @@
-import json
 from datetime import datetime
+from agents.intake_context import IntakeContext
+from agents.json_stream import iter_records
 
 class JSONAgent:
-    def __init__(self, memory):
+    def __init__(self, memory, action_router=None, stream_batch_size=500):
+        """
+        stream_batch_size: records of a JSON array / NDJSON body stored per transaction,
+        each batch with at most one aggregated risk alert.
+        """
         self.memory = memory
+        self.action_router = action_router
+        self.stream_batch_size = stream_batch_size
 
-    def process(self, raw_json):
+    def process(self, raw_json, parent=None):
         """
         Process arbitrary JSON input:
-        - Parse JSON
+        - Parse JSON (reusing the IntakeContext parse when given one)
         - Reformat to FlowBit schema (dummy example)
         - Identify anomalies or missing fields
         - Log alert in memory if anomalies detected
+        - Trigger a risk alert through the action router if anomalies detected
+        A top-level array or an NDJSON body is processed record by record (see process_stream).
+        parent links the stored row to the email the JSON was attached to ({"message_id", "filename"}).
         """
+        if not isinstance(raw_json, (str, bytes, IntakeContext)):
+            return {"error": "Invalid input type", "details": f"Expected str or bytes, got {type(raw_json)}"}
+        ctx = IntakeContext.wrap(raw_json)
+        if ctx.looks_like_record_stream:
+            return self.process_stream(ctx, parent=parent)
+        if not ctx.is_json:
+            if not ctx.is_utf8:
+                return {"error": "Invalid encoding", "details": ctx.json_error}
+            return {"error": "Invalid JSON format", "details": ctx.json_error}
+
+        flowbit_schema, anomalies = self.map_record(ctx.json_data)
+
+        # Store extracted fields in shared memory
         try:
-            if isinstance(raw_json, str):
-                data = json.loads(raw_json)
-            elif isinstance(raw_json, bytes):
-                data = json.loads(raw_json.decode('utf-8'))
-            else:
-                return {"error": "Invalid input type", "details": f"Expected str or bytes, got {type(raw_json)}"}
-        except json.JSONDecodeError as e:
-            return {"error": "Invalid JSON format", "details": str(e)}
-        except UnicodeDecodeError as e:
-            return {"error": "Invalid encoding", "details": str(e)}
+            self.memory.add_extracted_fields("JSONAgent", dict(flowbit_schema, parent=parent) if parent else flowbit_schema)
         except Exception as e:
-            return {"error": "Unexpected error parsing JSON", "details": str(e)}
+            # Log error but continue processing
+            print(f"Warning: Failed to store extracted fields: {e}")
+
+        # Log alert if anomalies detected
+        if anomalies:
+            actions = self.follow_up_actions({"anomalies": anomalies})
+            risk_alert = actions[0][1]
+            timestamp = risk_alert["timestamp"]
+            durable = self.action_router is not None and self.action_router.outbox
+            try:
+                alert = {
+                    "alert_type": "JSON Anomaly",
+                    "details": anomalies,
+                    "timestamp": timestamp
+                }
+                self.memory.add_extracted_fields("JSONAgent_Alert", alert,
+                                                 actions=actions if durable else None,
+                                                 on_commit=self.action_router.notify if durable else None)
+            except Exception as e:
+                # Log error but continue processing
+                print(f"Warning: Failed to store alert: {e}")
+
+            if self.action_router and not durable:
+                try:
+                    self.action_router.trigger_action("risk_alert", risk_alert)
+                except Exception as e:
+                    print(f"Warning: Failed to trigger risk alert: {e}")
+
+        return {
+            "flowbit_schema": flowbit_schema,
+            "anomalies": anomalies
+        }
+
+    def map_record(self, data):
+        """Map one JSON document to the FlowBit schema; returns (flowbit_schema, anomalies)."""
+        if not isinstance(data, dict):
+            return {"id": None, "type": None, "attributes": {}}, [f"Expected a JSON object, got {type(data).__name__}"]
 
         # Dummy FlowBit schema example: expecting keys 'id', 'type', 'attributes'
         flowbit_schema = {
@@ -42,28 +92,87 @@ class JSONAgent:
         anomalies = []
         if missing_fields:
             anomalies.append(f"Missing fields: {', '.join(missing_fields)}")
+        return flowbit_schema, anomalies
 
-        # Store extracted fields in shared memory
+    def process_stream(self, raw_json, parent=None):
+        """
+        Process a top-level JSON array or an NDJSON body (e.g. a webhook delivery of many events):
+        - records are parsed incrementally and mapped to the FlowBit schema one at a time
+        - every stream_batch_size records, their rows and one JSON Anomaly alert covering the
+          batch's anomalous records are stored in a single transaction
+        - each batch with anomalies triggers one aggregated risk alert, not one per record
+        Returns counts and the batch alerts rather than every mapped record.
+        """
+        records = 0
+        anomalous_records = 0
+        alerts = []
+        batch = []
+        batch_anomalies = []
+        first = 0
+
+        for index, data, error in iter_records(raw_json):
+            if error is not None:
+                anomalies = [f"Invalid record: {error}"]
+            else:
+                flowbit_schema, anomalies = self.map_record(data)
+                row = dict(flowbit_schema, record=index)
+                batch.append(dict(row, parent=parent) if parent else row)
+            records += 1
+            if anomalies:
+                anomalous_records += 1
+                batch_anomalies.append(f"Record {index}: {'; '.join(anomalies)}")
+            if records - first >= self.stream_batch_size:
+                alerts.extend(self._store_batch(batch, batch_anomalies, first, index))
+                batch, batch_anomalies, first = [], [], records
+        if records > first:
+            alerts.extend(self._store_batch(batch, batch_anomalies, first, records - 1))
+
+        return {
+            "records": records,
+            "batches": (records + self.stream_batch_size - 1) // self.stream_batch_size,
+            "anomalous_records": anomalous_records,
+            "alerts": alerts
+        }
+
+    def _store_batch(self, rows, anomalies, first, last):
+        """Store one batch of stream rows with its aggregated alert; returns the alerts raised (zero or one)."""
+        alerts = []
+        actions = []
+        if anomalies:
+            alerts = [{"records": [first, last], "details": anomalies}]
+            actions = self.follow_up_actions({"alerts": alerts})
+        durable = self.action_router is not None and self.action_router.outbox
+        stored = [("JSONAgent", row) for row in rows]
+        if alerts:
+            stored.append(("JSONAgent_Alert", {
+                "alert_type": "JSON Anomaly",
+                "records": [first, last],
+                "details": anomalies,
+                "timestamp": actions[0][1]["timestamp"]
+            }))
         try:
-            self.memory.add_extracted_fields("JSONAgent", flowbit_schema)
+            self.memory.add_extracted_fields_batch(stored, actions=actions if durable else None,
+                                                   on_commit=self.action_router.notify if durable and actions else None)
         except Exception as e:
-            # Log error but continue processing
-            print(f"Warning: Failed to store extracted fields: {e}")
+            # Log error but continue with the next batch
+            print(f"Warning: Failed to store records {first}-{last}: {e}")
 
-        # Log alert if anomalies detected
-        if anomalies:
+        if actions and self.action_router and not durable:
             try:
-                alert = {
-                    "alert_type": "JSON Anomaly",
-                    "details": anomalies,
-                    "timestamp": datetime.utcnow().isoformat()
-                }
-                self.memory.add_extracted_fields("JSONAgent_Alert", alert)
+                self.action_router.trigger_action(*actions[0])
             except Exception as e:
-                # Log error but continue processing
-                print(f"Warning: Failed to store alert: {e}")
+                print(f"Warning: Failed to trigger risk alert: {e}")
+        return alerts
 
-        return {
-            "flowbit_schema": flowbit_schema,
-            "anomalies": anomalies
-        }
+    def follow_up_actions(self, result):
+        """
+        Return the (action_type, payload) pairs a processing result should trigger:
+        one risk alert for a document with anomalies, one per alerted batch of a record stream.
+        """
+        timestamp = datetime.utcnow().isoformat()
+        if "alerts" in result:
+            return [("risk_alert", {"details": alert["details"], "records": alert["records"], "timestamp": timestamp})
+                    for alert in result["alerts"]]
+        if not result.get("anomalies"):
+            return []
+        return [("risk_alert", {"details": result["anomalies"], "timestamp": timestamp})]
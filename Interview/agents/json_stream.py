@@ -0,0 +1,112 @@
+import io
+import json
+import codecs
+from agents.intake_context import IntakeContext, CHUNK_BYTES
+
+_WHITESPACE = " \t\r\n"
+_decoder = json.JSONDecoder()
+
+
+def _skip_whitespace(buffer, pos):
+    while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+        pos += 1
+    return pos
+
+
+def _iter_array(stream, chunk_bytes):
+    """Elements of a top-level JSON array, decoded one at a time from a sliding text buffer."""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    buffer, pos, eof = "", 0, False
+    index = 0
+
+    def read_more():
+        nonlocal buffer, pos, eof
+        chunk = stream.read(chunk_bytes)
+        eof = not chunk
+        # Drop what has been consumed so the buffer only holds the current element
+        buffer = buffer[pos:] + decoder.decode(chunk, final=eof)
+        pos = 0
+
+    try:
+        read_more()
+        pos = _skip_whitespace(buffer, pos)
+        if buffer[pos:pos + 1] != "[":
+            yield 0, None, "Expected a JSON array"
+            return
+        pos += 1
+        # What may come next: "first" (a value or the closing bracket), "value" or "separator"
+        state = "first"
+        while True:
+            pos = _skip_whitespace(buffer, pos)
+            if pos >= len(buffer):
+                if eof:
+                    yield index, None, "Unterminated JSON array"
+                    return
+                read_more()
+                continue
+            char = buffer[pos]
+            if state != "value" and char == "]":
+                return
+            if state == "separator":
+                if char != ",":
+                    yield index, None, f"Expected ',' or ']' after array element {index - 1}"
+                    return
+                pos += 1
+                state = "value"
+                continue
+            try:
+                value, end = _decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                if eof:
+                    yield index, None, str(e)
+                    return
+                # The element may continue in the next chunk
+                read_more()
+                continue
+            # A number or literal ending at the buffer edge may continue in the next chunk
+            if end >= len(buffer) and not eof:
+                read_more()
+                continue
+            yield index, value, None
+            index += 1
+            pos = end
+            state = "separator"
+    except UnicodeDecodeError:
+        yield index, None, "Input is not valid UTF-8"
+    except RecursionError as e:
+        yield index, None, str(e)
+
+
+def _iter_lines(stream):
+    """One JSON document per non-empty line; a bad line is reported and skipped."""
+    index = 0
+    for line_number, line in enumerate(stream, 1):
+        if line_number == 1 and line.startswith(codecs.BOM_UTF8):
+            line = line[len(codecs.BOM_UTF8):]
+        if not line.strip():
+            continue
+        try:
+            yield index, json.loads(line.decode('utf-8')), None
+        except UnicodeDecodeError:
+            yield index, None, f"Line {line_number} is not valid UTF-8"
+        except (ValueError, RecursionError) as e:
+            yield index, None, f"Invalid JSON on line {line_number}: {e}"
+        index += 1
+
+
+def iter_records(source, chunk_bytes=CHUNK_BYTES):
+    """
+    Records of a top-level JSON array or an NDJSON body, parsed incrementally as
+    (index, record, error) tuples; record is None when error is set:
+    - arrays are decoded one element at a time, so the full document tree is never
+      built; a malformed element ends the stream since the rest can't be located
+    - NDJSON is decoded line by line and a malformed line doesn't stop the others
+    A spooled upload is read from its file, so the body is never held in memory whole.
+    """
+    ctx = IntakeContext.wrap(source)
+    stream = open(ctx.path, 'rb') if ctx.path is not None else io.BytesIO(ctx.raw_bytes)
+    with stream:
+        if ctx.prefix_text.lstrip('\ufeff \t\r\n').startswith('['):
+            yield from _iter_array(stream, chunk_bytes)
+        else:
+            yield from _iter_lines(stream)
@@ -0,0 +1,162 @@
+import io
+import re
+import hashlib
+from html.parser import HTMLParser
+from email import policy
+from email.parser import BytesFeedParser
+from agents.intake_context import IntakeContext, CHUNK_BYTES
+
+# Headers kept in the text the email rules run over; everything else is structure
+RULE_HEADERS = ("From", "Subject", "Conversation-ID")
+
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+
+class _TextExtractor(HTMLParser):
+    BLOCK_TAGS = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "table"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self._skip += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style") and self._skip:
+            self._skip -= 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+
+def html_to_text(html):
+    """Visible text of an HTML body, one line per block element; scripts and styles are dropped."""
+    extractor = _TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return _BLANK_LINES.sub("\n\n", "".join(extractor.parts)).strip()
+
+
+def attachment_format(filename, content_type, payload):
+    """Agent format of an attachment ("PDF" or "JSON"), or None for attachments no agent handles."""
+    name = (filename or "").lower()
+    if content_type == "application/pdf" or name.endswith(".pdf") or payload.startswith(b"%PDF"):
+        return "PDF"
+    if content_type in ("application/json", "text/json") or name.endswith(".json"):
+        return "JSON"
+    return None
+
+
+def _part_text(part):
+    try:
+        return part.get_content()
+    except (LookupError, UnicodeError):
+        # Unknown or wrong charset
+        return (part.get_payload(decode=True) or b"").decode('utf-8', errors='ignore')
+
+
+def _text_parts(message):
+    """The rule header lines and the decoded text/plain body (or the HTML body as text)."""
+    lines = [f"{name}: {message[name]}" for name in RULE_HEADERS if message[name]]
+    body = message.get_body(preferencelist=("plain", "html"))
+    body_text = ""
+    if body is not None:
+        body_text = _part_text(body)
+        if body.get_content_type() == "text/html":
+            body_text = html_to_text(body_text)
+    return lines, body_text
+
+
+def _parse(message):
+    """
+    Split a parsed message into what the agents need:
+    - text: the rule headers plus the text/plain body (or the HTML body as text); attachments
+      are never part of it, so base64 payloads aren't scanned by the email rules
+    - attachments: decoded payloads with their filename, content type and agent format
+    """
+    lines, body_text = _text_parts(message)
+
+    attachments = []
+    for part in message.iter_attachments():
+        payload = part.get_payload(decode=True) or b""
+        filename = part.get_filename()
+        content_type = part.get_content_type()
+        attachments.append({
+            "filename": filename,
+            "content_type": content_type,
+            "format": attachment_format(filename, content_type, payload),
+            "size": len(payload),
+            "sha256": hashlib.sha256(payload).hexdigest(),
+            "payload": payload
+        })
+
+    message_id = message["Message-ID"]
+    if not message_id:
+        # Stable id for messages without one, so attachments can still be linked to them
+        message_id = "<" + hashlib.sha256("\n".join(lines).encode('utf-8') + body_text.encode('utf-8')).hexdigest()[:32] + "@intake>"
+    return {
+        "message_id": str(message_id).strip(),
+        "text": "\n".join(lines) + "\n\n" + body_text,
+        "attachments": attachments
+    }
+
+
+def _iter_parsed(ctx, max_bytes=None):
+    """
+    Yield the email.message objects of an RFC 822 message or mbox bundle, one at a time.
+    With max_bytes only the start of the first message is parsed; a message cut short
+    still has its headers and whatever body parts came before the cut.
+    """
+    stream = open(ctx.path, 'rb') if ctx.path is not None else io.BytesIO(ctx.raw_bytes)
+    with stream:
+        is_mbox = ctx.prefix.startswith(b"From ")
+        parser = None
+        previous_blank = True
+        fed = 0
+        for line in stream:
+            if is_mbox and previous_blank and line.startswith(b"From "):
+                if parser is not None:
+                    yield parser.close()
+                parser = BytesFeedParser(policy=policy.default)
+                previous_blank = False
+                continue
+            if parser is None:
+                parser = BytesFeedParser(policy=policy.default)
+            parser.feed(line)
+            previous_blank = line in (b"\n", b"\r\n")
+            fed += len(line)
+            if max_bytes is not None and fed >= max_bytes:
+                break
+        if parser is not None:
+            yield parser.close()
+
+
+def iter_messages(source):
+    """
+    Parse an RFC 822 message or an mbox bundle (messages separated by "From " lines) from
+    an IntakeContext, bytes or str, one line at a time, yielding each message as
+    {"message_id", "text", "attachments"} once it is complete. A spooled upload is read
+    from its file, so a bundle is never held in memory whole.
+    """
+    for message in _iter_parsed(IntakeContext.wrap(source)):
+        yield _parse(message)
+
+
+def first_message_text(source, max_bytes=CHUNK_BYTES):
+    """
+    The text the email rules run over (rule headers and decoded body) of the first message,
+    for classifying a MIME input: the body is decoded from its transfer encoding, and
+    attachments are neither part of it nor decoded. Only the first max_bytes are parsed.
+    """
+    for message in _iter_parsed(IntakeContext.wrap(source), max_bytes):
+        lines, body_text = _text_parts(message)
+        return "\n".join(lines) + "\n\n" + body_text
+    return ""
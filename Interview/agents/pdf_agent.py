@@ -1,78 +1,245 @@
 import io
 import re
+import time
+import asyncio
 from pypdf import PdfReader
+from agents.intake_context import IntakeContext
+from agents.executor import ExecutorSaturated
+from agents.rule_engine import RuleEngine
 
-class PDFAgent:
-    def __init__(self, memory):
-        self.memory = memory
+# Parse invoice line items (dummy example: look for lines with item, qty, price)
+INVOICE_PATTERN = re.compile(r"(?P<item>\w+)\s+(?P<qty>\d+)\s+\$?(?P<price>[\d,.]+)")
+HIGH_INVOICE_TOTAL = 10000
 
-    def process(self, pdf_bytes):
-        """
-        Enhanced PDF processing:
-        - Extract text from PDF bytes
-        - Parse line-item invoice data (simple regex-based)
-        - Detect invoice total and flag if > 10,000
-        - Detect policy mentions like GDPR, FDA and flag compliance risk
-        - Return extracted data and flags
-        """
-        try:
-            reader = PdfReader(io.BytesIO(pdf_bytes))
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text() or ""
-        except Exception as e:
-            return {"error": "Failed to process PDF", "details": str(e)}
-
-        # Parse invoice line items (dummy example: look for lines with item, qty, price)
-        invoice_lines = []
-        invoice_total = 0.0
-        invoice_pattern = re.compile(r"(?P<item>\w+)\s+(?P<qty>\d+)\s+\$?(?P<price>[\d,.]+)")
-        
-        # Find all invoice line items
-        for match in invoice_pattern.finditer(text):
+
+def _scan_pages(reader, start, stop, deadline=None, include_text=True, max_text_bytes=None, flags_only=False):
+    """
+    Extract and scan pages [start, stop) one at a time, so invoice lines and policy
+    keywords are found incrementally instead of over one concatenated string.
+    Returns a partial result that _build_result merges.
+    """
+    rule_engine = RuleEngine.default()
+    policy_labels = rule_engine.labels("policy")
+    partial = {
+        "start": start,
+        "pages_scanned": 0,
+        "text_parts": [],
+        "text_bytes": 0,
+        "text_truncated": False,
+        "invoice_lines": [],
+        "invoice_total": 0.0,
+        "policy_flags": [],
+        "truncated": None
+    }
+    for page_number in range(start, stop):
+        if deadline is not None and time.time() >= deadline:
+            partial["truncated"] = "time_budget"
+            break
+
+        text = reader.pages[page_number].extract_text() or ""
+        partial["pages_scanned"] += 1
+
+        if include_text and not partial["text_truncated"]:
+            size = len(text.encode('utf-8'))
+            if max_text_bytes is not None and partial["text_bytes"] + size > max_text_bytes:
+                partial["text_truncated"] = True
+            else:
+                partial["text_parts"].append(text)
+                partial["text_bytes"] += size
+
+        # Find all invoice line items on this page
+        for match in INVOICE_PATTERN.finditer(text):
             try:
                 item = match.group('item')
                 qty = int(match.group('qty'))
                 price_str = match.group('price').replace(',', '')
                 price = float(price_str)
                 line_total = qty * price
-                invoice_lines.append({
+                partial["invoice_lines"].append({
                     'item': item,
                     'quantity': qty,
                     'price': price,
                     'total': line_total
                 })
-                invoice_total += line_total
-            except (ValueError, AttributeError) as e:
+                partial["invoice_total"] += line_total
+            except (ValueError, AttributeError):
                 # Skip invalid line items
                 continue
 
-        # Detect policy mentions
-        policy_flags = []
-        policy_keywords = ["GDPR", "FDA", "HIPAA", "CCPA"]
-        for keyword in policy_keywords:
-            if keyword.lower() in text.lower():
-                policy_flags.append(keyword)
-
-        flags = []
-        if invoice_total > 10000:
-            flags.append("High Invoice Total")
-        if policy_flags:
-            flags.append(f"Policy Mentions: {', '.join(policy_flags)}")
-
-        result = {
-            "extracted_text": text,
-            "num_pages": len(reader.pages),
-            "invoice_lines": invoice_lines,
-            "invoice_total": invoice_total,
-            "policy_flags": policy_flags,
-            "flags": flags
-        }
+        # Detect policy mentions with one rule scan per page
+        for label in rule_engine.match(text.lower())["policy"]:
+            if label not in partial["policy_flags"]:
+                partial["policy_flags"].append(label)
+
+        # Once every flag is raised the remaining pages can't change them
+        if (flags_only and partial["invoice_total"] > HIGH_INVOICE_TOTAL
+                and len(partial["policy_flags"]) == len(policy_labels)):
+            if page_number + 1 < stop:
+                partial["truncated"] = "early_exit"
+            break
+
+    return partial
+
+
+def _build_result(partials, num_pages, include_text=True, max_text_bytes=None):
+    partials = sorted(partials, key=lambda p: p["start"])
+    text_parts = []
+    text_bytes = 0
+    text_truncated = False
+    invoice_lines = []
+    invoice_total = 0.0
+    found = set()
+    truncated = None
+    pages_scanned = 0
+    for partial in partials:
+        pages_scanned += partial["pages_scanned"]
+        invoice_lines.extend(partial["invoice_lines"])
+        invoice_total += partial["invoice_total"]
+        found.update(partial["policy_flags"])
+        truncated = truncated or partial["truncated"]
+        text_truncated = text_truncated or partial["text_truncated"]
+        for text in partial["text_parts"]:
+            size = len(text.encode('utf-8'))
+            if max_text_bytes is not None and text_bytes + size > max_text_bytes:
+                text_truncated = True
+                break
+            text_parts.append(text)
+            text_bytes += size
+    if truncated is None and pages_scanned < num_pages:
+        truncated = "max_pages"
+
+    policy_flags = [label for label in RuleEngine.default().labels("policy") if label in found]
+    flags = []
+    if invoice_total > HIGH_INVOICE_TOTAL:
+        flags.append("High Invoice Total")
+    if policy_flags:
+        flags.append(f"Policy Mentions: {', '.join(policy_flags)}")
+
+    result = {
+        "num_pages": num_pages,
+        "pages_scanned": pages_scanned,
+        "invoice_lines": invoice_lines,
+        "invoice_total": invoice_total,
+        "policy_flags": policy_flags,
+        "flags": flags,
+        "truncated": truncated
+    }
+    if include_text:
+        result["extracted_text"] = "".join(text_parts)
+        result["text_truncated"] = text_truncated
+    return result
+
+
+def _open_pdf(source):
+    """Open a PDF given as bytes or as a file path; a path is read through a file handle, not loaded."""
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    return open(source, 'rb')
+
+
+def extract_pdf(pdf_bytes, max_pages=None, max_seconds=None, max_text_bytes=None,
+                include_text=True, flags_only=False):
+    """
+    Enhanced PDF processing:
+    - Extract text from PDF bytes page by page
+    - Parse line-item invoice data (simple regex-based)
+    - Detect invoice total and flag if > 10,000
+    - Detect policy mentions like GDPR, FDA and flag compliance risk
+    - Return extracted data and flags
+    Budgets: only the first max_pages pages are read, scanning stops after max_seconds,
+    and at most max_text_bytes of text is kept. flags_only stops as soon as every flag
+    is raised; the result's "truncated" says which limit cut the scan short.
+
+    pdf_bytes may also be the path of a spooled upload.
+
+    Module-level and free of shared state so it can run in a worker process.
+    """
+    deadline = time.time() + max_seconds if max_seconds else None
+    try:
+        with _open_pdf(pdf_bytes) as stream:
+            reader = PdfReader(stream)
+            num_pages = len(reader.pages)
+            stop = min(num_pages, max_pages) if max_pages else num_pages
+            partial = _scan_pages(reader, 0, stop, deadline, include_text, max_text_bytes, flags_only)
+    except Exception as e:
+        return {"error": "Failed to process PDF", "details": str(e)}
+    return _build_result([partial], num_pages, include_text, max_text_bytes)
 
+
+def extract_pdf_range(pdf_bytes, start, stop, deadline=None, include_text=True, max_text_bytes=None):
+    """Scan one page range of a PDF; used to split large documents across worker processes."""
+    with _open_pdf(pdf_bytes) as stream:
+        return _scan_pages(PdfReader(stream), start, stop, deadline, include_text, max_text_bytes)
+
+
+def count_pdf_pages(pdf_bytes):
+    with _open_pdf(pdf_bytes) as stream:
+        return len(PdfReader(stream).pages)
+
+
+async def extract_pdf_parallel(executor, pdf_bytes, pages_per_task=50, max_pages=None, max_seconds=None,
+                               max_text_bytes=None, include_text=True, flags_only=False):
+    """
+    Extract a PDF (bytes or a file path) on the executor's process pool. Documents longer
+    than pages_per_task are split into page ranges scanned by separate processes and
+    merged in page order. Workers open a path themselves instead of receiving a copy.
+    """
+    try:
+        num_pages = await executor.run(count_pdf_pages, pdf_bytes)
+    except ExecutorSaturated:
+        raise
+    except Exception as e:
+        return {"error": "Failed to process PDF", "details": str(e)}
+
+    stop = min(num_pages, max_pages) if max_pages else num_pages
+    if stop <= pages_per_task or flags_only:
+        return await executor.run_cpu(extract_pdf, pdf_bytes, max_pages, max_seconds, max_text_bytes,
+                                      include_text, flags_only)
+
+    deadline = time.time() + max_seconds if max_seconds else None
+    try:
+        partials = await asyncio.gather(*[
+            executor.run_cpu(extract_pdf_range, pdf_bytes, start, min(start + pages_per_task, stop),
+                             deadline, include_text, max_text_bytes)
+            for start in range(0, stop, pages_per_task)
+        ])
+    except ExecutorSaturated:
+        raise
+    except Exception as e:
+        return {"error": "Failed to process PDF", "details": str(e)}
+    return _build_result(partials, num_pages, include_text, max_text_bytes)
+
+
+class PDFAgent:
+    def __init__(self, memory):
+        self.memory = memory
+
+    def process(self, pdf_bytes, parent=None, **options):
+        """
+        Extract invoice and policy data from PDF bytes (or an IntakeContext, possibly file-backed)
+        and store it in shared memory.
+        parent links the stored row to the email the PDF was attached to ({"message_id", "filename"}).
+        options are the extract_pdf budgets (max_pages, max_seconds, max_text_bytes, include_text, flags_only).
+        """
+        result = extract_pdf(IntakeContext.wrap(pdf_bytes).pdf_source, **options)
+        if "error" not in result:
+            self.store(result, parent)
+        return result
+
+    async def process_parallel(self, executor, pdf_bytes, parent=None, **options):
+        """
+        Like process, but extracts on the executor's process pool (see extract_pdf_parallel)
+        and stores the result on a pool thread.
+        options are the extract_pdf_parallel budgets (pages_per_task, max_pages, ...).
+        """
+        result = await extract_pdf_parallel(executor, IntakeContext.wrap(pdf_bytes).pdf_source, **options)
+        if "error" not in result:
+            await executor.run(self.store, result, parent)
+        return result
+
+    def store(self, result, parent=None):
         # Store extracted fields in shared memory
         try:
-            self.memory.add_extracted_fields("PDFAgent", result)
+            self.memory.add_extracted_fields("PDFAgent", dict(result, parent=parent) if parent else result)
         except Exception as e:
             print(f"Warning: Failed to store PDF data: {e}")
-
-        return result
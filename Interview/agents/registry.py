@@ -0,0 +1,48 @@
+import threading
+import time
+
+
+class AgentRegistry:
+    def __init__(self):
+        """
+        Agents built on first use, keyed by name:
+        - register() records a factory that imports the agent's module and constructs it,
+          so heavy dependencies (pypdf for the PDFAgent) are only loaded when needed
+        - get() builds an agent once, concurrent first callers wait for the same build
+        - prewarm() builds agents ahead of traffic, e.g. from a background thread at startup
+        """
+        self._factories = {}
+        self._locks = {}
+        self._agents = {}
+        self.load_seconds = {}
+
+    def register(self, name, factory):
+        self._factories[name] = factory
+        self._locks[name] = threading.Lock()
+
+    def names(self):
+        return list(self._factories)
+
+    def is_loaded(self, name):
+        return name in self._agents
+
+    def get(self, name):
+        agent = self._agents.get(name)
+        if agent is not None:
+            return agent
+        with self._locks[name]:
+            agent = self._agents.get(name)
+            if agent is None:
+                started = time.perf_counter()
+                agent = self._factories[name]()
+                self.load_seconds[name] = round(time.perf_counter() - started, 4)
+                self._agents[name] = agent
+        return agent
+
+    def prewarm(self, names=None):
+        """Build the given agents (default: all registered), logging failures instead of raising."""
+        for name in names if names is not None else self.names():
+            try:
+                self.get(name)
+            except Exception as e:
+                print(f"Warning: Failed to prewarm {name}: {e}")
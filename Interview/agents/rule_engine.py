@@ -0,0 +1,103 @@
+import os
+import re
+import json
+import hashlib
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(__file__), "rules.json")
+
+# Below this many keywords, per-keyword substring checks (C-speed scans) beat one regex pass
+MIN_AUTOMATON_KEYWORDS = 64
+
+_default_engine = None
+
+
+def _trie_pattern(keywords):
+    """Build a regex whose alternatives are factored into a trie, so each text position
+    is checked against the distinct next characters instead of every keyword."""
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for ch in keyword:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def build(node):
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch != ""]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return "(?:" + body + ")?" if "" in node else body
+
+    return build(trie)
+
+
+class RuleEngine:
+    def __init__(self, rules):
+        """
+        Keyword rules for every category (intent, urgency, tone, policy...), compiled into
+        one matcher that scans a document once and reports every category:
+        - rules: {category: {"match": "first" | "all", "default": label, "labels": [{"label", "keywords"}]}}
+        - "first" returns the first label in list order with a matching keyword (priority order),
+          "all" returns every matching label in list order
+        - Keywords match case-insensitively as substrings of the text
+        """
+        self.rules = rules
+        self.version = hashlib.sha256(json.dumps(rules, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+        self._labels = {}
+        keywords = set()
+        for category, spec in rules.items():
+            self._labels[category] = [
+                (label["label"], [keyword.lower() for keyword in label["keywords"]])
+                for label in spec["labels"]
+            ]
+            for _, label_keywords in self._labels[category]:
+                keywords.update(label_keywords)
+        self.keywords = sorted(keywords)
+
+        self._pattern = None
+        if len(self.keywords) >= MIN_AUTOMATON_KEYWORDS:
+            # The lookahead reports the longest keyword starting at every position;
+            # shorter keywords starting there are its prefixes
+            self._pattern = re.compile("(?=(" + _trie_pattern(self.keywords) + "))")
+            self._prefixes = {
+                keyword: [other for other in self.keywords if keyword.startswith(other)]
+                for keyword in self.keywords
+            }
+
+    @classmethod
+    def from_file(cls, path=None):
+        with open(path or DEFAULT_RULES_PATH, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    @classmethod
+    def default(cls):
+        """Engine for the rules file named by RULES_PATH (or the bundled rules.json), loaded once per process."""
+        global _default_engine
+        if _default_engine is None:
+            _default_engine = cls.from_file(os.getenv("RULES_PATH"))
+        return _default_engine
+
+    def scan(self, text_lower):
+        """Return the set of keywords found in already lowercased text."""
+        if self._pattern is None:
+            return {keyword for keyword in self.keywords if keyword in text_lower}
+        found = set()
+        for longest in set(self._pattern.findall(text_lower)):
+            found.update(self._prefixes[longest])
+        return found
+
+    def labels(self, category):
+        return [label for label, _ in self._labels[category]]
+
+    def match(self, text_lower, found=None):
+        """Map every category to its matched label(s); found can be a previous scan() result."""
+        if found is None:
+            found = self.scan(text_lower)
+        result = {}
+        for category, labels in self._labels.items():
+            matched = [label for label, keywords in labels if any(k in found for k in keywords)]
+            if self.rules[category].get("match", "first") == "all":
+                result[category] = matched
+            else:
+                result[category] = matched[0] if matched else self.rules[category].get("default")
+        return result
@@ -0,0 +1,123 @@
+import re
+import os
+import json
+import random
+
+SAMPLE_INPUTS_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "SAMPLE_INPUTS.txt")
+
+SAMPLE_HEADER = re.compile(r"^\d+\. .*\(copy this into (email_body|json_body) parameter\):\n-+\n", re.M)
+
+FILLER_SENTENCES = [
+    "Please see the details of our previous conversation below.",
+    "Our team has reviewed the documentation you sent last week.",
+    "Let us know if anything in the attached summary is unclear.",
+    "The account manager is copied on this message for visibility.",
+    "We appreciate your continued partnership on this project.",
+    "Delivery schedules may shift depending on the final scope.",
+]
+
+INVOICE_ITEMS = ["Widget", "Gadget", "License", "Support", "Consulting", "Hosting", "Training", "Hardware"]
+POLICY_SENTENCES = [
+    "Data is processed in line with GDPR requirements",
+    "Patient records follow HIPAA safeguards",
+    "Devices are registered with the FDA",
+    "California customers are covered by CCPA",
+]
+
+
+def load_samples(path=None):
+    """
+    Read the email and JSON samples from SAMPLE_INPUTS.txt:
+    - Returns {"email": [text, ...], "json": [dict, ...]}
+    """
+    with open(path or SAMPLE_INPUTS_PATH, encoding='utf-8') as f:
+        content = f.read().split("=== QUICK TEST COMMANDS ===")[0]
+    samples = {"email": [], "json": []}
+    headers = list(SAMPLE_HEADER.finditer(content))
+    for i, header in enumerate(headers):
+        end = headers[i + 1].start() if i + 1 < len(headers) else len(content)
+        body = content[header.end():end].split("\n=== ")[0].strip()
+        if header.group(1) == "email_body":
+            samples["email"].append(body)
+        else:
+            samples["json"].append(json.loads(body))
+    return samples
+
+
+def synthetic_emails(count, samples=None, filler_sentences=10, seed=0):
+    """Emails based on the samples, each with its own sender, conversation ID and filler body."""
+    rng = random.Random(seed)
+    samples = samples or load_samples()
+    emails = []
+    for i in range(count):
+        base = samples["email"][i % len(samples["email"])]
+        base = re.sub(r"^From: \S+", f"From: sender{i}@example{i % 97}.com", base, count=1, flags=re.M)
+        filler = " ".join(rng.choice(FILLER_SENTENCES) for _ in range(filler_sentences))
+        emails.append(f"{base}\n\n{filler}\n\nConversation-ID: CONV-{seed}-{i}\n")
+    return emails
+
+
+def synthetic_json(count, samples=None, seed=0):
+    """JSON webhooks based on the samples, with unique IDs and randomized amounts."""
+    rng = random.Random(seed)
+    samples = samples or load_samples()
+    documents = []
+    for i in range(count):
+        document = json.loads(json.dumps(samples["json"][i % len(samples["json"])]))
+        if "id" in document:
+            document["id"] = f"{document['id']}-{seed}-{i}"
+        if "total_amount" in document:
+            document["total_amount"] = round(rng.uniform(100, 20000), 2)
+        if "amount" in document:
+            document["amount"] = round(rng.uniform(100, 20000), 2)
+        documents.append(json.dumps(document))
+    return documents
+
+
+def _pdf_string(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(pages):
+    """Build a minimal PDF with one Helvetica text page per entry in pages (lines split on newlines)."""
+    count = len(pages)
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [%s] /Count %d >>" % (" ".join(f"{4 + 2 * i} 0 R" for i in range(count)), count),
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, text in enumerate(pages):
+        lines = " ".join(f"({_pdf_string(line)}) Tj T*" for line in text.split("\n"))
+        stream = f"BT /F1 11 Tf 13 TL 50 760 Td {lines} ET"
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode('latin-1')
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode('latin-1')
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode('latin-1')
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode('latin-1')
+    return bytes(out)
+
+
+def synthetic_invoice_pdfs(count, pages=5, lines_per_page=20, seed=0):
+    """Multi-page invoice PDFs with line items on every page and an occasional policy mention."""
+    rng = random.Random(seed)
+    documents = []
+    for i in range(count):
+        page_texts = []
+        for page in range(pages):
+            lines = [f"Invoice INV-{seed}-{i} page {page + 1}"]
+            for _ in range(lines_per_page):
+                lines.append(f"{rng.choice(INVOICE_ITEMS)} {rng.randint(1, 20)} ${rng.uniform(5, 900):.2f}")
+            if rng.random() < 0.3:
+                lines.append(rng.choice(POLICY_SENTENCES))
+            page_texts.append("\n".join(lines))
+        documents.append(make_pdf(page_texts))
+    return documents
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import load_samples, synthetic_emails, synthetic_json, synthetic_invoice_pdfs
+from benchmarks.stub_server import StubActionServer
+
+PERCENTILES = [50, 90, 95, 99]
+
+
+def summarize(latencies, elapsed, errors=None):
+    """Throughput and latency percentiles (milliseconds, nearest rank) for one benchmark."""
+    ordered = sorted(latencies)
+    summary = {
+        "count": len(ordered),
+        "seconds": round(elapsed, 4),
+        "throughput": round(len(ordered) / elapsed, 2) if elapsed else None
+    }
+    for p in PERCENTILES:
+        index = max(0, int(round(p / 100 * len(ordered))) - 1) if ordered else None
+        summary[f"p{p}_ms"] = round(ordered[index] * 1000, 3) if ordered else None
+    summary["max_ms"] = round(ordered[-1] * 1000, 3) if ordered else None
+    if errors is not None:
+        summary["errors"] = errors
+    return summary
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its reaped children (PDF worker processes)."""
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1)
+    }
+
+
+def time_calls(fn, inputs):
+    latencies = []
+    started = time.perf_counter()
+    for item in inputs:
+        call_started = time.perf_counter()
+        fn(item)
+        latencies.append(time.perf_counter() - call_started)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def bench_agents(args, stub, workdir, samples):
+    """Microbenchmark each agent's classify/process in-process against its own SharedMemory."""
+    from memory.shared_memory import SharedMemory
+    from agents.action_router import ActionRouter
+    from agents.classifier_agent import ClassifierAgent
+    from agents.email_parser_agent import EmailParserAgent
+    from agents.json_agent import JSONAgent
+    from agents.pdf_agent import PDFAgent
+
+    memory = SharedMemory(os.path.join(workdir, "agents.db"), write_behind=True)
+    router = ActionRouter(memory, retry_delay=0.05, outbox=True, base_url=stub.base_url)
+    classifier = ClassifierAgent(memory)
+    email_agent = EmailParserAgent(memory, action_router=router)
+    json_agent = JSONAgent(memory, action_router=router)
+    pdf_agent = PDFAgent(memory)
+
+    emails = synthetic_emails(args.iterations, samples, args.email_sentences, seed=1)
+    documents = synthetic_json(args.iterations, samples, seed=1)
+    pdfs = synthetic_invoice_pdfs(args.pdf_iterations, args.pdf_pages, seed=1)
+
+    results = {
+        "classifier.email": time_calls(classifier.classify, emails),
+        "classifier.json": time_calls(classifier.classify, documents),
+        "classifier.pdf": time_calls(classifier.classify, pdfs),
+        "email_parser.process": time_calls(email_agent.process, emails),
+        "json_agent.process": time_calls(json_agent.process, documents),
+        "pdf_agent.process": time_calls(pdf_agent.process, pdfs),
+    }
+    memory.flush()
+    router.shutdown()
+    memory.close()
+    return results
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def intake_requests(kind, corpus):
+    if kind == "email":
+        return [{"data": {"email_body": text}} for text in corpus]
+    if kind == "json":
+        return [{"data": {"json_body": text}} for text in corpus]
+    return [{"files": {"file": ("invoice.pdf", pdf, "application/pdf")}} for pdf in corpus]
+
+
+def run_phase(url, jobs, concurrency):
+    """POST every job to url from concurrency client threads; returns the phase summary."""
+    local = threading.local()
+    errors = {}
+    errors_lock = threading.Lock()
+
+    def send(job):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            status = local.session.post(url, timeout=120, **job).status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        latency = time.perf_counter() - started
+        if status != 200:
+            with errors_lock:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+        return latency
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(send, jobs))
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+def wait_for_actions(base_url, stub, delivered_before, timeout):
+    """
+    Wait until every action is delivered: no SharedMemory writes left to commit (outbox rows
+    and their delivery updates go through write-behind), nothing pending or in flight in the
+    outbox, and as many rows delivered as the stub received since delivered_before.
+    Returns (seconds, outbox stats, actions the stub received).
+    """
+    started = time.perf_counter()
+    outbox = {}
+    received = 0
+    while time.perf_counter() - started < timeout:
+        metrics = requests.get(f"{base_url}/actions/metrics", timeout=10).json()
+        outbox = metrics.get("outbox", {})
+        received = stub.stats()["total_actions"] - delivered_before
+        if (not metrics.get("pending_writes") and not outbox.get("pending") and not outbox.get("in_flight")
+                and outbox.get("delivered", 0) == received):
+            break
+        time.sleep(0.1)
+    return round(time.perf_counter() - started, 3), outbox, received
+
+
+def run_load(args, stub, workdir, samples):
+    """Start main.app under uvicorn on a local port and drive concurrent intake load against it."""
+    import uvicorn
+
+    # The stub also counts the actions of the agent microbenchmarks
+    delivered_before = stub.stats()["total_actions"]
+    os.environ["DATABASE_PATH"] = os.path.join(workdir, "load.db")
+    os.environ["ACTION_BASE_URL"] = stub.base_url
+    os.environ.setdefault("RETRY_DELAY", "0.1")
+    import main
+
+    if not args.verbose:
+        # Request logging echoes every document body
+        logging.getLogger("main").setLevel(logging.WARNING)
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="uvicorn", daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("uvicorn failed to start")
+        time.sleep(0.05)
+    base_url = f"http://127.0.0.1:{port}"
+    url = f"{base_url}/intake/"
+
+    corpora = {
+        "email": synthetic_emails(args.requests, samples, args.email_sentences, seed=2),
+        "json": synthetic_json(args.requests, samples, seed=2),
+        "pdf": synthetic_invoice_pdfs(args.pdf_requests, args.pdf_pages, seed=2),
+    }
+    results = {}
+    try:
+        # Warm up connections and the PDF process pool outside the measured phases
+        warmup = (intake_requests("email", synthetic_emails(1, samples, seed=5))
+                  + intake_requests("json", synthetic_json(1, samples, seed=5))
+                  + intake_requests("pdf", synthetic_invoice_pdfs(1, args.pdf_pages, seed=5)))
+        run_phase(url, warmup, len(warmup))
+
+        for kind, corpus in corpora.items():
+            results[kind] = run_phase(url, intake_requests(kind, corpus), args.concurrency)
+
+        # Interleave fresh documents of every format so the result cache can't answer them
+        mixed = []
+        for jobs in zip(intake_requests("email", synthetic_emails(args.requests, samples, args.email_sentences, seed=3)),
+                        intake_requests("json", synthetic_json(args.requests, samples, seed=3))):
+            mixed.extend(jobs)
+        mixed.extend(intake_requests("pdf", synthetic_invoice_pdfs(args.pdf_requests, args.pdf_pages, seed=3)))
+        results["mixed"] = run_phase(url, mixed, args.concurrency)
+
+        # One NDJSON batch request, reported per document
+        lines = [json.dumps({"email_body": text}) for text in synthetic_emails(args.batch_size // 2, samples, seed=4)]
+        lines += [json.dumps({"json_body": text}) for text in synthetic_json(args.batch_size - len(lines), samples, seed=4)]
+        started = time.perf_counter()
+        response = requests.post(f"{base_url}/intake/batch", data="\n".join(lines).encode('utf-8'),
+                                 headers={"Content-Type": "application/x-ndjson"}, timeout=600)
+        statuses = [json.loads(line).get("status") for line in response.iter_lines() if line]
+        elapsed = time.perf_counter() - started
+        results["batch"] = {
+            "documents": len(statuses),
+            "seconds": round(elapsed, 4),
+            "throughput": round(len(statuses) / elapsed, 2) if elapsed else None,
+            "errors": sum(1 for status in statuses if status != 200)
+        }
+
+        drain_seconds, outbox, received = wait_for_actions(base_url, stub, delivered_before, args.drain_timeout)
+        if outbox.get("delivered", 0) != received:
+            print(f"Warning: Outbox reports {outbox.get('delivered', 0)} delivered actions, the stub received {received}",
+                  file=sys.stderr)
+        actions = {"drain_seconds": drain_seconds, "outbox": outbox, "stub_received": received,
+                   "router": requests.get(f"{base_url}/actions/metrics", timeout=10).json()}
+    finally:
+        server.should_exit = True
+        thread.join(30)
+    return results, actions
+
+
+def compare(results, baseline, max_regression):
+    """List benchmarks whose throughput dropped or p95 latency grew by more than max_regression."""
+    regressions = []
+    for section in ("agents", "load"):
+        for name, current in results.get(section, {}).items():
+            previous = baseline.get(section, {}).get(name)
+            if not previous:
+                continue
+            if previous.get("throughput") and current.get("throughput") is not None:
+                if current["throughput"] < previous["throughput"] * (1 - max_regression):
+                    regressions.append(f"{section}.{name}: throughput {previous['throughput']} -> {current['throughput']}")
+            if previous.get("p95_ms") and current.get("p95_ms") is not None:
+                if current["p95_ms"] > previous["p95_ms"] * (1 + max_regression):
+                    regressions.append(f"{section}.{name}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the agents and load-test the intake API offline")
+    parser.add_argument("--quick", action="store_true", help="small corpora for a fast smoke run")
+    parser.add_argument("--skip-agents", action="store_true", help="skip the per-agent microbenchmarks")
+    parser.add_argument("--skip-load", action="store_true", help="skip the end-to-end load test")
+    parser.add_argument("--iterations", type=int, default=500, help="documents per agent microbenchmark")
+    parser.add_argument("--pdf-iterations", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=400, help="email and JSON requests per load phase")
+    parser.add_argument("--pdf-requests", type=int, default=20)
+    parser.add_argument("--pdf-pages", type=int, default=10)
+    parser.add_argument("--email-sentences", type=int, default=10, help="filler sentences per synthetic email")
+    parser.add_argument("--batch-size", type=int, default=500, help="documents in the /intake/batch request")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent load-test clients")
+    parser.add_argument("--stub-latency-ms", type=float, default=0, help="delay of the stub action endpoints")
+    parser.add_argument("--stub-failure-rate", type=float, default=0, help="share of stub responses that are 500")
+    parser.add_argument("--drain-timeout", type=float, default=60, help="seconds to wait for queued actions")
+    parser.add_argument("--verbose", action="store_true", help="keep the API's request logging")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="previous JSON report to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="allowed throughput drop / p95 growth against the baseline (default: 0.2)")
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.iterations, args.pdf_iterations = 50, 3
+        args.requests, args.pdf_requests, args.pdf_pages, args.batch_size = 40, 3, 3, 50
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    samples = load_samples()
+    stub = StubActionServer(latency=args.stub_latency_ms / 1000, failure_rate=args.stub_failure_rate).start()
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline", "verbose")}
+    }
+    with tempfile.TemporaryDirectory(prefix="intake-bench-") as workdir:
+        try:
+            if not args.skip_agents:
+                report["agents"] = bench_agents(args, stub, workdir, samples)
+            if not args.skip_load:
+                report["load"], report["actions"] = run_load(args, stub, workdir, samples)
+        finally:
+            stub.stop()
+    report["actions"] = dict(report.get("actions", {}), stub=stub.stats())
+    report["peak_rss_mb"] = peak_rss_mb()
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            report["regressions"] = compare(report, json.load(f), args.max_regression)
+        for regression in report["regressions"]:
+            print(f"Regression: {regression}", file=sys.stderr)
+        status = 1 if report["regressions"] else 0
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding='utf-8') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
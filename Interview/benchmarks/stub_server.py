@@ -0,0 +1,76 @@
+import json
+import time
+import random
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class StubActionServer:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, failure_rate=0.0):
+        """
+        Local stand-in for the CRM and risk endpoints the ActionRouter posts to:
+        - Accepts any POST path, answers 200 after latency seconds
+        - failure_rate answers that share of requests with 500 to exercise retries
+        - Counts requests and delivered actions per path (bulk array bodies count every item)
+        """
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.requests = Counter()
+        self.actions = Counter()
+        self.failures = Counter()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if stub.latency:
+                    time.sleep(stub.latency)
+                failed = stub.failure_rate and random.random() < stub.failure_rate
+                with stub._lock:
+                    stub.requests[self.path] += 1
+                    if failed:
+                        stub.failures[self.path] += 1
+                    else:
+                        try:
+                            payload = json.loads(body or b"null")
+                        except ValueError:
+                            payload = None
+                        stub.actions[self.path] += len(payload) if isinstance(payload, list) else 1
+                self.send_response(500 if failed else 200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-actions", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": dict(self.requests),
+                "actions": dict(self.actions),
+                "failures": dict(self.failures),
+                "total_actions": sum(self.actions.values())
+            }
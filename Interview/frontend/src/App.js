@@ -1,12 +1,19 @@
 import React, { useState } from 'react';
 import axios from 'axios';
 
+// Documents are submitted as async jobs and their status polled until done
+const POLL_INTERVAL_MS = 1000;
+const JOB_TIMEOUT_MS = 10 * 60 * 1000;
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
 function App() {
   const [file, setFile] = useState(null);
   const [jsonBody, setJsonBody] = useState('');
   const [emailBody, setEmailBody] = useState('');
   const [result, setResult] = useState(null);
   const [loading, setLoading] = useState(false);
+  const [jobStatus, setJobStatus] = useState(null);
 
   const handleFileChange = (e) => {
     setFile(e.target.files[0]);
@@ -16,6 +23,7 @@ function App() {
     e.preventDefault();
     setLoading(true);
     setResult(null);
+    setJobStatus(null);
 
     const formData = new FormData();
     if (file) {
@@ -33,16 +41,32 @@ function App() {
     try {
       console.log('Sending request to backend...');
       const apiUrl = process.env.REACT_APP_API_URL || '';
-      const response = await axios.post(`${apiUrl}/intake/`, formData, {
+      const response = await axios.post(`${apiUrl}/intake/?mode=async`, formData, {
         headers: {
           'Content-Type': 'multipart/form-data',
         },
-        timeout: 10000, // 10 second timeout
+        timeout: 10000, // 10 second timeout for the upload itself
       });
-      
+
       console.log('Response status:', response.status);
-      console.log('Response data:', response.data);
-      setResult(response.data);
+      console.log('Job queued:', response.data);
+      const jobId = response.data.job_id;
+      setJobStatus(response.data.status);
+
+      // Poll the job until it finishes; large PDFs can take longer than any single request
+      const deadline = Date.now() + JOB_TIMEOUT_MS;
+      let job = response.data;
+      while (job.status !== 'done' && job.status !== 'failed') {
+        if (Date.now() > deadline) {
+          throw new Error(`Job ${jobId} did not finish in time`);
+        }
+        await sleep(POLL_INTERVAL_MS);
+        job = (await axios.get(`${apiUrl}/jobs/${jobId}`, { timeout: 10000 })).data;
+        setJobStatus(job.status);
+      }
+
+      console.log('Job finished:', job);
+      setResult(job.status === 'done' ? job.result : { error: job.error, classification: job.classification });
     } catch (error) {
       console.error('Axios error:', error);
       if (error.response) {
@@ -92,7 +116,7 @@ function App() {
           />
         </div>
         <button type="submit" disabled={loading} style={{ marginTop: 10 }}>
-          {loading ? 'Processing...' : 'Submit'}
+          {loading ? `Processing${jobStatus ? ` (${jobStatus})` : ''}...` : 'Submit'}
         </button>
       </form>
 
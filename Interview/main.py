@@ -1,19 +1,337 @@
 import logging
-from fastapi import FastAPI, UploadFile, File, Form
-from fastapi.responses import JSONResponse
+import os
+import time
+import json
+import base64
+import asyncio
+import threading
+import traceback
+from contextlib import asynccontextmanager, contextmanager
+from fastapi import FastAPI, UploadFile, File, Form, Request, HTTPException
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from starlette.background import BackgroundTask
+from starlette.datastructures import Headers, MutableHeaders
 from fastapi.middleware.cors import CORSMiddleware
 from typing import Optional
-from agents.classifier_agent import ClassifierAgent
-from agents.json_agent import JSONAgent
-from agents.email_parser_agent import EmailParserAgent
-from agents.pdf_agent import PDFAgent
 from agents.action_router import ActionRouter
+from agents.executor import AgentExecutor, ExecutorSaturated
+from agents.intake_context import IntakeContext, InputTooLarge
+from agents.registry import AgentRegistry
+from agents.job_queue import JobQueue, job_priority
+from agents.mime_email import iter_messages
+from agents.rule_engine import RuleEngine
 from memory.shared_memory import SharedMemory
+from memory.event_bus import FILTER_FIELDS, matches
+from memory.result_cache import ResultCache
+from responses import FastJSONResponse, CompressResponse, parse_paths, project
+from schemas import IntakeResponse, intake_response
+from metrics import REGISTRY, INTAKE_SECONDS, STAGE_SECONDS, AGENT_SECONDS, gauge
+from tracing import Tracer, activate, deactivate, span, record_span, timeline
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+def parse_batching(spec):
+    """Parse "crm_log=50:200,risk_alert=20:500" (max items : max wait in ms) into ActionRouter batching config."""
+    batching = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        action_type, _, limits = entry.partition("=")
+        max_items, _, max_wait_ms = limits.partition(":")
+        batching[action_type.strip()] = {
+            "max_items": int(max_items or 50),
+            "max_wait": int(max_wait_ms or 200) / 1000
+        }
+    return batching
+
+def optional_int(name):
+    value = os.getenv(name)
+    return int(value) if value else None
+
+# Page-streaming PDF extraction budgets; large documents are split across the process pool
+PDF_OPTIONS = {
+    "pages_per_task": int(os.getenv("PDF_PAGES_PER_TASK", "50")),
+    "max_pages": optional_int("PDF_MAX_PAGES"),
+    "max_seconds": optional_int("PDF_MAX_SECONDS"),
+    "max_text_bytes": optional_int("PDF_MAX_TEXT_BYTES"),
+    "include_text": os.getenv("PDF_INCLUDE_TEXT", "1") == "1",
+    "flags_only": os.getenv("PDF_FLAGS_ONLY", "0") == "1"
+}
+
+# Bump when agent logic changes so cached results from older logic are not reused
+# (rule changes are covered by the rule engine version)
+PIPELINE_VERSION = "1"
+
+# Whether a cache hit fires the follow-up actions again (CRM actions, risk alerts)
+REPLAY_ACTIONS_ON_CACHE_HIT = os.getenv("RESULT_CACHE_REPLAY_ACTIONS", "0") == "1"
+
+# Agents built in the background once the app is serving; the rest are built on first use
+PREWARM_AGENTS = [name.strip() for name in
+                  os.getenv("PREWARM_AGENTS", "ClassifierAgent,JSONAgent,EmailParserAgent,PDFAgent").split(",")
+                  if name.strip()]
+
+# Agent handling each classified format
+FORMAT_AGENTS = {"JSON": "JSONAgent", "Email": "EmailParserAgent", "PDF": "PDFAgent"}
+
+# Services built by the lifespan handler, so importing this module stays cheap
+memory = None
+action_router = None
+executor = None
+result_cache = None
+agents = None
+job_queue = None
+tracer = None
+
+def register_agents(registry):
+    """Agent factories; each imports its agent module on first use."""
+    def classifier():
+        from agents.classifier_agent import ClassifierAgent
+        return ClassifierAgent(memory)
+
+    def json_agent():
+        from agents.json_agent import JSONAgent
+        return JSONAgent(memory, action_router=action_router,
+                         stream_batch_size=int(os.getenv("JSON_STREAM_BATCH_SIZE", "500")))
+
+    def email_parser():
+        from agents.email_parser_agent import EmailParserAgent
+        return EmailParserAgent(memory, action_router=action_router,
+                                escalate_after_messages=int(os.getenv("ESCALATE_AFTER_MESSAGES", "3")))
+
+    def pdf_agent():
+        from agents.pdf_agent import PDFAgent
+        return PDFAgent(memory)
+
+    registry.register("ClassifierAgent", classifier)
+    registry.register("JSONAgent", json_agent)
+    registry.register("EmailParserAgent", email_parser)
+    registry.register("PDFAgent", pdf_agent)
+    return registry
+
+def start_services():
+    global memory, action_router, executor, result_cache, agents, job_queue, tracer
+
+    # Initialize shared memory, committing writes in batches from a background writer
+    # (or forwarding them to the writer service process)
+    memory = SharedMemory(
+        os.getenv("DATABASE_PATH", "memory.db"),
+        write_behind=os.getenv("MEMORY_WRITE_BEHIND", "1") == "1",
+        batch_size=int(os.getenv("MEMORY_BATCH_SIZE", "200")),
+        flush_interval=float(os.getenv("MEMORY_FLUSH_INTERVAL", "0.05")),
+        blob_threshold=int(os.getenv("MEMORY_BLOB_THRESHOLD", "4096")),
+        partition=os.getenv("MEMORY_PARTITION") or None,
+        retention=int(os.getenv("MEMORY_RETENTION", "0")) or None,
+        # Set for multi-worker deployments, see memory/writer_service.py
+        writer_address=os.getenv("MEMORY_WRITER_SOCKET") or None,
+        writer_authkey=os.getenv("MEMORY_WRITER_AUTHKEY", "").encode() or None,
+        event_buffer=int(os.getenv("EVENT_BUFFER_SIZE", "10000"))
+    )
+
+    # Initialize action router
+    action_router = ActionRouter(
+        memory,
+        max_retries=int(os.getenv("MAX_RETRIES", "3")),
+        retry_delay=float(os.getenv("RETRY_DELAY", "2")),
+        max_workers=int(os.getenv("ACTION_WORKERS", "4")),
+        max_queue=int(os.getenv("ACTION_QUEUE_SIZE", "1000")),
+        batching=parse_batching(os.getenv("ACTION_BATCHING", "")),
+        breaker_failures=int(os.getenv("BREAKER_FAILURES", "5")),
+        breaker_reset=float(os.getenv("BREAKER_RESET", "30")),
+        outbox=os.getenv("ACTION_OUTBOX", "1") == "1",
+        base_url=os.getenv("ACTION_BASE_URL")
+    )
+
+    # Agents are built lazily; JSON and email agents queue their follow-up actions themselves
+    agents = register_agents(AgentRegistry())
+
+    # Execution layer keeping agent work and SQLite writes off the event loop
+    executor = AgentExecutor(
+        max_workers=int(os.getenv("AGENT_THREADS", "8")),
+        max_processes=int(os.getenv("PDF_PROCESSES", "2")),
+        max_pending=int(os.getenv("AGENT_MAX_PENDING", "128")),
+        format_limits={
+            "PDF": int(os.getenv("PDF_CONCURRENCY", "2")),
+            "JSON": int(os.getenv("JSON_CONCURRENCY", "32")),
+            "Email": int(os.getenv("EMAIL_CONCURRENCY", "32"))
+        },
+        queue_limits={
+            "PDF": int(os.getenv("PDF_QUEUE_LIMIT", "8")),
+            "JSON": int(os.getenv("JSON_QUEUE_LIMIT", "256")),
+            "Email": int(os.getenv("EMAIL_QUEUE_LIMIT", "256"))
+        }
+    )
+
+    # Cache of results for repeated documents, keyed by content hash and pipeline version
+    result_cache = None
+    if int(os.getenv("RESULT_CACHE_SIZE", "1024")) > 0:
+        result_cache = ResultCache(
+            memory,
+            version=f"{PIPELINE_VERSION}:{RuleEngine.default().version}:{json.dumps(PDF_OPTIONS, sort_keys=True)}",
+            max_entries=int(os.getenv("RESULT_CACHE_SIZE", "1024")),
+            max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+            ttl=float(os.getenv("RESULT_CACHE_TTL", "3600"))
+        )
+
+    # Request traces: a sample of them, plus every slow or failed one, is stored with its spans
+    tracer = Tracer(
+        memory,
+        sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", "0.1")),
+        slow_seconds=float(os.getenv("TRACE_SLOW_SECONDS", "1")) or None,
+        ttl=float(os.getenv("TRACE_TTL", "86400")),
+        force_header=os.getenv("TRACE_FORCE_HEADER") or None
+    )
+
+    # Workers for /intake/?mode=async jobs, started with the event loop
+    job_queue = JobQueue(
+        memory,
+        run_job=lambda ctx, classification: run_pipeline(ctx, bounded=False, classification=classification),
+        workers=int(os.getenv("JOB_WORKERS", "4")),
+        max_queued=int(os.getenv("JOB_QUEUE_SIZE", "1000")),
+        ttl=float(os.getenv("JOB_TTL", "3600")),
+        tracer=tracer,
+        stale_after=float(os.getenv("JOB_STALE_SECONDS", "86400"))
+    )
+    # Fail the jobs a previous run (or a dead sibling worker) left queued or running
+    job_queue.recover()
+
+    # Pick up actions left pending in the outbox by a previous run
+    if action_router.outbox:
+        action_router.notify()
+    # Drop expired result cache entries
+    if result_cache is not None:
+        memory.prune_cached_results(time.time() - result_cache.ttl)
+
+def stop_services():
+    executor.shutdown(wait=False)
+    action_router.shutdown()
+    memory.close()
+
+@asynccontextmanager
+async def lifespan(app):
+    await asyncio.to_thread(start_services)
+    job_queue.start()
+    if PREWARM_AGENTS:
+        threading.Thread(target=agents.prewarm, args=(PREWARM_AGENTS,), name="agent-prewarm", daemon=True).start()
+    try:
+        yield
+    finally:
+        await job_queue.stop()
+        await asyncio.to_thread(stop_services)
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+
+# Largest accepted upload; bigger requests are refused before (or while) their body is read
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+
+class UploadSizeLimit:
+    """
+    ASGI middleware rejecting intake requests larger than max_bytes with a 413:
+    - Right away when the declared Content-Length is too large
+    - Otherwise (chunked bodies, or a Content-Length that understates the body) as soon as
+      more bytes were received, so the body is never read or spooled past the limit
+    """
+
+    def __init__(self, app, max_bytes):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def reject(self, scope, receive, send):
+        response = FastJSONResponse(status_code=413, content={"error": f"Upload exceeds {self.max_bytes} bytes"})
+        await response(scope, receive, send)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not scope["path"].startswith("/intake/"):
+            await self.app(scope, receive, send)
+            return
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > self.max_bytes:
+            await self.reject(scope, receive, send)
+            return
+
+        received = 0
+        exceeded = False
+        started = False
+        rejected = False
+
+        async def receive_limited():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    raise InputTooLarge(f"Upload exceeds {self.max_bytes} bytes")
+            return message
+
+        async def send_limited(message):
+            nonlocal started, rejected
+            if exceeded and not started:
+                # Whatever the app made of the cut-off body (e.g. a 400 parse error) becomes the 413
+                if not rejected:
+                    rejected = True
+                    await self.reject(scope, receive, send)
+                return
+            started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive_limited, send_limited)
+        except Exception:
+            if not exceeded or started:
+                raise
+        if exceeded and not started and not rejected:
+            await self.reject(scope, receive, send)
+
+if MAX_UPLOAD_BYTES > 0:
+    app.add_middleware(UploadSizeLimit, max_bytes=MAX_UPLOAD_BYTES)
+
+# Responses of at least this many bytes are gzip/brotli compressed for clients that accept it
+RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", "1024"))
+
+if RESPONSE_COMPRESS_MIN_BYTES > 0:
+    app.add_middleware(CompressResponse, minimum_size=RESPONSE_COMPRESS_MIN_BYTES,
+                       level=int(os.getenv("RESPONSE_COMPRESS_LEVEL", "6")))
+
+class TraceRequests:
+    """
+    ASGI middleware tracing intake requests: the trace id is the client's X-Request-ID when
+    it is a safe token (a fresh id otherwise) and is returned as X-Trace-ID. Rows, actions and
+    jobs of the request carry the id; its spans are stored once the response is sent if the
+    tracer keeps it (see Tracer.should_store).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or tracer is None or scope["method"] == "OPTIONS"
+                or not scope["path"].startswith("/intake/")):
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        trace = tracer.start(f"{scope['method']} {scope['path']}", headers.get("x-request-id"),
+                             sampled=tracer.forced(headers))
+        status = 500
+
+        async def send_traced(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                MutableHeaders(scope=message)["X-Trace-ID"] = trace.trace_id
+            await send(message)
+
+        token = activate(trace)
+        try:
+            await self.app(scope, receive, send_traced)
+        finally:
+            deactivate(token)
+            trace.finish(status)
+            if tracer.should_store(trace):
+                try:
+                    await asyncio.to_thread(tracer.store, trace)
+                except Exception as e:
+                    logger.error(f"Failed to store trace {trace.trace_id}: {e}")
+
+app.add_middleware(TraceRequests)
 
 # Add CORS middleware to allow frontend requests
 app.add_middleware(
@@ -24,115 +342,588 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize shared memory
-memory = SharedMemory('memory.db')
+@app.get("/memory/metadata")
+async def list_metadata(type: Optional[str] = None, intent: Optional[str] = None,
+                        since: Optional[str] = None, until: Optional[str] = None,
+                        before_id: Optional[int] = None, limit: int = 100):
+    return await executor.run(memory.query_metadata, type=type, intent=intent, since=since,
+                              until=until, before_id=before_id, limit=limit)
+
+@app.get("/memory/extracted_fields")
+async def list_extracted_fields(agent: Optional[str] = None,
+                                since: Optional[str] = None, until: Optional[str] = None,
+                                before_id: Optional[int] = None, limit: int = 100,
+                                include_blobs: bool = False):
+    return await executor.run(memory.query_extracted_fields, agent=agent, since=since,
+                              until=until, before_id=before_id, limit=limit, include_blobs=include_blobs)
+
+@app.get("/conversations/{conversation_id}")
+async def get_conversation(conversation_id: str, before_id: Optional[int] = None, limit: int = 100):
+    """A conversation's summary plus one page of its messages, newest first."""
+    summary = await executor.run(memory.get_conversation_state, conversation_id)
+    if summary is None:
+        return FastJSONResponse(status_code=404, content={"error": "Conversation not found"})
+    history = await executor.run(memory.query_conversations, conversation_id=conversation_id,
+                                 before_id=before_id, limit=limit)
+    return {"summary": summary, "history": history}
+
+@app.get("/memory/blobs/{digest}")
+async def get_blob(digest: str):
+    """Load one large field (e.g. a PDF's extracted_text) referenced from extracted_fields."""
+    text = await executor.run(memory.get_blob, digest)
+    if text is None:
+        return FastJSONResponse(status_code=404, content={"error": "Blob not found"})
+    return PlainTextResponse(text)
+
+@app.get("/memory/conversations")
+async def list_conversations(conversation_id: Optional[str] = None,
+                             since: Optional[str] = None, until: Optional[str] = None,
+                             before_id: Optional[int] = None, limit: int = 100):
+    return await executor.run(memory.query_conversations, conversation_id=conversation_id, since=since,
+                              until=until, before_id=before_id, limit=limit)
+
+# Seconds between keepalives on an idle event stream (also how soon a gone viewer is noticed)
+EVENT_HEARTBEAT_SECONDS = float(os.getenv("EVENT_HEARTBEAT_SECONDS", "15"))
+event_subscribers = 0
+
+async def stream_events(sequence, filters):
+    """
+    Server-Sent Events of SharedMemory writes read from its event buffer, starting after
+    sequence. A subscriber the buffer moved past gets a gap event before the rest.
+    """
+    global event_subscribers
+    bus = memory.events
+    event_subscribers += 1
+    try:
+        while True:
+            events, last, missed = bus.read(sequence)
+            # Everything read at once goes out as one chunk
+            chunk = ["event: gap\ndata: {}\n\n"] if missed else []
+            tail = f"{bus.epoch}-{last}"
+            sent = None
+            for event_id, event in events:
+                if matches(event, filters):
+                    chunk.append(f"id: {event_id}\nevent: {event['table']}\ndata: {event['payload']}\n\n")
+                    sent = event_id
+            # An id without data moves the client's Last-Event-ID past events it filtered out
+            if events and sent != tail:
+                chunk.append(f"id: {tail}\n\n")
+            if chunk:
+                yield "".join(chunk)
+            sequence = last
+            if not await bus.wait(sequence, EVENT_HEARTBEAT_SECONDS):
+                yield ": keepalive\n\n"
+    finally:
+        event_subscribers -= 1
+
+@app.get("/events")
+async def events(request: Request, table: Optional[str] = None, agent: Optional[str] = None,
+                 intent: Optional[str] = None, alert_type: Optional[str] = None,
+                 last_event_id: Optional[str] = None):
+    """
+    Live stream of this process's SharedMemory inserts as Server-Sent Events, optionally
+    filtered by table, agent, intent and alert_type (comma-separated values). Reconnecting
+    with Last-Event-ID (or ?last_event_id=) resumes after that event from the buffer.
+    """
+    if memory.events is None:
+        return FastJSONResponse(status_code=503, content={"error": "Event stream is disabled"})
+    values = {"table": table, "agent": agent, "intent": intent, "alert_type": alert_type}
+    filters = {field: {value.strip() for value in values[field].split(",")}
+               for field in FILTER_FIELDS if values[field]}
+    sequence = memory.events.resume(request.headers.get("last-event-id") or last_event_id)
+    return StreamingResponse(stream_events(sequence, filters), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def serve_cached(cached):
+    """Record a cache hit and, if configured, fire its follow-up actions again."""
+    classification = cached["classification"]
+    memory.add_metadata({
+        "source": "result_cache",
+        "type": classification.get("format"),
+        "intent": classification.get("intent"),
+        "timestamp": agents.get("ClassifierAgent").get_timestamp()
+    })
+    agent_name = FORMAT_AGENTS.get(classification.get("format"))
+    if REPLAY_ACTIONS_ON_CACHE_HIT and agent_name in ("JSONAgent", "EmailParserAgent"):
+        # An mbox bundle's extraction holds one record per message
+        for extraction in cached["extraction"].get("messages", [cached["extraction"]]):
+            for action_type, payload in agents.get(agent_name).follow_up_actions(extraction):
+                action_router.trigger_action(action_type, payload)
+    return dict(cached, cached=True)
+
+@app.get("/actions/metrics")
+async def action_metrics():
+    # pending_writes: outbox rows and delivery updates still waiting for the write-behind queue
+    return dict(action_router.metrics(), pending_writes=memory.pending_writes())
+
+# Point-in-time gauges read when /metrics is scraped
+gauge("executor_pending", "Work items submitted to the agent pools", (),
+      lambda: {(): executor.stats()["pending"]})
+gauge("executor_active", "Requests holding a concurrency slot", ("format",),
+      lambda: {(k,): v for k, v in executor.stats()["active"].items()})
+gauge("executor_waiting", "Requests waiting for a concurrency slot", ("format",),
+      lambda: {(k,): v for k, v in executor.stats()["waiting"].items()})
+gauge("action_queue_depth", "Actions queued for the dispatcher workers", (),
+      lambda: {(): action_router.metrics()["queue_depth"]})
+gauge("action_outbox_rows", "Action outbox rows by status", ("status",),
+      lambda: {(k,): v for k, v in action_router.metrics().get("outbox", {}).items()})
+gauge("memory_write_queue_depth", "SharedMemory writes waiting for the background writer", (),
+      lambda: {(): memory.pending_writes()})
+gauge("result_cache_stats", "Result cache entries, bytes, hits and misses", ("stat",),
+      lambda: {(k,): v for k, v in result_cache.stats().items()} if result_cache is not None else {})
+gauge("job_queue_jobs", "Async intake jobs of this process by status and priority", ("status", "priority"),
+      lambda: job_queue.stats() if job_queue is not None else {})
+gauge("event_stream_subscribers", "Viewers connected to /events", (),
+      lambda: {(): event_subscribers})
+gauge("agent_load_seconds", "Time taken to import and build each agent on first use", ("agent",),
+      lambda: {(k,): v for k, v in agents.load_seconds.items()} if agents is not None else {})
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Latency histograms, counters and gauges in the Prometheus text format."""
+    # Rendered off the event loop, but outside the agent executor so scrapes still work when it is saturated
+    return PlainTextResponse(await asyncio.to_thread(REGISTRY.render), media_type="text/plain; version=0.0.4")
+
+def timed_process(agent_name, format_, intent, ctx, **kwargs):
+    """
+    Run an agent's process() and record its own duration, excluding time queued for a pool thread.
+    The agent is built here on first use, off the event loop.
+    """
+    agent = agents.get(agent_name)
+    with AGENT_SECONDS.time(agent_name, format_, intent), span("agent", agent=agent_name):
+        return agent.process(ctx, **kwargs)
+
+@contextmanager
+def stage(name, format_):
+    """Time a pipeline stage into STAGE_SECONDS and as a span of the request's trace."""
+    with STAGE_SECONDS.time(name, format_), span(name, format=format_):
+        yield
 
-# Initialize action router
-action_router = ActionRouter(memory)
+async def process_attachment(attachment, parent, intent):
+    """Run one decoded email attachment through the PDF or JSON agent, linked to its message."""
+    if attachment["format"] == "PDF":
+        pdf_agent = await executor.run(agents.get, "PDFAgent")
+        async with executor.slot("PDF", bounded=False):
+            with AGENT_SECONDS.time("PDFAgent", "PDF", intent), span("agent", agent="PDFAgent"):
+                return await pdf_agent.process_parallel(executor, attachment["payload"], parent=parent, **PDF_OPTIONS)
+    if attachment["format"] == "JSON":
+        return await executor.run(timed_process, "JSONAgent", "JSON", intent,
+                                  IntakeContext(attachment["payload"]), parent=parent)
+    return {"skipped": "No agent for this attachment type"}
 
-# Initialize agents with action router where needed
-classifier_agent = ClassifierAgent(memory)
-json_agent = JSONAgent(memory)
-email_parser_agent = EmailParserAgent(memory, action_router=action_router)
-pdf_agent = PDFAgent(memory)
+async def process_message(message, intent):
+    """
+    Parse one MIME message's body with the EmailParserAgent while its attachments are
+    processed concurrently; attachment rows in SharedMemory carry the message id as parent.
+    """
+    attachments = [{key: value for key, value in attachment.items() if key != "payload"}
+                   for attachment in message["attachments"]]
+    extra = {"message_id": message["message_id"], "attachments": attachments}
+    results = await asyncio.gather(
+        executor.run(timed_process, "EmailParserAgent", "Email", intent, IntakeContext(message["text"]), extra=extra),
+        *[process_attachment(attachment, {"message_id": message["message_id"], "filename": attachment["filename"]},
+                             intent)
+          for attachment in message["attachments"]],
+        return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, ExecutorSaturated):
+            raise result
+    record = results[0]
+    if isinstance(record, Exception):
+        raise record
+    for attachment, result in zip(attachments, results[1:]):
+        attachment["result"] = result if not isinstance(result, Exception) else {
+            "error": "Processing failed", "details": str(result)}
+    return dict(record, attachments=attachments)
+
+async def process_email(ctx, intent):
+    """
+    Flat email text goes straight to the EmailParserAgent. Raw MIME messages and mbox bundles
+    are parsed one message at a time; a bundle answers with all of its messages.
+    """
+    if not ctx.looks_like_mime:
+        return await executor.run(timed_process, "EmailParserAgent", "Email", intent, ctx)
+    records = []
+    messages = iter_messages(ctx)
+    while True:
+        message = await executor.run(next, messages, None)
+        if message is None:
+            break
+        records.append(await process_message(message, intent))
+    if len(records) == 1:
+        return records[0]
+    return {"messages": records, "message_count": len(records)}
+
+def timed_classify(ctx):
+    classifier_agent = agents.get("ClassifierAgent")
+    started = time.perf_counter()
+    classification = classifier_agent.classify(ctx)
+    elapsed = time.perf_counter() - started
+    AGENT_SECONDS.observe(elapsed, "ClassifierAgent", classification.get("format"), classification.get("intent"))
+    record_span("agent", started, elapsed, agent="ClassifierAgent")
+    return classification
+
+async def classify_input(ctx):
+    started = time.perf_counter()
+    classification = await executor.run(timed_classify, ctx)
+    elapsed = time.perf_counter() - started
+    STAGE_SECONDS.observe(elapsed, "classify", classification.get("format"))
+    record_span("classify", started, elapsed, format=classification.get("format"),
+                intent=classification.get("intent"))
+    return classification
+
+async def run_pipeline(raw_input, bounded=True, classification=None):
+    """
+    Classify one input, record its metadata and run it through the matching agent.
+    Returns (status_code, content) so single, batch and async job intake can share it.
+    classification, if given, is used instead of classifying again (and updated in place).
+    """
+    started = time.perf_counter()
+    classification = classification if classification is not None else {}
+    status_code, content = await run_stages(raw_input, bounded, classification)
+    INTAKE_SECONDS.observe(time.perf_counter() - started, classification.get("format", ""),
+                           classification.get("intent", ""), status_code)
+    return status_code, content
+
+async def run_stages(raw_input, bounded, classification):
+    # Decode and parse the input once, shared by the classifier and the agents
+    ctx = IntakeContext.wrap(raw_input)
+
+    # Serve repeated documents from the result cache
+    cache_key = None
+    if result_cache is not None:
+        try:
+            with stage("cache_lookup", ""):
+                cache_key, cached = await executor.run(result_cache.lookup, ctx)
+            if cached is not None:
+                classification.update(cached["classification"])
+                return 200, await executor.run(serve_cached, cached)
+        except ExecutorSaturated as e:
+            return e.status_code, {"error": str(e)}
+        except Exception as e:
+            logger.error(f"Result cache lookup failed: {e}")
+
+    # Classify input format and intent; async jobs arrive already classified
+    if "format" not in classification:
+        try:
+            classification.update(await classify_input(ctx))
+        except ExecutorSaturated as e:
+            return e.status_code, {"error": str(e)}
+        except Exception as e:
+            logger.error(f"Classification failed: {e}")
+            return 500, {"error": "Classification failed", "details": str(e)}
+
+    # Route to appropriate agent based on classification
+    format_ = classification.get("format")
+    intent = classification.get("intent")
+
+    try:
+        stage_started = time.perf_counter()
+        async with executor.slot(format_, bounded=bounded):
+            elapsed = time.perf_counter() - stage_started
+            STAGE_SECONDS.observe(elapsed, "slot_wait", format_)
+            record_span("slot_wait", stage_started, elapsed, format=format_)
+            try:
+                with stage("metadata", format_):
+                    await executor.run(memory.add_metadata, {
+                        "source": "user_input",
+                        "type": format_,
+                        "intent": intent,
+                        "timestamp": agents.get("ClassifierAgent").get_timestamp()
+                    })
+            except ExecutorSaturated:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to add metadata: {e}")
+                # Continue processing even if metadata fails
+
+            # Process based on format with error handling
+            try:
+                with stage("process", format_):
+                    if format_ == "JSON":
+                        result = await executor.run(timed_process, "JSONAgent", format_, intent, ctx)
+                    elif format_ == "Email":
+                        result = await process_email(ctx, intent)
+                    elif format_ == "PDF":
+                        # Parsing runs in the process pool, storing the result on a thread
+                        pdf_agent = await executor.run(agents.get, "PDFAgent")
+                        with AGENT_SECONDS.time("PDFAgent", format_, intent), span("agent", agent="PDFAgent"):
+                            result = await pdf_agent.process_parallel(executor, ctx, **PDF_OPTIONS)
+                    else:
+                        result = {"error": "Unknown format"}
+            except ExecutorSaturated:
+                raise
+            except Exception as e:
+                logger.error(f"Agent processing failed: {e}")
+                result = {"error": "Processing failed", "details": str(e)}
+    except ExecutorSaturated as e:
+        return e.status_code, {"error": str(e)}
+
+    content = {"classification": classification, "extraction": result}
+    if cache_key is not None and "error" not in result:
+        try:
+            with stage("cache_put", format_):
+                await executor.run(result_cache.put, cache_key, content)
+        except Exception as e:
+            logger.error(f"Failed to cache result: {e}")
+    return 200, content
 
 @app.options("/intake/")
 async def intake_options():
     return {"message": "OK"}
 
-from fastapi import HTTPException
+def project_intake(content, fields=None, exclude=None):
+    """
+    Shape an intake result as an IntakeResponse, keeping only the requested extraction fields
+    (parsed ?fields= / ?exclude= paths); error results are always returned whole.
+    """
+    extraction = content.get("extraction")
+    if (fields or exclude) and isinstance(extraction, dict) and "error" not in extraction:
+        content = dict(content, extraction=project(extraction, fields, exclude))
+    return intake_response(content)
 
-@app.post("/intake/")
+@app.post("/intake/", response_model=IntakeResponse)
 async def intake(
     file: Optional[UploadFile] = None,
     json_body: Optional[str] = Form(None),
-    email_body: Optional[str] = Form(None)
+    email_body: Optional[str] = Form(None),
+    mode: str = "sync",
+    fields: Optional[str] = None,
+    exclude: Optional[str] = None
 ):
     try:
         logger.info("Received request at /intake/")
         logger.info(f"file: {file}")
         logger.info(f"json_body: {json_body}")
         logger.info(f"email_body: {email_body}")
-        
-        # Add CORS headers manually as well
-        from fastapi import Response
-        from fastapi.responses import JSONResponse
 
         """
         Intake endpoint accepts either a file (PDF), JSON body, or email body text.
+        With mode=async the document is classified and queued, and a job id is returned right away.
+        fields / exclude are comma-separated extraction paths, e.g. fields=flags,invoice_total,
+        so unrequested fields (like a PDF's extracted_text) are never serialized.
         """
+        if mode not in ("sync", "async"):
+            return FastJSONResponse(status_code=400, content={"error": f"Unknown mode: {mode}"})
         raw_input = None
         if file:
-            raw_input = await file.read()
+            # Large uploads are spooled to a temp file instead of being read into memory
+            try:
+                with stage("read", ""):
+                    raw_input = await executor.run(IntakeContext.from_stream, file.file, MAX_UPLOAD_BYTES or None)
+            except InputTooLarge as e:
+                return FastJSONResponse(status_code=413, content={"error": str(e)})
         elif json_body:
             raw_input = json_body
         elif email_body:
             raw_input = email_body
         else:
-            return JSONResponse(status_code=400, content={"error": "No input provided"})
+            return FastJSONResponse(status_code=400, content={"error": "No input provided"})
+
+        if mode == "async":
+            return await submit_job(IntakeContext.wrap(raw_input))
 
-        # Classify input format and intent
         try:
-            classification = classifier_agent.classify(raw_input)
-        except Exception as e:
-            logger.error(f"Classification failed: {e}")
-            return JSONResponse(status_code=500, content={"error": "Classification failed", "details": str(e)})
+            status_code, response_content = await run_pipeline(raw_input)
+        finally:
+            if isinstance(raw_input, IntakeContext):
+                raw_input.close()
+        if status_code != 200:
+            return FastJSONResponse(status_code=status_code, content=response_content)
 
-        # Route to appropriate agent based on classification
-        format_ = classification.get("format")
-        intent = classification.get("intent")
+        response = FastJSONResponse(content=project_intake(response_content, parse_paths(fields), parse_paths(exclude)))
+        response.headers["Access-Control-Allow-Origin"] = "*"
+        response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
+        response.headers["Access-Control-Allow-Headers"] = "*"
+        return response
+    except Exception as e:
+        tb_str = traceback.format_exc()
+        logger.error(f"Error processing /intake/ request: {e}\\n{tb_str}")
+        raise HTTPException(status_code=500, detail="Internal server error")
 
-        # Fix: If format is "Unknown" but input is JSON string, set format to JSON
-        import json
-        if format_ == "Unknown":
-            try:
-                json.loads(raw_input if isinstance(raw_input, str) else raw_input.decode('utf-8'))
-                format_ = "JSON"
-            except Exception:
-                pass
 
+async def submit_job(ctx):
+    """Classify a document and queue it as an async job by priority; the job owns ctx from here on."""
+    try:
+        classification = await classify_input(ctx)
+        urgency = None
+        if classification["format"] == "Email":
+            # Reuses the classifier's keyword scan; MIME messages by the decoded text of the first message
+            engine = RuleEngine.default()
+            matches = engine.match(ctx.message_text_lower) if ctx.looks_like_mime else ctx.rule_matches(engine)
+            urgency = matches["urgency"]
+        priority = job_priority(classification["format"], classification["intent"], urgency)
+        job = await job_queue.submit(ctx, classification, priority)
+    except ExecutorSaturated as e:
+        ctx.close()
+        return FastJSONResponse(status_code=e.status_code, content={"error": str(e)})
+    except Exception:
+        ctx.close()
+        raise
+    return FastJSONResponse(status_code=202, content=dict(job, status_url=f"/jobs/{job['job_id']}"))
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, fields: Optional[str] = None, exclude: Optional[str] = None):
+    """Status of an async intake job, with its result once done (projected like /intake/)."""
+    job = await executor.run(job_queue.get, job_id)
+    if job is None:
+        return FastJSONResponse(status_code=404, content={"error": "Job not found"})
+    if job.get("result") is not None:
+        result = project_intake(job["result"], parse_paths(fields), parse_paths(exclude))
+        job = dict(job, result=result.model_dump(mode="json", exclude_unset=True))
+    return FastJSONResponse(content=job)
+
+@app.get("/traces/{trace_id}")
+async def get_trace(trace_id: str):
+    """
+    Everything recorded for one request, by the trace id returned in X-Trace-ID: its stored
+    traces and spans (the request's and its async job's, if sampled), metadata, agent outputs,
+    actions and jobs, plus all of them merged into one timeline.
+    """
+    found = await executor.run(memory.get_trace, trace_id)
+    if not any(found.values()):
+        return FastJSONResponse(status_code=404, content={"error": "Trace not found"})
+    return FastJSONResponse(content=dict(found, trace_id=trace_id, timeline=timeline(found)))
+
+
+# Documents processed concurrently per batch, and documents per grouped SharedMemory transaction
+BATCH_WINDOW = int(os.getenv("BATCH_WINDOW", "16"))
+BATCH_GROUP_SIZE = int(os.getenv("BATCH_GROUP_SIZE", "100"))
+
+def batch_document(line):
+    """
+    Map one NDJSON line to an intake input:
+    - {"email_body": "..."}, {"json_body": "..." or {...}} or {"pdf_base64": "..."}
+    - any other JSON document is taken as a JSON input itself
+    """
+    doc = json.loads(line)
+    if isinstance(doc, dict) and len(doc) == 1:
+        if "email_body" in doc:
+            return doc["email_body"]
+        if "json_body" in doc:
+            body = doc["json_body"]
+            return body if isinstance(body, str) else IntakeContext(json.dumps(body), json_data=body)
+        if "pdf_base64" in doc:
+            return base64.b64decode(doc["pdf_base64"])
+    return IntakeContext(line.decode('utf-8'), json_data=doc)
+
+async def ndjson_documents(body):
+    """Yield (index, raw_input, error) for each non-empty line of an NDJSON body."""
+    index = 0
+    start = 0
+    while start < len(body):
+        end = body.find(b"\n", start)
+        if end < 0:
+            end = len(body)
+        line = body[start:end].strip()
+        start = end + 1
+        if not line:
+            continue
+        # Decoding (json.loads, b64decode) runs on the thread pool, not the event loop
         try:
-            memory.add_metadata({
-                "source": "user_input",
-                "type": format_,
-                "intent": intent,
-                "timestamp": classifier_agent.get_timestamp()
-            })
+            raw_input, error = await executor.run(batch_document, line), None
         except Exception as e:
-            logger.error(f"Failed to add metadata: {e}")
-            # Continue processing even if metadata fails
+            raw_input, error = None, f"Invalid NDJSON line: {e}"
+        yield index, raw_input, error
+        index += 1
+
+async def multipart_documents(form):
+    """Yield (index, raw_input, error) for every uploaded file and json_body/email_body field."""
+    index = 0
+    for name, value in form.multi_items():
+        if isinstance(value, str):
+            if name not in ("json_body", "email_body"):
+                continue
+            yield index, value, None
+        else:
+            try:
+                raw_input, error = await executor.run(IntakeContext.from_stream, value.file, MAX_UPLOAD_BYTES or None), None
+            except InputTooLarge as e:
+                raw_input, error = None, str(e)
+            except Exception as e:
+                raw_input, error = None, f"Failed to read upload: {e}"
+            yield index, raw_input, error
+        index += 1
+
+async def stream_batch(documents):
+    """
+    Run batch documents through the pipeline with at most BATCH_WINDOW in flight,
+    yielding one NDJSON line per document as it completes. SharedMemory writes are
+    collected in a write group and committed every BATCH_GROUP_SIZE documents.
+    """
+    group = memory.write_group()
+    window = asyncio.Semaphore(BATCH_WINDOW)
+    results = asyncio.Queue()
 
-        # Process based on format with error handling
+    async def process_one(index, raw_input):
+        group.activate()
         try:
-            if format_ == "JSON":
-                result = json_agent.process(raw_input)
-            elif format_ == "Email":
-                result = email_parser_agent.process(raw_input)
-            elif format_ == "PDF":
-                result = pdf_agent.process(raw_input)
-            else:
-                result = {"error": "Unknown format"}
+            with span("document", index=index):
+                status_code, content = await run_pipeline(raw_input, bounded=False)
         except Exception as e:
-            logger.error(f"Agent processing failed: {e}")
-            result = {"error": "Processing failed", "details": str(e)}
+            logger.error(f"Batch document {index} failed: {e}")
+            status_code, content = 500, {"error": "Processing failed", "details": str(e)}
+        finally:
+            window.release()
+            if isinstance(raw_input, IntakeContext):
+                raw_input.close()
+        await results.put(dict(content, index=index, status=status_code))
 
-        # Trigger follow-up actions based on agent outputs if needed
-        # For example, if JSON agent detects anomalies, trigger risk alert
+    tasks = set()
+
+    async def produce():
+        # The sentinel is always put, so the consumer never waits on a producer that died
         try:
-            if format_ == "JSON" and result.get("anomalies"):
-                action_router.trigger_action("risk_alert", {"details": result["anomalies"], "timestamp": classifier_agent.get_timestamp()})
-        except Exception as e:
-            logger.error(f"Action router failed: {e}")
-            # Continue processing even if action fails
+            try:
+                async for index, raw_input, error in documents:
+                    if error:
+                        await results.put({"index": index, "status": 400, "error": error})
+                        continue
+                    await window.acquire()
+                    task = asyncio.create_task(process_one(index, raw_input))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            except Exception as e:
+                logger.error(f"Reading the batch failed: {e}")
+                await results.put({"status": 400, "error": "Failed to read batch", "details": str(e)})
+            await asyncio.gather(*tasks)
+        finally:
+            results.put_nowait(None)
+
+    producer = asyncio.create_task(produce())
+    completed = 0
+    try:
+        while True:
+            item = await results.get()
+            if item is None:
+                break
+            completed += 1
+            if completed % BATCH_GROUP_SIZE == 0:
+                await executor.run(memory.commit_group, group)
+            yield json.dumps(item, default=str) + "\n"
+        await producer
+    finally:
+        if not producer.done():
+            producer.cancel()
+        # On client disconnect, documents already running finish first, so their writes,
+        # outbox actions and pending-message releases are part of the final commit
+        await asyncio.gather(producer, *tasks, return_exceptions=True)
+        await executor.run(memory.commit_group, group)
+
+@app.post("/intake/batch")
+async def intake_batch(request: Request):
+    """
+    Batch intake: accepts a multipart bundle (any number of files and json_body/email_body
+    fields) or an NDJSON body with one document per line, and streams back one NDJSON
+    result line per document, tagged with its index, in completion order.
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form(max_files=10000, max_fields=10000)
+        return StreamingResponse(stream_batch(multipart_documents(form)), media_type="application/x-ndjson",
+                                 background=BackgroundTask(form.close))
+    # The body is read up front so it isn't consumed while the response streams
+    body = await request.body()
+    return StreamingResponse(stream_batch(ndjson_documents(body)), media_type="application/x-ndjson")
 
-        response_content = {"classification": classification, "extraction": result}
-        response = JSONResponse(content=response_content)
-        response.headers["Access-Control-Allow-Origin"] = "*"
-        response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
-        response.headers["Access-Control-Allow-Headers"] = "*"
-        return response
-    except Exception as e:
-        import traceback
-        tb_str = traceback.format_exc()
-        logger.error(f"Error processing /intake/ request: {e}\\n{tb_str}")
-        raise HTTPException(status_code=500, detail="Internal server error")
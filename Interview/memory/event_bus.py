@@ -0,0 +1,90 @@
+import uuid
+import asyncio
+import threading
+import itertools
+from collections import deque
+
+# Event fields subscribers can filter on
+FILTER_FIELDS = ("table", "agent", "intent", "alert_type")
+
+
+def parse_event_id(value):
+    """Split a "<epoch>-<sequence>" event id; (None, None) if it is malformed."""
+    epoch, _, sequence = (value or "").rpartition("-")
+    if not epoch or not sequence.isdigit():
+        return None, None
+    return epoch, int(sequence)
+
+
+def matches(event, filters):
+    """Whether event passes filters, a dict of field -> set of accepted values (any of them, within a field)."""
+    return all(event.get(field) in accepted for field, accepted in filters.items())
+
+
+class EventBus:
+    def __init__(self, capacity=10000):
+        """
+        In-process publish/subscribe of SharedMemory writes:
+        - publish() appends an event to a ring buffer of the last capacity events, so
+          subscribers never read SQLite and a slow one can't hold back writers
+        - events get ids "<epoch>-<sequence>"; the epoch changes with each process, so a
+          subscriber resuming with an id from another process or run is detected
+        - publish() may be called from any thread; wait() wakes every subscriber of an
+          event loop with one callback per publish, however many are waiting
+        """
+        self.capacity = capacity
+        self.epoch = uuid.uuid4().hex[:8]
+        self._events = deque(maxlen=capacity)
+        self._sequence = itertools.count(1)
+        self._last = 0
+        self._signals = {}
+        self._lock = threading.Lock()
+
+    def publish(self, event):
+        with self._lock:
+            self._last = next(self._sequence)
+            self._events.append((self._last, event))
+            signals, self._signals = self._signals, {}
+        for loop, signal in signals.items():
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(signal.set)
+
+    def resume(self, event_id=None):
+        """
+        Sequence number to read() after for a subscriber that last saw event_id, or that
+        starts following now without one. An id this process didn't issue (another worker,
+        an earlier run) replays the whole buffer, reported as missed events.
+        """
+        with self._lock:
+            if event_id is None:
+                return self._last
+            epoch, sequence = parse_event_id(event_id)
+            if epoch == self.epoch and sequence <= self._last:
+                return sequence
+            return -1
+
+    def read(self, sequence):
+        """
+        Events published after sequence as (event id, event) pairs, the newest sequence
+        number, and whether events after sequence already left the buffer (missed).
+        """
+        with self._lock:
+            oldest = self._events[0][0] if self._events else self._last + 1
+            missed = sequence + 1 < oldest
+            events = list(itertools.islice(self._events, max(sequence + 1 - oldest, 0), None))
+            return [(f"{self.epoch}-{number}", event) for number, event in events], self._last, missed
+
+    async def wait(self, sequence, timeout=None):
+        """Wait until an event newer than sequence is published; False if timeout elapsed first."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._last > sequence:
+                return True
+            signal = self._signals.get(loop)
+            if signal is None:
+                signal = self._signals[loop] = asyncio.Event()
+        try:
+            await asyncio.wait_for(signal.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
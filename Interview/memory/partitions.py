@@ -0,0 +1,74 @@
+import os
+import re
+import calendar
+from datetime import date, datetime, timedelta
+
+# Row ids of a partition start at its ordinal times this span, so ids grow across partitions
+# and keyset pagination (ORDER BY id DESC) works over all of them
+PARTITION_ID_SPAN = 10 ** 9
+
+PERIODS = ("day", "week")
+
+
+class PartitionScheme:
+    def __init__(self, db_path, period="day"):
+        """
+        Naming and time ranges of SharedMemory partitions, one SQLite file per period:
+        - "day": memory.2024-01-15.db, "week": memory.2024-W03.db (ISO weeks, starting Monday)
+        - Periods are in UTC, like the stored timestamps
+        """
+        if period not in PERIODS:
+            raise ValueError(f"Unknown partition period: {period}")
+        self.period = period
+        self.directory = os.path.dirname(os.path.abspath(db_path))
+        self.stem = os.path.splitext(os.path.basename(db_path))[0]
+        key_pattern = r"\d{4}-\d{2}-\d{2}" if period == "day" else r"\d{4}-W\d{2}"
+        self._file_pattern = re.compile(rf"^{re.escape(self.stem)}\.({key_pattern})\.db$")
+
+    def key_for(self, when):
+        if self.period == "day":
+            return when.strftime("%Y-%m-%d")
+        return when.strftime("%G-W%V")
+
+    def start_of(self, key):
+        if self.period == "day":
+            return date.fromisoformat(key)
+        return datetime.strptime(key + "-1", "%G-W%V-%u").date()
+
+    def end_of(self, key):
+        return self.start_of(key) + timedelta(days=1 if self.period == "day" else 7)
+
+    def expires_at(self, key):
+        """Unix timestamp at which key stops being the current partition."""
+        return calendar.timegm(self.end_of(key).timetuple())
+
+    def id_base(self, key):
+        ordinal = self.start_of(key).toordinal()
+        return (ordinal if self.period == "day" else ordinal // 7) * PARTITION_ID_SPAN
+
+    def path_for(self, key):
+        return os.path.join(self.directory, f"{self.stem}.{key}.db")
+
+    def discover(self):
+        """Keys of the partition files on disk, oldest first."""
+        keys = []
+        for name in os.listdir(self.directory):
+            match = self._file_pattern.match(name)
+            if match:
+                keys.append(match.group(1))
+        return sorted(keys, key=self.start_of)
+
+    def overlaps(self, key, since=None, until=None):
+        """Whether the partition can hold rows with since <= timestamp < until (ISO strings)."""
+        if since is not None and self.end_of(key).isoformat() <= since[:10]:
+            return False
+        if until is not None and self.start_of(key).isoformat() >= until:
+            return False
+        return True
+
+    def remove_files(self, key):
+        """Unlink a partition's database file and its WAL side files."""
+        path = self.path_for(key)
+        for suffix in ("", "-wal", "-shm", "-journal"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
@@ -0,0 +1,76 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    def __init__(self, memory, version, max_entries=1024, max_bytes=64 * 1024 * 1024, ttl=3600):
+        """
+        Content-addressed cache of pipeline results:
+        - Keyed by the SHA-256 of the raw input plus the agent/rule version
+        - In-process LRU bounded by entry count and serialized size, entries expire after ttl seconds
+        - Backed by the result_cache table in SharedMemory, so hits survive restarts
+          and are shared between workers
+        """
+        self.memory = memory
+        self.version = version
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, raw):
+        """raw is the input's bytes, or anything with a sha256 hex digest attribute (e.g. an IntakeContext)."""
+        digest = raw.sha256 if hasattr(raw, "sha256") else hashlib.sha256(raw).hexdigest()
+        return f"{digest}:{self.version}"
+
+    def _remember(self, key, value, size, created_at):
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size, created_at)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def get(self, key):
+        """Return the cached {"classification", "extraction"} for key, or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now - entry[2] < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                self._bytes -= entry[1]
+                del self._entries[key]
+
+        row = self.memory.get_cached_result(key, now - self.ttl)
+        if row is None:
+            self.misses += 1
+            return None
+        value, size, created_at = row
+        self._remember(key, value, size, created_at)
+        self.hits += 1
+        return value
+
+    def lookup(self, raw):
+        """Hash raw and look it up; returns (key, value or None)."""
+        key = self.key(raw)
+        return key, self.get(key)
+
+    def put(self, key, value):
+        created_at = time.time()
+        size = self.memory.put_cached_result(key, value, created_at)
+        self._remember(key, value, size, created_at)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
@@ -1,105 +1,1204 @@
 import sqlite3
 import threading
+import queue
+import contextvars
+import time
 import json
+import zlib
+import hashlib
 from datetime import datetime
+from memory.partitions import PartitionScheme
+from memory.event_bus import EventBus
+from memory.writer_service import WriterClient
+from metrics import MEMORY_LOCK_WAIT_SECONDS, MEMORY_WRITE_SECONDS, MEMORY_STATEMENTS
+from tracing import current_trace_id
+
+_FLUSH = object()
+_STOP = object()
+
+# Write group collecting the writes made in the current context, see SharedMemory.write_group
+_current_group = contextvars.ContextVar("shared_memory_write_group", default=None)
+
+# Columns of each table, and which of them hold JSON documents
+_COLUMNS = {
+    "metadata": ("id", "source", "type", "intent", "timestamp", "trace_id"),
+    "extracted_fields": ("id", "agent", "data", "timestamp", "trace_id"),
+    "conversations": ("id", "conversation_id", "metadata", "timestamp", "trace_id")
+}
+_JSON_COLUMNS = {"data", "metadata"}
+MAX_PAGE_SIZE = 1000
+
+# Urgency levels in increasing order, for the highest urgency seen in a conversation
+URGENCY_RANKS = {"Low": 0, "Medium": 1, "High": 2}
+
+# Locks serializing the handling of one conversation's messages, picked by conversation id hash
+CONVERSATION_LOCK_STRIPES = 64
+
+# Key marking a field that was moved to the blobs table: {"$blob": sha256, "size": bytes}
+BLOB_REF_KEY = "$blob"
+
+
+def _alert_type(data):
+    # JSON anomaly alerts name their type; ActionRouter outcomes are tagged with their action (e.g. risk_alert)
+    if not isinstance(data, dict):
+        return None
+    return data.get("alert_type") or data.get("action")
+
+
+class WriteGroup:
+    def __init__(self):
+        self._statements = []
+        self._lock = threading.Lock()
+
+    def activate(self):
+        """Route SharedMemory writes made in the current context into this group."""
+        return _current_group.set(self)
+
+    def add(self, statements):
+        with self._lock:
+            self._statements.extend(statements)
+
+    def take(self):
+        with self._lock:
+            statements, self._statements = self._statements, []
+            return statements
+
 
 class SharedMemory:
-    def __init__(self, db_path='memory.db'):
+    def __init__(self, db_path='memory.db', write_behind=False, batch_size=200,
+                 flush_interval=0.05, max_queue=10000, blob_threshold=4096, partition=None, retention=None,
+                 writer_address=None, writer_authkey=None, event_buffer=10000):
+        """
+        SQLite backed store shared by all agents.
+        - Writes go through one long-lived connection in WAL mode
+        - With write_behind=True, writes are queued and committed by a background
+          writer thread in batched transactions (flushed every flush_interval seconds
+          or every batch_size writes, whichever comes first)
+        - Reads use per-thread connections and don't wait for the writer
+        - Top-level string fields of agent outputs of blob_threshold bytes or more
+          (e.g. PDF extracted_text) are stored zlib-compressed in the blobs table,
+          deduplicated by SHA-256, and referenced from the row; 0 keeps them inline
+        - partition="day" or "week" stores metadata, extracted_fields, conversations and
+          blobs in one SQLite file per period (memory.2024-01-15.db); writes go to the
+          current period's file, queries span all of them, and retention keeps only the
+          newest retention partitions by unlinking older files whole. Outbox and result
+          cache stay in db_path. Rows already in db_path are still read, as the oldest data.
+        - writer_address, the Unix socket of a WriterService, makes this a client for
+          multi-process deployments: writes are queued as with write_behind and forwarded
+          in batches to the one process owning the database, outbox claims are made by
+          it, and reads still open db_path directly. The service creates the schema, so
+          partition and blob_threshold must match its configuration.
+        - every metadata, extracted_fields and conversations insert made through this
+          instance is published to self.events, a ring buffer of the last event_buffer
+          rows that live viewers follow without querying SQLite; 0 disables it. Rows are
+          published when the write is accepted, which with write_behind or a write group
+          is shortly before it is committed.
+        """
         self.db_path = db_path
         self.lock = threading.Lock()
-        self._initialize_db()
+        self.write_behind = write_behind
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.blob_threshold = blob_threshold
+        self.retention = retention
+        self._partitions = PartitionScheme(db_path, partition) if partition else None
+        self._schema = "part" if partition else "main"
+        self._partition_key = None
+        self._partition_expires = 0
+        self._partition_keys = []
+        self._dropped = set()
+        self._migrated = set()
+        self._local = threading.local()
+        self._readers = []
+        self._conn = None
+        self._remote = None
+        self.events = EventBus(event_buffer) if event_buffer else None
+        # Conversation messages accepted but not committed yet, by conversation id (see get_conversation_state)
+        self._pending_messages = {}
+        self._commit_lock = threading.Lock()
+        self._conversation_locks = [threading.Lock() for _ in range(CONVERSATION_LOCK_STRIPES)]
+        if writer_address:
+            self.write_behind = True
+            self._remote = WriterClient(writer_address, writer_authkey)
+            # Waits for the service, which owns the schema, to be up
+            self._remote.call("ping")
+        else:
+            self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._initialize_db()
+
+        self._queue = None
+        self._writer = None
+        if self.write_behind:
+            self._queue = queue.Queue(maxsize=max_queue)
+            self._writer = threading.Thread(target=self._writer_loop, name="shared-memory-writer", daemon=True)
+            self._writer.start()
 
     def _initialize_db(self):
         try:
-            with self.lock, sqlite3.connect(self.db_path, timeout=10) as conn:
-                cursor = conn.cursor()
+            with self.lock:
+                cursor = self._conn.cursor()
+                self._create_document_tables(cursor, "main")
                 cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS metadata (
+                    CREATE TABLE IF NOT EXISTS action_outbox (
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        source TEXT,
-                        type TEXT,
-                        intent TEXT,
-                        timestamp TEXT
+                        action_type TEXT,
+                        payload TEXT,
+                        status TEXT DEFAULT 'pending',
+                        attempts INTEGER DEFAULT 0,
+                        next_attempt_at REAL,
+                        claimed_at REAL,
+                        last_error TEXT,
+                        created_at TEXT,
+                        delivered_at TEXT,
+                        trace_id TEXT
                     )
                 ''')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_action_outbox_due ON action_outbox (status, next_attempt_at)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_action_outbox_claimed ON action_outbox (status, claimed_at)')
                 cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS extracted_fields (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        agent TEXT,
-                        data TEXT,
-                        timestamp TEXT
+                    CREATE TABLE IF NOT EXISTS result_cache (
+                        key TEXT PRIMARY KEY,
+                        value TEXT,
+                        created_at REAL
+                    )
+                ''')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_result_cache_created_at ON result_cache (created_at)')
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS jobs (
+                        id TEXT PRIMARY KEY,
+                        status TEXT,
+                        priority TEXT,
+                        classification TEXT,
+                        result TEXT,
+                        error TEXT,
+                        created_at TEXT,
+                        updated_at TEXT,
+                        trace_id TEXT,
+                        owner TEXT
                     )
                 ''')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_updated_at ON jobs (updated_at)')
+                for table in ("action_outbox", "jobs"):
+                    self._add_trace_column(cursor, "main", table)
+                # The process running a job, for recovering the jobs of one that died
+                cursor.execute('PRAGMA main.table_info(jobs)')
+                if "owner" not in {row[1] for row in cursor.fetchall()}:
+                    cursor.execute('ALTER TABLE jobs ADD COLUMN owner TEXT')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)')
                 cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS conversations (
+                    CREATE TABLE IF NOT EXISTS traces (
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        conversation_id TEXT,
-                        metadata TEXT,
-                        timestamp TEXT
+                        trace_id TEXT,
+                        name TEXT,
+                        status INTEGER,
+                        started_at TEXT,
+                        duration REAL,
+                        spans TEXT
+                    )
+                ''')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_traces_trace_id ON traces (trace_id)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_traces_started_at ON traces (started_at)')
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'conversation_state'")
+                backfill = cursor.fetchone() is None
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS conversation_state (
+                        conversation_id TEXT PRIMARY KEY,
+                        message_count INTEGER,
+                        last_sender TEXT,
+                        max_urgency TEXT,
+                        urgency_rank INTEGER,
+                        escalated INTEGER,
+                        first_timestamp TEXT,
+                        last_timestamp TEXT
                     )
                 ''')
-                conn.commit()
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversation_state_last_timestamp ON conversation_state (last_timestamp)')
+                if self._partitions is not None:
+                    self._roll_partition()
         except sqlite3.Error as e:
             print(f"Database initialization error: {e}")
             raise
+        if backfill:
+            self.rebuild_conversation_state()
+
+    def _create_document_tables(self, cursor, schema):
+        """Create the append-only document tables (the ones that get partitioned) in schema."""
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {schema}.metadata (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                source TEXT,
+                type TEXT,
+                intent TEXT,
+                timestamp TEXT,
+                trace_id TEXT
+            )
+        ''')
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {schema}.extracted_fields (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                agent TEXT,
+                data TEXT,
+                timestamp TEXT,
+                trace_id TEXT
+            )
+        ''')
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {schema}.conversations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                conversation_id TEXT,
+                metadata TEXT,
+                timestamp TEXT,
+                trace_id TEXT
+            )
+        ''')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {schema}.idx_metadata_type ON metadata (type)')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {schema}.idx_metadata_intent ON metadata (intent)')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {schema}.idx_metadata_timestamp ON metadata (timestamp)')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {schema}.idx_extracted_fields_agent ON extracted_fields (agent)')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {schema}.idx_extracted_fields_timestamp ON extracted_fields (timestamp)')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {schema}.idx_conversations_conversation_id ON conversations (conversation_id)')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {schema}.idx_conversations_timestamp ON conversations (timestamp)')
+        for table in _COLUMNS:
+            self._add_trace_column(cursor, schema, table)
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {schema}.blobs (
+                hash TEXT PRIMARY KEY,
+                codec TEXT,
+                size INTEGER,
+                data BLOB,
+                created_at TEXT
+            )
+        ''')
+
+    def _add_trace_column(self, cursor, schema, table):
+        """Add the indexed trace_id column to a table created before request tracing."""
+        cursor.execute(f'PRAGMA {schema}.table_info({table})')
+        if "trace_id" not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute(f'ALTER TABLE {schema}.{table} ADD COLUMN trace_id TEXT')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {schema}.idx_{table}_trace_id ON {table} (trace_id)')
+
+    def _migrate_partitions(self, keys):
+        """Add trace_id to older partitions too, so queries can select it from every partition."""
+        for key in keys:
+            if key in self._migrated:
+                continue
+            conn = sqlite3.connect(self._partitions.path_for(key), timeout=30, isolation_level=None)
+            try:
+                cursor = conn.cursor()
+                cursor.execute('BEGIN')
+                for table in _COLUMNS:
+                    self._add_trace_column(cursor, "main", table)
+                cursor.execute('COMMIT')
+            finally:
+                conn.close()
+            self._migrated.add(key)
+
+    def _roll_partition(self):
+        """
+        Attach the partition for the current period to the write connection as "part",
+        creating it if needed, then apply retention. Called with the lock held, outside a transaction.
+        """
+        key = self._partitions.key_for(datetime.utcnow())
+        if key == self._partition_key:
+            return
+        if self._partition_key is not None:
+            self._conn.execute('DETACH DATABASE part')
+        self._conn.execute('ATTACH DATABASE ? AS part', (self._partitions.path_for(key),))
+        self._conn.execute('PRAGMA part.journal_mode=WAL')
+        self._conn.execute('PRAGMA part.synchronous=NORMAL')
+        cursor = self._conn.cursor()
+        cursor.execute('BEGIN')
+        try:
+            self._create_document_tables(cursor, "part")
+            # Start this partition's ids above every earlier partition's
+            base = self._partitions.id_base(key)
+            for table in _COLUMNS:
+                cursor.execute('''
+                    INSERT INTO part.sqlite_sequence (name, seq)
+                    SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM part.sqlite_sequence WHERE name = ?)
+                ''', (table, base, table))
+            cursor.execute('COMMIT')
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+        self._partition_key = key
+        self._partition_expires = self._partitions.expires_at(key)
+        self._migrated.add(key)
+        keys = set(self._partitions.discover()) - self._dropped
+        keys.add(key)
+        self._partition_keys = sorted(keys, key=self._partitions.start_of)
+        self._migrate_partitions(self._partition_keys)
+        self._apply_retention()
+
+    def _apply_retention(self):
+        if self.retention:
+            expired = self._partition_keys[:-self.retention]
+            self._partition_keys = self._partition_keys[-self.retention:]
+            self._dropped.update(expired)
+        # Files still open elsewhere (e.g. on Windows) are retried on the next pass
+        for key in sorted(self._dropped):
+            try:
+                self._partitions.remove_files(key)
+                self._dropped.discard(key)
+            except OSError as e:
+                print(f"Warning: Failed to remove partition {key}: {e}")
+
+    def apply_retention(self):
+        """Drop partitions beyond the retention count by unlinking their files (done by the writer service for its clients)."""
+        if self._partitions is not None and self._remote is None:
+            with self.lock:
+                self._apply_retention()
+
+    def partitions(self):
+        """Keys of the live partitions, oldest first (empty when not partitioned)."""
+        return list(self._partition_keys)
+
+    def _reader(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            self._local.conn = conn
+            self._readers.append(conn)
+        return conn
+
+    def _execute_groups(self, groups, operation="write"):
+        """
+        Commit several write groups, each a list of (sql, params), in one transaction.
+        Lock wait and transaction time are recorded separately per operation.
+        A (None, callback) entry is a commit hook, see _settle.
+        """
+        waiting = time.perf_counter()
+        with self.lock:
+            started = time.perf_counter()
+            MEMORY_LOCK_WAIT_SECONDS.observe(started - waiting, operation)
+            if self._partitions is not None and time.time() >= self._partition_expires:
+                self._roll_partition()
+            cursor = self._conn.cursor()
+            cursor.execute('BEGIN')
+            try:
+                count = 0
+                for statements in groups:
+                    for sql, params in statements:
+                        if sql is not None:
+                            cursor.execute(sql, params)
+                            count += 1
+                # Hooks run with the commit so readers see their writes as pending or committed, never neither
+                with self._commit_lock:
+                    cursor.execute('COMMIT')
+                    self._run_hooks(groups)
+            except Exception:
+                if self._conn.in_transaction:
+                    cursor.execute('ROLLBACK')
+                raise
+            finally:
+                MEMORY_WRITE_SECONDS.observe(time.perf_counter() - started, operation)
+        MEMORY_STATEMENTS.inc(operation, amount=count)
+
+    def _run_hooks(self, groups):
+        for statements in groups:
+            for sql, hook in statements:
+                if sql is None:
+                    try:
+                        hook()
+                    except Exception as e:
+                        print(f"Warning: Write hook failed: {e}")
+
+    def _settle(self, groups):
+        """
+        Run the commit hooks of write groups that were forwarded or dropped instead of
+        committed here. Hooks run once per group whatever its fate, e.g. to stop counting
+        a conversation message as pending.
+        """
+        with self._commit_lock:
+            self._run_hooks(groups)
+
+    def _write(self, statements):
+        group = _current_group.get()
+        if group is not None:
+            group.add(statements)
+        else:
+            self._write_now(statements)
+
+    def _writer_loop(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            items = [item]
+            if item is _STOP:
+                stop = True
+            elif item is not _FLUSH:
+                # Collect more writes until the batch is full or the interval elapses
+                deadline = time.monotonic() + self.flush_interval
+                while len(items) < self.batch_size:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+                    items.append(item)
+                    if item is _FLUSH:
+                        break
+                    if item is _STOP:
+                        stop = True
+                        break
+
+            groups = [i for i in items if i is not _FLUSH and i is not _STOP]
+            try:
+                if groups:
+                    self._commit_batch(groups)
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+
+    def _commit_batch(self, groups):
+        if self._remote is not None:
+            forwarded = [[(sql, params) for sql, params in statements if sql is not None] for statements in groups]
+            try:
+                # Commit hooks stay in this process and may only run once the rows exist, so
+                # groups with hooks wait for the service to commit them; others are just sent
+                if any(sql is None for statements in groups for sql, _ in statements):
+                    self._remote.call("commit", forwarded)
+                else:
+                    self._remote.write(forwarded)
+            except (OSError, EOFError) as e:
+                print(f"Warning: Dropping {len(groups)} writes, writer service unreachable: {e}")
+            except RuntimeError as e:
+                print(f"Warning: {e}")
+            finally:
+                self._settle(groups)
+            return
+        try:
+            self._execute_groups(groups, "batch")
+        except sqlite3.Error as e:
+            # Retry one group at a time so a single bad write doesn't drop the batch
+            print(f"Warning: Batched write failed, retrying individually: {e}")
+            for statements in groups:
+                try:
+                    self._execute_groups([statements], "batch")
+                except sqlite3.Error as e:
+                    print(f"Warning: Dropping write that failed: {e}")
+                    self._settle([statements])
+
+    def write_group(self):
+        """
+        Create a WriteGroup. Activate it with group.activate() in a context (an asyncio
+        task, or threads started through AgentExecutor.run) to collect that context's
+        writes, then commit_group() stores everything collected so far in one transaction.
+        """
+        return WriteGroup()
+
+    def commit_group(self, group):
+        statements = group.take()
+        if statements:
+            self._write_now(statements)
+
+    def enqueue_writes(self, groups):
+        """Queue write groups forwarded by another process (see WriterService); each is committed atomically."""
+        for statements in groups:
+            self._write_now(statements)
+
+    def pending_writes(self):
+        """Writes queued for the background writer and not committed yet, including the batch being committed."""
+        return self._queue.unfinished_tasks if self._queue is not None else 0
+
+    def _write_now(self, statements):
+        if self._queue is None:
+            try:
+                self._execute_groups([statements])
+            except Exception:
+                self._settle([statements])
+                raise
+        else:
+            self._queue.put(statements)
+
+    def flush(self):
+        """Block until every queued write has been committed."""
+        if self._queue is not None:
+            self._queue.put(_FLUSH)
+            self._queue.join()
+        if self._remote is not None:
+            self._remote.call("flush")
+
+    def close(self):
+        if self._writer is not None:
+            self._queue.put(_STOP)
+            self._writer.join()
+            self._writer = None
+            self._queue = None
+        for conn in self._readers:
+            conn.close()
+        self._readers = []
+        if self._remote is not None:
+            self._remote.close()
+        else:
+            self._conn.close()
+
+    def _publish(self, table, fields, body_key=None, body=None):
+        """
+        Publish a row accepted for table to the event buffer. fields are the row's small
+        columns (including the filter fields); body is its JSON document column, already
+        serialized for the insert, and is spliced in rather than encoded again.
+        """
+        if self.events is None:
+            return
+        payload = json.dumps(dict(fields, table=table))
+        if body_key is not None:
+            payload = f'{payload[:-1]}, "{body_key}": {body}}}'
+        self.events.publish(dict(
+            table=table,
+            agent=fields.get("agent"),
+            intent=fields.get("intent"),
+            alert_type=fields.get("alert_type"),
+            payload=payload
+        ))
 
     def add_metadata(self, metadata: dict):
-        with self.lock, sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO metadata (source, type, intent, timestamp)
+        row = {
+            "source": metadata.get('source'),
+            "type": metadata.get('type'),
+            "intent": metadata.get('intent'),
+            "timestamp": metadata.get('timestamp', datetime.utcnow().isoformat()),
+            "trace_id": current_trace_id()
+        }
+        self._write([(f'''
+            INSERT INTO {self._schema}.metadata (source, type, intent, timestamp, trace_id)
+            VALUES (?, ?, ?, ?, ?)
+        ''', tuple(row.values()))])
+        self._publish("metadata", row)
+
+    def add_extracted_fields(self, agent: str, data: dict, actions=None, trace_id=None, on_commit=None):
+        """
+        Store an agent's output. actions, a list of (action_type, payload), are added to
+        the action outbox in the same transaction, so they are queued if and only if the
+        output is stored. Large text fields go to the blobs table in that transaction too.
+        Rows carry trace_id, by default the current request's (see tracing).
+        on_commit is called once the transaction is committed (see _settle), e.g. to wake
+        the outbox drainer only when the actions can be claimed.
+        """
+        self.add_extracted_fields_batch([(agent, data)], actions=actions, trace_id=trace_id, on_commit=on_commit)
+
+    def add_extracted_fields_batch(self, rows, actions=None, trace_id=None, on_commit=None):
+        """Store a list of (agent, data) outputs and their actions in one transaction."""
+        timestamp = datetime.utcnow().isoformat()
+        trace_id = trace_id or current_trace_id()
+        statements = []
+        stored = []
+        for agent, data in rows:
+            data, blob_statements = self._split_blobs(data)
+            statements.extend(blob_statements)
+            encoded = json.dumps(data)
+            statements.append((f'''
+                INSERT INTO {self._schema}.extracted_fields (agent, data, timestamp, trace_id)
                 VALUES (?, ?, ?, ?)
-            ''', (
-                metadata.get('source'),
-                metadata.get('type'),
-                metadata.get('intent'),
-                metadata.get('timestamp', datetime.utcnow().isoformat())
-            ))
-            conn.commit()
-
-    def add_extracted_fields(self, agent: str, data: dict):
-        with self.lock, sqlite3.connect(self.db_path) as conn:
+            ''', (agent, encoded, timestamp, trace_id)))
+            stored.append((agent, data, encoded))
+        self._write(statements + self._outbox_statements(actions or []) + self._commit_hooks(on_commit))
+        for agent, data, encoded in stored:
+            self._publish("extracted_fields", {
+                "agent": agent,
+                "intent": data.get("intent") if isinstance(data, dict) else None,
+                "alert_type": _alert_type(data),
+                "timestamp": timestamp,
+                "trace_id": trace_id
+            }, "data", encoded)
+
+    def _split_blobs(self, data):
+        """Replace large top-level string fields with blob references; returns (data, blob insert statements)."""
+        if not self.blob_threshold or not isinstance(data, dict):
+            return data, []
+        stored = None
+        statements = []
+        for key, value in data.items():
+            # A character is at most 4 UTF-8 bytes, so shorter strings are skipped without encoding
+            if not isinstance(value, str) or len(value) < self.blob_threshold // 4:
+                continue
+            raw = value.encode('utf-8')
+            if len(raw) < self.blob_threshold:
+                continue
+            digest = hashlib.sha256(raw).hexdigest()
+            if stored is None:
+                stored = dict(data)
+            stored[key] = {BLOB_REF_KEY: digest, "size": len(raw)}
+            # Identical text (a re-sent document) is compressed and stored only once
+            if not self._blob_exists(digest):
+                statements.append((f'''
+                    INSERT OR IGNORE INTO {self._schema}.blobs (hash, codec, size, data, created_at)
+                    VALUES (?, 'zlib', ?, ?, ?)
+                ''', (digest, len(raw), zlib.compress(raw), datetime.utcnow().isoformat())))
+        return stored or data, statements
+
+    def _blob_exists(self, digest):
+        # Only the current partition counts: blobs are dropped with their partition
+        if self._partitions is None:
+            conn = self._reader()
+        else:
+            self._refresh_partitions()
+            if self._partition_key not in self._partition_keys:
+                return False
+            conn = self._partition_reader(self._partition_key)
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1 FROM blobs WHERE hash = ?', (digest,))
+        return cursor.fetchone() is not None
+
+    def get_blob(self, digest):
+        """Load and decompress one blob by its hash; None if it doesn't exist."""
+        for conn in self._read_sources():
             cursor = conn.cursor()
+            cursor.execute('SELECT codec, data FROM blobs WHERE hash = ?', (digest,))
+            row = cursor.fetchone()
+            if row is not None:
+                break
+        else:
+            return None
+        codec, data = row
+        raw = zlib.decompress(data) if codec == "zlib" else data
+        return raw.decode('utf-8')
+
+    def resolve_blobs(self, data):
+        """Return a copy of data with blob references replaced by their text."""
+        if not isinstance(data, dict):
+            return data
+        resolved = dict(data)
+        for key, value in data.items():
+            if isinstance(value, dict) and BLOB_REF_KEY in value:
+                resolved[key] = self.get_blob(value[BLOB_REF_KEY])
+        return resolved
+
+    def add_conversation(self, conversation_id: str, metadata: dict, escalated=None):
+        """
+        Append a message to a conversation and fold it into the conversation's summary
+        in the same transaction. escalated defaults to an escalating tone or High urgency;
+        an explicit value is kept with the message so rebuilds give the same summary.
+        Until it is committed (write-behind, write groups) the message is counted as
+        pending by get_conversation_state.
+        """
+        timestamp = datetime.utcnow().isoformat()
+        if escalated is not None:
+            metadata = dict(metadata, escalated=bool(escalated))
+        encoded = json.dumps(metadata)
+        trace_id = current_trace_id()
+        statement = self._conversation_state_statement(conversation_id, metadata, timestamp, escalated)
+        message = (metadata.get("sender"), metadata.get("urgency"), statement[1][4], timestamp)
+        with self._commit_lock:
+            self._pending_messages.setdefault(conversation_id, []).append(message)
+        self._write([(f'''
+            INSERT INTO {self._schema}.conversations (conversation_id, metadata, timestamp, trace_id)
+            VALUES (?, ?, ?, ?)
+        ''', (
+            conversation_id,
+            encoded,
+            timestamp,
+            trace_id
+        )), statement, (None, lambda: self._release_pending(conversation_id, message))])
+        self._publish("conversations", {
+            "conversation_id": conversation_id,
+            "intent": metadata.get("intent"),
+            "timestamp": timestamp,
+            "trace_id": trace_id
+        }, "metadata", encoded)
+
+    def _conversation_state_statement(self, conversation_id, metadata, timestamp, escalated=None):
+        urgency = metadata.get("urgency")
+        if escalated is None:
+            escalated = metadata.get("escalated",
+                                     metadata.get("tone") == "escalation" or urgency == "High")
+        # Messages may be folded in out of order (e.g. a rebuild), so every field is order independent
+        return ('''
+            INSERT INTO conversation_state (conversation_id, message_count, last_sender, max_urgency,
+                                            urgency_rank, escalated, first_timestamp, last_timestamp)
+            VALUES (?, 1, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (conversation_id) DO UPDATE SET
+                message_count = message_count + 1,
+                last_sender = CASE WHEN excluded.last_timestamp >= last_timestamp
+                                   THEN excluded.last_sender ELSE last_sender END,
+                max_urgency = CASE WHEN excluded.urgency_rank > urgency_rank
+                                   THEN excluded.max_urgency ELSE max_urgency END,
+                urgency_rank = MAX(urgency_rank, excluded.urgency_rank),
+                escalated = MAX(escalated, excluded.escalated),
+                first_timestamp = MIN(first_timestamp, excluded.first_timestamp),
+                last_timestamp = MAX(last_timestamp, excluded.last_timestamp)
+        ''', (conversation_id, metadata.get("sender"), urgency, URGENCY_RANKS.get(urgency, -1),
+              1 if escalated else 0, timestamp, timestamp))
+
+    def _release_pending(self, conversation_id, message):
+        # Called with _commit_lock held, once per message
+        pending = self._pending_messages.get(conversation_id, [])
+        if message in pending:
+            pending.remove(message)
+        if not pending:
+            self._pending_messages.pop(conversation_id, None)
+
+    def conversation_lock(self, conversation_id):
+        """
+        Lock to hold from reading a conversation's state to adding its next message, so
+        concurrent messages of one conversation in this process each see the ones before.
+        """
+        return self._conversation_locks[hash(conversation_id) % CONVERSATION_LOCK_STRIPES]
+
+    def get_conversation_state(self, conversation_id):
+        """
+        Summary of one conversation, or None: a primary key lookup, no scan of its messages.
+        Messages this process added that are not committed yet are folded in, so decisions
+        based on the count (thread escalation) don't depend on write-behind timing. With a
+        writer service, messages count as committed once they are sent to it.
+        """
+        with self._commit_lock:
+            cursor = self._reader().cursor()
             cursor.execute('''
-                INSERT INTO extracted_fields (agent, data, timestamp)
-                VALUES (?, ?, ?)
-            ''', (
-                agent,
-                json.dumps(data),
-                datetime.utcnow().isoformat()
-            ))
-            conn.commit()
-
-    def add_conversation(self, conversation_id: str, metadata: dict):
-        with self.lock, sqlite3.connect(self.db_path) as conn:
+                SELECT conversation_id, message_count, last_sender, max_urgency, escalated,
+                       first_timestamp, last_timestamp, urgency_rank
+                FROM conversation_state WHERE conversation_id = ?
+            ''', (conversation_id,))
+            row = cursor.fetchone()
+            pending = list(self._pending_messages.get(conversation_id, []))
+        if row is None and not pending:
+            return None
+        if row is None:
+            row = (conversation_id, 0, None, None, 0, None, None, -1)
+        state = {
+            "conversation_id": row[0],
+            "message_count": row[1],
+            "last_sender": row[2],
+            "max_urgency": row[3],
+            "escalated": bool(row[4]),
+            "first_timestamp": row[5],
+            "last_timestamp": row[6]
+        }
+        # Pending messages are folded in like the conversation_state upsert would
+        urgency_rank = row[7]
+        for sender, urgency, escalated, timestamp in pending:
+            state["message_count"] += 1
+            if state["last_timestamp"] is None or timestamp >= state["last_timestamp"]:
+                state["last_sender"] = sender
+                state["last_timestamp"] = timestamp
+            if state["first_timestamp"] is None or timestamp < state["first_timestamp"]:
+                state["first_timestamp"] = timestamp
+            if state["message_count"] == 1 or URGENCY_RANKS.get(urgency, -1) > urgency_rank:
+                state["max_urgency"] = urgency
+                urgency_rank = max(urgency_rank, URGENCY_RANKS.get(urgency, -1))
+            state["escalated"] = state["escalated"] or bool(escalated)
+        return state
+
+    def rebuild_conversation_state(self, batch_size=1000):
+        """Recompute every conversation summary from the stored messages (e.g. for databases that predate it)."""
+        self._execute_groups([[('DELETE FROM conversation_state', ())]], "rebuild")
+        statements = []
+        for message in self.iter_conversations(batch_size=batch_size):
+            if not message["conversation_id"]:
+                continue
+            metadata = message["metadata"] if isinstance(message["metadata"], dict) else {}
+            statements.append(self._conversation_state_statement(
+                message["conversation_id"], metadata, message["timestamp"]))
+            if len(statements) >= batch_size:
+                self._execute_groups([statements], "rebuild")
+                statements = []
+        if statements:
+            self._execute_groups([statements], "rebuild")
+
+    def _outbox_statements(self, actions):
+        now = time.time()
+        created_at = datetime.utcnow().isoformat()
+        trace_id = current_trace_id()
+        return [('''
+            INSERT INTO action_outbox (action_type, payload, status, attempts, next_attempt_at, created_at, trace_id)
+            VALUES (?, ?, 'pending', 0, ?, ?, ?)
+        ''', (action_type, json.dumps(payload), now, created_at, trace_id)) for action_type, payload in actions]
+
+    def enqueue_actions(self, actions, on_commit=None):
+        """Add (action_type, payload) pairs to the durable action outbox; on_commit as for add_extracted_fields."""
+        if actions:
+            self._write(self._outbox_statements(actions) + self._commit_hooks(on_commit))
+
+    def _commit_hooks(self, on_commit):
+        return [(None, on_commit)] if on_commit is not None else []
+
+    def claim_actions(self, limit=100, lease=60):
+        """
+        Claim up to limit due outbox actions for delivery, oldest first.
+        Actions left in_flight for longer than lease seconds (e.g. by a process that
+        crashed mid-delivery) are claimed again. Always runs synchronously, through the
+        writer service when there is one.
+        """
+        if self._remote is not None:
+            return self._remote.call("claim", limit, lease)
+        now = time.time()
+        waiting = time.perf_counter()
+        with self.lock:
+            started = time.perf_counter()
+            MEMORY_LOCK_WAIT_SECONDS.observe(started - waiting, "claim")
+            cursor = self._conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                cursor.execute('''
+                    SELECT id, action_type, payload, attempts, trace_id FROM action_outbox
+                    WHERE (status = 'pending' AND next_attempt_at <= ?)
+                       OR (status = 'in_flight' AND claimed_at <= ?)
+                    ORDER BY id LIMIT ?
+                ''', (now, now - lease, limit))
+                rows = cursor.fetchall()
+                cursor.executemany(
+                    "UPDATE action_outbox SET status = 'in_flight', claimed_at = ? WHERE id = ?",
+                    [(now, row[0]) for row in rows]
+                )
+                cursor.execute('COMMIT')
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+            finally:
+                MEMORY_WRITE_SECONDS.observe(time.perf_counter() - started, "claim")
+        return [
+            {"id": row[0], "action_type": row[1], "payload": json.loads(row[2]), "attempts": row[3], "trace_id": row[4]}
+            for row in rows
+        ]
+
+    def update_actions(self, ids, status, next_attempt_at=None, error=None, count_attempt=True):
+        """
+        Record the outcome of a delivery attempt for claimed outbox actions:
+        - status 'delivered' or 'failed' is final
+        - status 'pending' makes them due again at next_attempt_at (a unix timestamp)
+        """
+        delivered_at = datetime.utcnow().isoformat() if status == "delivered" else None
+        self._write([('''
+            UPDATE action_outbox
+            SET status = ?, attempts = attempts + ?, next_attempt_at = ?, last_error = ?,
+                delivered_at = ?, claimed_at = NULL
+            WHERE id = ?
+        ''', (status, 1 if count_attempt else 0, next_attempt_at, error, delivered_at, action_id))
+            for action_id in ids])
+
+    def outbox_stats(self):
+        cursor = self._reader().cursor()
+        cursor.execute('SELECT status, COUNT(*) FROM action_outbox GROUP BY status')
+        return dict(cursor.fetchall())
+
+    def get_cached_result(self, key, min_created_at):
+        """
+        Return (value, size, created_at) for a result_cache entry newer than min_created_at,
+        or None. Blob fields of its extraction are loaded; an entry whose blob is gone (dropped
+        with its partition) counts as missing. size is in bytes, with blob fields at full size.
+        """
+        cursor = self._reader().cursor()
+        cursor.execute('SELECT value, created_at FROM result_cache WHERE key = ? AND created_at >= ?',
+                       (key, min_created_at))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        serialized, created_at = row
+        value = json.loads(serialized)
+        size = len(serialized)
+        extraction = value.get("extraction") if isinstance(value, dict) else None
+        if isinstance(extraction, dict):
+            refs = [name for name, field in extraction.items() if isinstance(field, dict) and BLOB_REF_KEY in field]
+            if refs:
+                resolved = self.resolve_blobs(extraction)
+                if any(resolved[name] is None for name in refs):
+                    return None
+                size += sum(extraction[name]["size"] for name in refs)
+                value["extraction"] = resolved
+        return value, size, created_at
+
+    def put_cached_result(self, key, value, created_at):
+        """
+        Store a result_cache entry; large text fields of its extraction go to the blobs table,
+        like agent outputs and job results. Returns the entry's size as get_cached_result does.
+        """
+        blob_statements = []
+        blob_bytes = 0
+        if isinstance(value, dict) and isinstance(value.get("extraction"), dict):
+            extraction, blob_statements = self._split_blobs(value["extraction"])
+            if extraction is not value["extraction"]:
+                blob_bytes = sum(field["size"] for field in extraction.values()
+                                 if isinstance(field, dict) and BLOB_REF_KEY in field)
+                value = dict(value, extraction=extraction)
+        serialized = json.dumps(value)
+        self._write(blob_statements + [('''
+            INSERT OR REPLACE INTO result_cache (key, value, created_at)
+            VALUES (?, ?, ?)
+        ''', (key, serialized, created_at))])
+        return len(serialized) + blob_bytes
+
+    def prune_cached_results(self, older_than):
+        """Delete result_cache entries created before the unix timestamp older_than."""
+        self._write([('DELETE FROM result_cache WHERE created_at < ?', (older_than,))])
+
+    def _refresh_partitions(self):
+        """
+        Clients of a writer service find the partitions on disk, once per period; the service
+        rolls partitions and applies retention itself. A no-op in the owning process.
+        """
+        if self._remote is None or time.time() < self._partition_expires:
+            return
+        key = self._partitions.key_for(datetime.utcnow())
+        self._partition_keys = self._partitions.discover()
+        self._partition_key = key
+        # The service creates the current period's file on its first write; look again shortly until then
+        if key in self._partition_keys:
+            self._partition_expires = self._partitions.expires_at(key)
+        else:
+            self._partition_expires = time.time() + 1
+
+    def put_job(self, job, owner=None):
+        """
+        Insert or update an async intake job record (job_id, status, priority, classification,
+        result, error, created_at, updated_at, trace_id) run by the process owner. Large text
+        fields of the result's extraction are stored as blobs.
+        """
+        result = job.get("result")
+        blob_statements = []
+        if isinstance(result, dict) and isinstance(result.get("extraction"), dict):
+            extraction, blob_statements = self._split_blobs(result["extraction"])
+            result = dict(result, extraction=extraction)
+        self._write(blob_statements + [('''
+            INSERT OR REPLACE INTO jobs (id, status, priority, classification, result, error, created_at, updated_at,
+                                         trace_id, owner)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            job["job_id"],
+            job["status"],
+            job.get("priority"),
+            json.dumps(job.get("classification")),
+            json.dumps(result) if result is not None else None,
+            job.get("error"),
+            job["created_at"],
+            job["updated_at"],
+            job.get("trace_id"),
+            owner
+        ))])
+
+    def get_job(self, job_id):
+        """One job record with its result's blob fields resolved, or None."""
+        cursor = self._reader().cursor()
+        cursor.execute('''
+            SELECT id, status, priority, classification, result, error, created_at, updated_at, trace_id
+            FROM jobs WHERE id = ?
+        ''', (job_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        result = json.loads(row[4]) if row[4] is not None else None
+        if isinstance(result, dict) and "extraction" in result:
+            result["extraction"] = self.resolve_blobs(result["extraction"])
+        return {
+            "job_id": row[0],
+            "status": row[1],
+            "priority": row[2],
+            "classification": json.loads(row[3]) if row[3] else None,
+            "result": result,
+            "error": row[5],
+            "created_at": row[6],
+            "updated_at": row[7],
+            "trace_id": row[8]
+        }
+
+    def prune_jobs(self, older_than, stale_before=None):
+        """
+        Delete finished jobs last updated before the ISO timestamp older_than, and queued or
+        running ones last updated before stale_before: left behind by a process that is gone.
+        """
+        statements = [("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?", (older_than,))]
+        if stale_before is not None:
+            statements.append(("DELETE FROM jobs WHERE status IN ('queued', 'running') AND updated_at < ?",
+                               (stale_before,)))
+        self._write(statements)
+
+    def fail_abandoned_jobs(self, is_abandoned, error):
+        """
+        Mark queued and running jobs failed whose owner process is gone, by is_abandoned(owner).
+        Their inputs went with the process, so they can't be run again. Returns how many.
+        """
+        cursor = self._reader().cursor()
+        cursor.execute("SELECT id, owner FROM jobs WHERE status IN ('queued', 'running')")
+        job_ids = [job_id for job_id, owner in cursor.fetchall() if is_abandoned(owner)]
+        if job_ids:
+            now = datetime.utcnow().isoformat()
+            self._write([('''
+                UPDATE jobs SET status = 'failed', error = ?, updated_at = ?
+                WHERE id = ? AND status IN ('queued', 'running')
+            ''', (error, now, job_id)) for job_id in job_ids])
+        return len(job_ids)
+
+    def put_trace(self, trace):
+        """Store a finished trace (see tracing.Trace.record); one id may have several, e.g. an intake and its job."""
+        self._write([('''
+            INSERT INTO traces (trace_id, name, status, started_at, duration, spans)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (trace["trace_id"], trace["name"], trace["status"], trace["started_at"], trace["duration"],
+              json.dumps(trace["spans"])))])
+
+    def prune_traces(self, older_than):
+        """Delete traces started before the ISO timestamp older_than."""
+        self._write([('DELETE FROM traces WHERE started_at < ?', (older_than,))])
+
+    def get_trace(self, trace_id):
+        """
+        Everything recorded under one trace id, each found through a trace_id index: stored
+        traces with their spans, metadata / extracted_fields / conversations rows of every
+        partition (blob fields as references), action outbox rows and async jobs.
+        """
+        cursor = self._reader().cursor()
+        cursor.execute('''
+            SELECT name, status, started_at, duration, spans FROM traces WHERE trace_id = ? ORDER BY id
+        ''', (trace_id,))
+        found = {"traces": [
+            {"name": row[0], "status": row[1], "started_at": row[2], "duration": row[3], "spans": json.loads(row[4])}
+            for row in cursor.fetchall()
+        ]}
+        for table in _COLUMNS:
+            sql = f"SELECT {', '.join(_COLUMNS[table])} FROM {table} WHERE trace_id = ? ORDER BY id"
+            rows = []
+            for conn in reversed(self._read_sources()):
+                rows.extend(self._row_to_dict(table, row) for row in conn.execute(sql, (trace_id,)))
+            found[table] = rows
+        cursor.execute('''
+            SELECT id, action_type, payload, status, attempts, last_error, created_at, delivered_at
+            FROM action_outbox WHERE trace_id = ? ORDER BY id
+        ''', (trace_id,))
+        found["actions"] = [
+            {"id": row[0], "action_type": row[1], "payload": json.loads(row[2]), "status": row[3],
+             "attempts": row[4], "last_error": row[5], "created_at": row[6], "delivered_at": row[7]}
+            for row in cursor.fetchall()
+        ]
+        cursor.execute('''
+            SELECT id, status, priority, error, created_at, updated_at FROM jobs WHERE trace_id = ? ORDER BY created_at
+        ''', (trace_id,))
+        found["jobs"] = [
+            {"job_id": row[0], "status": row[1], "priority": row[2], "error": row[3],
+             "created_at": row[4], "updated_at": row[5]}
+            for row in cursor.fetchall()
+        ]
+        return found
+
+    def _partition_reader(self, key):
+        connections = getattr(self._local, "partitions", None)
+        if connections is None:
+            connections = self._local.partitions = {}
+        conn = connections.get(key)
+        if conn is None:
+            conn = sqlite3.connect(self._partitions.path_for(key), timeout=30, check_same_thread=False)
+            connections[key] = conn
+            self._readers.append(conn)
+        return conn
+
+    def _read_sources(self, since=None, until=None, before_id=None):
+        """
+        Reader connections for the document tables, newest rows first: the partitions
+        that can match the time range and cursor, then db_path itself.
+        """
+        if self._partitions is None:
+            return [self._reader()]
+        self._refresh_partitions()
+        keys = self._partition_keys
+        # Close this thread's connections to partitions dropped by retention
+        connections = getattr(self._local, "partitions", {})
+        for key in [key for key in connections if key not in keys]:
+            conn = connections.pop(key)
+            conn.close()
+            if conn in self._readers:
+                self._readers.remove(conn)
+        sources = [
+            self._partition_reader(key) for key in reversed(keys)
+            if self._partitions.overlaps(key, since, until)
+            and (before_id is None or int(before_id) > self._partitions.id_base(key))
+        ]
+        sources.append(self._reader())
+        return sources
+
+    def _all_rows(self, table):
+        rows = []
+        for conn in reversed(self._read_sources()):
             cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO conversations (conversation_id, metadata, timestamp)
-                VALUES (?, ?, ?)
-            ''', (
-                conversation_id,
-                json.dumps(metadata),
-                datetime.utcnow().isoformat()
-            ))
-            conn.commit()
+            cursor.execute(f'SELECT * FROM {table}')
+            rows.extend(cursor.fetchall())
+        return rows
 
     def get_metadata(self):
-        with self.lock, sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM metadata')
-            rows = cursor.fetchall()
-            return rows
+        return self._all_rows("metadata")
 
     def get_extracted_fields(self):
-        with self.lock, sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM extracted_fields')
-            rows = cursor.fetchall()
-            return rows
+        return self._all_rows("extracted_fields")
 
     def get_conversations(self):
-        with self.lock, sqlite3.connect(self.db_path) as conn:
+        return self._all_rows("conversations")
+
+    def _row_to_dict(self, table, row):
+        record = dict(zip(_COLUMNS[table], row))
+        for column in _JSON_COLUMNS.intersection(record):
+            if record[column] is not None:
+                record[column] = json.loads(record[column])
+        return record
+
+    def _query(self, table, filters, since=None, until=None, before_id=None, limit=100):
+        """
+        Keyset-paginated query, newest rows first.
+        - filters: equality filters on indexed columns (None values are ignored)
+        - since / until: ISO timestamp range (inclusive / exclusive)
+        - before_id: cursor returned as next_cursor by the previous page
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        clauses = []
+        params = []
+        for column, value in filters.items():
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("timestamp < ?")
+            params.append(until)
+        if before_id is not None:
+            clauses.append("id < ?")
+            params.append(int(before_id))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = f"SELECT {', '.join(_COLUMNS[table])} FROM {table} {where} ORDER BY id DESC LIMIT ?"
+
+        # Partitions hold disjoint, increasing id ranges, so reading them newest first
+        # until the page is full gives the same order as one table
+        items = []
+        for conn in self._read_sources(since, until, before_id):
             cursor = conn.cursor()
-            cursor.execute('SELECT * FROM conversations')
-            rows = cursor.fetchall()
-            return rows
+            cursor.execute(sql, params + [limit - len(items)])
+            items.extend(self._row_to_dict(table, row) for row in cursor.fetchall())
+            if len(items) >= limit:
+                break
+        next_cursor = items[-1]["id"] if len(items) == limit else None
+        return {"items": items, "next_cursor": next_cursor}
+
+    def _iterate(self, query, batch_size, **kwargs):
+        before_id = None
+        while True:
+            page = query(before_id=before_id, limit=batch_size, **kwargs)
+            yield from page["items"]
+            before_id = page["next_cursor"]
+            if before_id is None:
+                return
+
+    def query_metadata(self, type=None, intent=None, since=None, until=None, before_id=None, limit=100):
+        return self._query("metadata", {"type": type, "intent": intent}, since, until, before_id, limit)
+
+    def query_extracted_fields(self, agent=None, since=None, until=None, before_id=None, limit=100,
+                               include_blobs=False):
+        """Blob fields come back as {"$blob": hash, "size": n} references unless include_blobs is set."""
+        page = self._query("extracted_fields", {"agent": agent}, since, until, before_id, limit)
+        if include_blobs:
+            for item in page["items"]:
+                item["data"] = self.resolve_blobs(item["data"])
+        return page
+
+    def query_conversations(self, conversation_id=None, since=None, until=None, before_id=None, limit=100):
+        return self._query("conversations", {"conversation_id": conversation_id}, since, until, before_id, limit)
+
+    def iter_metadata(self, batch_size=500, **filters):
+        """Stream matching metadata rows page by page instead of loading the table."""
+        return self._iterate(self.query_metadata, batch_size, **filters)
+
+    def iter_extracted_fields(self, batch_size=500, **filters):
+        return self._iterate(self.query_extracted_fields, batch_size, **filters)
+
+    def iter_conversations(self, batch_size=500, **filters):
+        return self._iterate(self.query_conversations, batch_size, **filters)
@@ -0,0 +1,190 @@
+import os
+import sys
+import time
+import signal
+import threading
+from multiprocessing.connection import Listener, Client
+
+
+class WriterService:
+    def __init__(self, memory, address, authkey=None):
+        """
+        Single writer for several app processes (uvicorn --workers N, gunicorn):
+        - owns memory (a write-behind SharedMemory) and the only write connection to its database
+        - workers connect over a Unix socket (multiprocessing.connection, HMAC-authenticated
+          when authkey is set) and forward batches of write groups, which join the owner's
+          write-behind queue, so writes from every worker share transactions
+        - "commit" forwards write groups the same way but answers once they are committed,
+          for groups whose commit hooks must not run before their rows exist
+        - claim and flush requests are answered synchronously
+        Workers still read the database directly through their own WAL connections.
+        """
+        self.memory = memory
+        self.address = address
+        self.authkey = authkey
+        self._listener = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        # A socket file left by a previous run would make bind fail
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        self._listener = Listener(self.address, family="AF_UNIX", authkey=self.authkey)
+        os.chmod(self.address, 0o600)
+        thread = threading.Thread(target=self._accept_loop, name="memory-writer-accept", daemon=True)
+        thread.start()
+        return self
+
+    def _accept_loop(self):
+        while not self._stopped.is_set():
+            try:
+                conn = self._listener.accept()
+            except Exception as e:
+                if not self._stopped.is_set():
+                    print(f"Warning: Writer service failed to accept a connection: {e}")
+                    time.sleep(0.1)
+                continue
+            threading.Thread(target=self._serve, args=(conn,), name="memory-writer-conn", daemon=True).start()
+
+    def _serve(self, conn):
+        with conn:
+            while True:
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    return
+                op = message[0]
+                try:
+                    if op == "write":
+                        self.memory.enqueue_writes(message[1])
+                        continue
+                    if op == "commit":
+                        reply = self._commit(message[1])
+                    elif op == "claim":
+                        reply = self.memory.claim_actions(*message[1:])
+                    elif op == "flush":
+                        self.memory.flush()
+                        reply = True
+                    elif op == "ping":
+                        reply = True
+                    else:
+                        reply = {"error": f"Unknown operation: {op}"}
+                except Exception as e:
+                    print(f"Warning: Writer service failed to handle {op}: {e}")
+                    reply = {"error": str(e)}
+                if op != "write":
+                    conn.send(reply)
+
+    def _commit(self, groups):
+        """
+        Queue write groups like "write", but reply only once they are committed: a hook on
+        the last group fires after its transaction, and groups commit in queue order.
+        """
+        committed = threading.Event()
+        if groups:
+            groups[-1] = groups[-1] + [(None, committed.set)]
+            self.memory.enqueue_writes(groups)
+            committed.wait()
+        return True
+
+    def stop(self):
+        self._stopped.set()
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        self.memory.close()
+
+
+class WriterClient:
+    def __init__(self, address, authkey=None, connect_timeout=30):
+        """
+        Connection from an app process to the WriterService.
+        One connection per process; requests are serialized by a lock, and a broken
+        connection is reopened, waiting up to connect_timeout seconds for the service.
+        """
+        self.address = address
+        self.authkey = authkey
+        self.connect_timeout = connect_timeout
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            deadline = time.monotonic() + self.connect_timeout
+            while True:
+                try:
+                    self._conn = Client(self.address, family="AF_UNIX", authkey=self.authkey)
+                    break
+                except (OSError, EOFError):
+                    if time.monotonic() >= deadline:
+                        raise
+                    time.sleep(0.1)
+        return self._conn
+
+    def _request(self, message, reply=True):
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    conn = self._connection()
+                    conn.send(message)
+                    return conn.recv() if reply else None
+                except (OSError, EOFError):
+                    # The service restarted: reconnect once and resend
+                    self._reset()
+                    if attempt:
+                        raise
+
+    def _reset(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except OSError:
+                pass
+            self._conn = None
+
+    def write(self, groups):
+        """Forward write groups, each a list of (sql, params); returns once they are sent (see call("commit"))."""
+        self._request(("write", groups), reply=False)
+
+    def call(self, op, *args):
+        result = self._request((op,) + args)
+        if isinstance(result, dict) and "error" in result:
+            raise RuntimeError(f"Writer service {op} failed: {result['error']}")
+        return result
+
+    def close(self):
+        with self._lock:
+            self._reset()
+
+
+def main():
+    """Run the writer service with the same SharedMemory environment variables as the app."""
+    from memory.shared_memory import SharedMemory
+
+    address = os.getenv("MEMORY_WRITER_SOCKET", "memory.sock")
+    authkey = os.getenv("MEMORY_WRITER_AUTHKEY", "").encode() or None
+    memory = SharedMemory(
+        os.getenv("DATABASE_PATH", "memory.db"),
+        write_behind=True,
+        batch_size=int(os.getenv("MEMORY_BATCH_SIZE", "200")),
+        flush_interval=float(os.getenv("MEMORY_FLUSH_INTERVAL", "0.05")),
+        blob_threshold=int(os.getenv("MEMORY_BLOB_THRESHOLD", "4096")),
+        partition=os.getenv("MEMORY_PARTITION") or None,
+        retention=int(os.getenv("MEMORY_RETENTION", "0")) or None
+    )
+    service = WriterService(memory, address, authkey).start()
+    print(f"SharedMemory writer listening on {address}")
+
+    stopped = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stopped.set())
+    stopped.wait()
+    # Commits every queued write before exiting
+    service.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+import bisect
+import threading
+import time
+
+# Latency buckets in seconds, from sub-millisecond keyword scans to multi-second PDFs
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, description, labelnames=()):
+        """Monotonic counter per label combination."""
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            values = dict(self._values)
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_label_text(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, description, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """
+        Latency histogram per label combination:
+        - observe() bumps a single bucket, cumulative counts are only built when exported
+        - time() is a context manager observing the elapsed seconds of its block
+        """
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, *labels):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def collect(self):
+        with self._lock:
+            series = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_label_text(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_label_text(self.labelnames, labels)} {count}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+        return False
+
+
+class Gauge:
+    def __init__(self, name, description, labelnames=(), callback=None):
+        """Gauge whose values are read from callback() at export time: {label tuple: value}."""
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.callback() if self.callback else {}
+        except Exception as e:
+            print(f"Warning: Failed to collect {self.name}: {e}")
+            values = {}
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_label_text(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Add a metric, or return the one already registered under its name."""
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, description, labelnames=()):
+    return REGISTRY.register(Counter(name, description, labelnames))
+
+
+def histogram(name, description, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, description, labelnames, buckets))
+
+
+def gauge(name, description, labelnames=(), callback=None):
+    return REGISTRY.register(Gauge(name, description, labelnames, callback))
+
+
+# Pipeline instruments shared by main, the agents, SharedMemory and ActionRouter
+INTAKE_SECONDS = histogram("intake_request_seconds", "End-to-end intake latency", ("format", "intent", "status"))
+STAGE_SECONDS = histogram("intake_stage_seconds", "Latency of each intake pipeline stage", ("stage", "format"))
+AGENT_SECONDS = histogram("agent_process_seconds", "Latency of agent classify/process calls",
+                          ("agent", "format", "intent"))
+MEMORY_LOCK_WAIT_SECONDS = histogram("memory_lock_wait_seconds", "Time spent waiting for the SharedMemory write lock",
+                                     ("operation",))
+MEMORY_WRITE_SECONDS = histogram("memory_write_seconds", "Time spent executing SharedMemory write transactions",
+                                 ("operation",))
+MEMORY_STATEMENTS = counter("memory_statements_total", "SQL statements committed by SharedMemory", ("operation",))
+ACTION_DISPATCH_SECONDS = histogram("action_dispatch_seconds", "Latency of action endpoint POSTs",
+                                    ("action_type", "outcome"))
+ACTION_ATTEMPTS = counter("action_attempts_total", "Action delivery attempts by outcome", ("action_type", "outcome"))
@@ -0,0 +1,171 @@
+import gzip
+import json
+import asyncio
+from pydantic import BaseModel
+from starlette.datastructures import Headers, MutableHeaders
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def parse_paths(spec):
+    """Comma-separated dotted field paths ("flags,invoice_lines.total") as tuples, or None if spec is empty."""
+    if not spec:
+        return None
+    paths = [tuple(part for part in path.strip().split(".") if part) for path in spec.split(",")]
+    return [path for path in paths if path] or None
+
+
+def _select(data, paths):
+    if isinstance(data, list):
+        return [_select(item, paths) for item in data]
+    if not isinstance(data, dict):
+        return data
+    selected = {}
+    for key in {path[0] for path in paths}:
+        if key not in data:
+            continue
+        rest = [path[1:] for path in paths if path[0] == key]
+        # A path ending here selects the whole value
+        selected[key] = data[key] if () in rest else _select(data[key], rest)
+    return selected
+
+
+def _drop(data, paths):
+    if isinstance(data, list):
+        return [_drop(item, paths) for item in data]
+    if not isinstance(data, dict):
+        return data
+    dropped = {key for key, *rest in paths if not rest}
+    nested = {}
+    for key, *rest in paths:
+        if rest:
+            nested.setdefault(key, []).append(tuple(rest))
+    return {key: _drop(value, nested[key]) if key in nested else value
+            for key, value in data.items() if key not in dropped}
+
+
+def project(data, fields=None, exclude=None):
+    """
+    Keep only the fields paths of a result, then remove the exclude paths (see parse_paths).
+    Paths step into nested objects by key and apply to every element of a list, so
+    "messages.sender" selects the sender of each message of an mbox bundle. The
+    result is rebuilt without touching the values of unselected fields.
+    """
+    if fields:
+        data = _select(data, fields)
+    if exclude:
+        data = _drop(data, exclude)
+    return data
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response encoded with orjson when it is installed (the standard library otherwise);
+    pydantic models are serialized without their unset fields.
+    """
+
+    def render(self, content):
+        if isinstance(content, BaseModel):
+            if orjson is None:
+                return content.model_dump_json(exclude_unset=True).encode("utf-8")
+            # Dumping to a dict and encoding with orjson beats pydantic's JSON encoder on large text fields
+            content = content.model_dump(exclude_unset=True)
+        if orjson is not None:
+            try:
+                return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+            except TypeError:
+                # Integers beyond 64 bits and other types orjson refuses
+                pass
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def _accepted_encoding(accept_encoding):
+    """Best supported content coding the client accepts: br (if brotli is installed), then gzip."""
+    accepted = set()
+    for coding in accept_encoding.lower().split(","):
+        name, *params = coding.split(";")
+        quality = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(name.strip())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def _compress(body, encoding, level):
+    if encoding == "br":
+        return brotli.compress(body, quality=min(level, 11))
+    return gzip.compress(body, compresslevel=min(level, 9))
+
+
+class CompressResponse:
+    def __init__(self, app, minimum_size=1024, level=6):
+        """
+        ASGI middleware compressing response bodies of at least minimum_size bytes with
+        brotli or gzip, per the request's Accept-Encoding:
+        - only complete bodies are compressed; streamed responses (no Content-Length, e.g.
+          NDJSON batches) are passed through untouched so each chunk reaches the client right away
+        - compression runs on a worker thread, off the event loop
+        """
+        self.app = app
+        self.minimum_size = minimum_size
+        self.level = level
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        encoding = _accepted_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, passthrough
+            if message["type"] == "http.response.start":
+                if "content-length" not in Headers(raw=message["headers"]):
+                    # A streamed body: sent on as it is produced
+                    passthrough = True
+                    await send(message)
+                    return
+                # Held back until the body shows whether it is worth compressing
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+            body = message.get("body", b"")
+            headers = MutableHeaders(raw=start["headers"])
+            if (message.get("more_body", False) or len(body) < self.minimum_size
+                    or "content-encoding" in headers):
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+            compressed = await asyncio.to_thread(_compress, body, encoding, self.level)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_compressed)
@@ -1,5 +1,9 @@
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Union
+from typing_extensions import TypedDict
+
+# Every result field is optional: error results and ?fields=/?exclude= projections
+# leave any of them out, and only the fields that are set are serialized.
 
 class IntakeRequest(BaseModel):
     file: Optional[bytes] = None
@@ -10,17 +14,82 @@ class ClassificationResult(BaseModel):
     format: str
     intent: str
 
-class JSONAgentResult(BaseModel):
-    flowbit_schema: Dict[str, Any]
-    anomalies: Optional[list]
+class AgentResult(BaseModel):
+    error: Optional[str] = None
+    details: Optional[Any] = None
+    skipped: Optional[str] = None
 
-class EmailParserAgentResult(BaseModel):
-    sender: str
-    intent: str
-    urgency: str
-    conversation_id: Optional[str]
-    timestamp: str
+class JSONStreamAlert(BaseModel):
+    records: Optional[List[int]] = None
+    details: Optional[List[str]] = None
+
+class JSONAgentResult(AgentResult):
+    flowbit_schema: Optional[Dict[str, Any]] = None
+    anomalies: Optional[list] = None
+    # JSON array / NDJSON record streams
+    records: Optional[int] = None
+    batches: Optional[int] = None
+    anomalous_records: Optional[int] = None
+    alerts: Optional[List[JSONStreamAlert]] = None
+
+class InvoiceLine(TypedDict, total=False):
+    item: str
+    quantity: int
+    price: float
+    total: float
+
+class PDFAgentResult(AgentResult):
+    num_pages: Optional[int] = None
+    pages_scanned: Optional[int] = None
+    invoice_lines: Optional[List[InvoiceLine]] = None
+    invoice_total: Optional[float] = None
+    policy_flags: Optional[List[str]] = None
+    flags: Optional[List[str]] = None
+    truncated: Optional[str] = None
+    extracted_text: Optional[str] = None
+    text_truncated: Optional[bool] = None
+
+class EmailAttachment(BaseModel):
+    filename: Optional[str] = None
+    content_type: Optional[str] = None
+    format: Optional[str] = None
+    size: Optional[int] = None
+    sha256: Optional[str] = None
+    result: Optional[Union[PDFAgentResult, JSONAgentResult, AgentResult]] = None
+
+class EmailParserAgentResult(AgentResult):
+    sender: Optional[str] = None
+    intent: Optional[str] = None
+    urgency: Optional[str] = None
+    tone: Optional[str] = None
+    conversation_id: Optional[str] = None
+    timestamp: Optional[str] = None
+    # MIME messages
+    message_id: Optional[str] = None
+    attachments: Optional[List[EmailAttachment]] = None
+    # mbox bundles
+    messages: Optional[List["EmailParserAgentResult"]] = None
+    message_count: Optional[int] = None
 
 class IntakeResponse(BaseModel):
     classification: ClassificationResult
-    extraction: Optional[Dict[str, Any]]
+    extraction: Optional[Union[JSONAgentResult, EmailParserAgentResult, PDFAgentResult, AgentResult]] = None
+    cached: Optional[bool] = None
+
+# Result model of each classified format
+EXTRACTION_MODELS = {"JSON": JSONAgentResult, "Email": EmailParserAgentResult, "PDF": PDFAgentResult}
+
+def intake_response(content):
+    """
+    Shape an intake result ({"classification", "extraction", "cached"}) as an IntakeResponse,
+    validating the extraction against its format's result model; keys a model doesn't
+    declare are dropped, so the response shape doesn't depend on what an agent returned.
+    """
+    classification = content["classification"]
+    model = EXTRACTION_MODELS.get(classification.get("format"), AgentResult)
+    fields = {"classification": classification}
+    if content.get("extraction") is not None:
+        fields["extraction"] = model.model_validate(content["extraction"])
+    if "cached" in content:
+        fields["cached"] = content["cached"]
+    return IntakeResponse(**fields)
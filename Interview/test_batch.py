@@ -0,0 +1,36 @@
+import os
+import sys
+import json
+import tempfile
+import subprocess
+
+CHILD = """
+import sys, json
+import main
+from fastapi.testclient import TestClient
+with TestClient(main.app) as client:
+    response = client.post("/intake/batch", content=sys.stdin.buffer.read(),
+                           headers={"Content-Type": "application/x-ndjson"})
+    print(json.dumps([json.loads(line) for line in response.text.splitlines()]))
+"""
+
+
+def run_batch(body):
+    """Post an NDJSON batch to the app in a fresh interpreter; the timeout catches a stream that never ends."""
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ, DATABASE_PATH=os.path.join(workdir, "memory.db"), PREWARM_AGENTS="")
+        output = subprocess.run([sys.executable, "-c", CHILD], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                input=body, env=env, capture_output=True, timeout=60, check=True).stdout
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def test_malformed_lines_get_their_own_result():
+    lines = run_batch(b'{"json_body":{"a":1}}\n{"pdf_base64":123}\nnot json\n')
+    status = {line["index"]: line["status"] for line in lines}
+    assert status == {0: 200, 1: 400, 2: 400}
+    assert all(line["error"].startswith("Invalid NDJSON line") for line in lines if line["status"] == 400)
+
+
+if __name__ == "__main__":
+    test_malformed_lines_get_their_own_result()
+    print("Batch tests passed")
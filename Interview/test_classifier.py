@@ -0,0 +1,72 @@
+from email.message import EmailMessage
+from agents.classifier_agent import ClassifierAgent
+from agents.intake_context import IntakeContext
+
+
+def classify(raw_input):
+    return ClassifierAgent(memory=None).classify(raw_input)
+
+
+def test_bracketed_subject_is_email():
+    # Text starting with "[" is only a record stream if its first element decodes as JSON
+    body = "[External] From: Bob <bob@example.com>\nSubject: complaint\nurgent"
+    assert not IntakeContext(body).looks_like_record_stream
+    assert classify(body)["format"] == "Email"
+
+
+def test_bracketed_tag_without_headers_is_unknown():
+    assert classify("[ticket 42] nothing else here")["format"] == "Unknown"
+
+
+def test_json_array_and_ndjson_are_record_streams():
+    for body in ('[{"id": 1}, {"id": 2}]', '[]', ' \n[\n  1, 2]', '{"id": 1}\n{"id": 2}\n'):
+        ctx = IntakeContext(body)
+        assert ctx.looks_like_record_stream, body
+        assert classify(ctx)["format"] == "JSON", body
+
+
+def test_array_with_malformed_first_element_is_not_a_record_stream():
+    assert not IntakeContext('[{"id": 1,, }]').looks_like_record_stream
+
+
+def test_large_first_element_is_still_a_record_stream():
+    # The first element is larger than the decoded head, so it is judged by how it starts
+    body = '[{"text": "' + "x" * (2 * 1024 * 1024) + '"}]'
+    assert IntakeContext(body).looks_like_record_stream
+
+
+def test_single_json_document():
+    assert classify('{"id": 1, "type": "invoice"}') == {"format": "JSON", "intent": "Invoice"}
+
+
+def mime_email(body):
+    message = EmailMessage()
+    message["From"] = "Ann <ann@example.com>"
+    message["Subject"] = "Hello"
+    message.set_content(body, cte="base64")
+    message.add_attachment(b"%PDF-1.4 quote request", maintype="application", subtype="pdf",
+                           filename="rfq.pdf")
+    return message.as_bytes()
+
+
+def test_mime_intent_comes_from_the_decoded_body():
+    # The body is base64, so only the decoded text has the keyword
+    raw = mime_email("Please find our invoice for March attached.")
+    ctx = IntakeContext(raw)
+    assert ctx.looks_like_mime and b"invoice" not in ctx.prefix.lower()
+    assert classify(ctx) == {"format": "Email", "intent": "Invoice"}
+
+
+def test_mime_intent_ignores_attachments():
+    assert classify(mime_email("Just saying hello."))["intent"] != "RFQ"
+
+if __name__ == "__main__":
+    test_bracketed_subject_is_email()
+    test_bracketed_tag_without_headers_is_unknown()
+    test_json_array_and_ndjson_are_record_streams()
+    test_array_with_malformed_first_element_is_not_a_record_stream()
+    test_large_first_element_is_still_a_record_stream()
+    test_single_json_document()
+    test_mime_intent_comes_from_the_decoded_body()
+    test_mime_intent_ignores_attachments()
+    print("Classifier tests passed")
@@ -0,0 +1,97 @@
+import contextvars
+import os
+import tempfile
+import threading
+from agents.email_parser_agent import EmailParserAgent
+from memory.shared_memory import SharedMemory
+
+
+class RecordingRouter:
+    """Stands in for the ActionRouter: records the actions instead of posting them."""
+    outbox = False
+
+    def __init__(self):
+        self.actions = []
+        self._lock = threading.Lock()
+
+    def trigger_action(self, action_type, payload):
+        with self._lock:
+            self.actions.append(action_type)
+        return {"status": "success", "action": action_type}
+
+
+def medium_email(n, conversation_id="T-1"):
+    return f"From: Ann <ann@example.com>\nSubject: order update {n}\nConversation-ID: {conversation_id}\nNeeded soon."
+
+
+def open_memory(workdir, **kwargs):
+    # A long flush interval keeps writes queued, as under load
+    return SharedMemory(os.path.join(workdir, "memory.db"), write_behind=True, flush_interval=5, batch_size=1000,
+                        **kwargs)
+
+
+def test_thread_escalates_before_writes_are_committed():
+    with tempfile.TemporaryDirectory() as workdir:
+        memory = open_memory(workdir)
+        router = RecordingRouter()
+        agent = EmailParserAgent(memory, action_router=router, escalate_after_messages=3)
+        try:
+            for n in range(4):
+                agent.process(medium_email(n))
+            assert router.actions == ["crm_log", "crm_log", "crm_escalate", "crm_escalate"]
+            assert memory.get_conversation_state("T-1")["message_count"] == 4
+            memory.flush()
+            # Once committed the summary is read from the table alone, without double counting
+            state = memory.get_conversation_state("T-1")
+            assert state["message_count"] == 4 and state["escalated"] and state["max_urgency"] == "Medium"
+        finally:
+            memory.close()
+
+
+def test_thread_escalates_inside_a_write_group():
+    with tempfile.TemporaryDirectory() as workdir:
+        memory = open_memory(workdir)
+        router = RecordingRouter()
+        agent = EmailParserAgent(memory, action_router=router, escalate_after_messages=3)
+        group = memory.write_group()
+
+        def process_in_group():
+            # Batch intake activates the group in each document's task and commits it every BATCH_GROUP_SIZE documents
+            group.activate()
+            for n in range(3):
+                agent.process(medium_email(n))
+
+        try:
+            contextvars.copy_context().run(process_in_group)
+            assert router.actions == ["crm_log", "crm_log", "crm_escalate"]
+            memory.commit_group(group)
+            memory.flush()
+            assert memory.get_conversation_state("T-1")["message_count"] == 3
+        finally:
+            memory.close()
+
+
+def test_concurrent_messages_of_one_thread():
+    with tempfile.TemporaryDirectory() as workdir:
+        memory = open_memory(workdir)
+        router = RecordingRouter()
+        agent = EmailParserAgent(memory, action_router=router, escalate_after_messages=3)
+        try:
+            threads = [threading.Thread(target=agent.process, args=(medium_email(n),)) for n in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            # Every message sees the ones before it: the first two are logged, the rest escalate
+            assert sorted(router.actions) == ["crm_escalate"] * 6 + ["crm_log"] * 2
+            memory.flush()
+            assert memory.get_conversation_state("T-1")["message_count"] == 8
+        finally:
+            memory.close()
+
+
+if __name__ == "__main__":
+    test_thread_escalates_before_writes_are_committed()
+    test_thread_escalates_inside_a_write_group()
+    test_concurrent_messages_of_one_thread()
+    print("Escalation tests passed")
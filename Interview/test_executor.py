@@ -0,0 +1,37 @@
+import os
+import asyncio
+from concurrent.futures.process import BrokenProcessPool
+from agents.executor import AgentExecutor
+
+
+def crash():
+    # Dies like an OOM-killed worker
+    os._exit(1)
+
+
+def square(value):
+    return value * value
+
+
+def test_process_pool_recovers_after_a_worker_dies():
+    async def scenario():
+        executor = AgentExecutor(max_workers=2, max_processes=1)
+        try:
+            assert await executor.run_cpu(square, 3) == 9
+            try:
+                await executor.run_cpu(crash)
+            except BrokenProcessPool:
+                pass
+            else:
+                raise AssertionError("a dead worker must fail its call")
+            # The next call gets a new pool instead of "process pool is not usable anymore"
+            assert await executor.run_cpu(square, 4) == 16
+        finally:
+            executor.shutdown()
+
+    asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    test_process_pool_recovers_after_a_worker_dies()
+    print("Executor tests passed")
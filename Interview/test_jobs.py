@@ -0,0 +1,124 @@
+import os
+import asyncio
+import socket
+import tempfile
+import subprocess
+import sys
+from datetime import datetime, timedelta
+from agents.job_queue import JobQueue
+from memory.shared_memory import SharedMemory
+
+
+def job(job_id, status="queued", age=0):
+    updated_at = (datetime.utcnow() - timedelta(seconds=age)).isoformat()
+    return {"job_id": job_id, "status": status, "priority": "normal", "classification": {"format": "JSON"},
+            "result": None, "error": None, "created_at": updated_at, "updated_at": updated_at}
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_startup_fails_jobs_of_dead_processes():
+    with tempfile.TemporaryDirectory() as workdir:
+        memory = SharedMemory(os.path.join(workdir, "memory.db"))
+        try:
+            host = socket.gethostname()
+            memory.put_job(job("dead"), owner=f"{host}:{dead_pid()}")
+            memory.put_job(dict(job("running"), status="running"), owner=f"{host}:{dead_pid()}")
+            memory.put_job(job("previous-run"), owner=f"{host}:{os.getpid()}")
+            memory.put_job(job("legacy"))
+            memory.put_job(job("sibling"), owner=f"{host}:{os.getppid()}")
+            memory.put_job(job("other-host"), owner="elsewhere.example.com:1234")
+            memory.put_job(job("finished", status="done"), owner=f"{host}:{dead_pid()}")
+            memory.flush()
+
+            queue = JobQueue(memory, run_job=None)
+            assert queue.recover() == 4
+            memory.flush()
+            status = {job_id: memory.get_job(job_id)["status"]
+                      for job_id in ("dead", "running", "previous-run", "legacy", "sibling", "other-host", "finished")}
+            assert status == {"dead": "failed", "running": "failed", "previous-run": "failed", "legacy": "failed",
+                              "sibling": "queued", "other-host": "queued", "finished": "done"}
+            assert memory.get_job("dead")["error"]
+            assert queue.recover() == 0
+        finally:
+            memory.close()
+
+
+def test_prune_covers_stale_unfinished_jobs():
+    with tempfile.TemporaryDirectory() as workdir:
+        memory = SharedMemory(os.path.join(workdir, "memory.db"))
+        try:
+            memory.put_job(job("old-done", status="done", age=7200))
+            memory.put_job(job("old-queued", age=7200))
+            memory.put_job(job("stale-queued", age=200000))
+            memory.put_job(dict(job("stale-running", age=200000), status="running"))
+            memory.put_job(job("new-queued"))
+            memory.flush()
+            now = datetime.utcnow()
+            memory.prune_jobs((now - timedelta(hours=1)).isoformat(), (now - timedelta(days=1)).isoformat())
+            memory.flush()
+            kept = {job_id for job_id in ("old-done", "old-queued", "stale-queued", "stale-running", "new-queued")
+                    if memory.get_job(job_id) is not None}
+            assert kept == {"old-queued", "new-queued"}
+        finally:
+            memory.close()
+
+
+class Input:
+    """Stands in for an IntakeContext; counts how often the job queue closes it."""
+
+    def __init__(self):
+        self.closed = 0
+
+    def close(self):
+        self.closed += 1
+
+
+def test_saturated_jobs_are_requeued_not_failed():
+    with tempfile.TemporaryDirectory() as workdir:
+        memory = SharedMemory(os.path.join(workdir, "memory.db"))
+        answers = [(503, {"error": "PDF agents are busy"}), (429, {"error": "Too many requests"}),
+                   (200, {"extraction": {}}), (500, {"error": "Processing failed"})]
+        runs = []
+
+        async def run_job(ctx, classification):
+            runs.append(ctx)
+            return answers[len(runs) - 1]
+
+        async def wait_for(queue, job_id, status):
+            for _ in range(200):
+                if queue.get(job_id)["status"] == status:
+                    return
+                await asyncio.sleep(0.01)
+            raise AssertionError(f"Job {job_id} is {queue.get(job_id)['status']}, not {status}")
+
+        async def scenario():
+            queue = JobQueue(memory, run_job, workers=1, retry_delay=0.01)
+            queue.start()
+            try:
+                saturated = Input()
+                job = await queue.submit(saturated, {"format": "PDF"}, "normal")
+                await wait_for(queue, job["job_id"], "done")
+                # Run again with the same input, closed once it finished
+                assert runs == [saturated] * 3 and saturated.closed == 1
+                job = await queue.submit(Input(), {"format": "PDF"}, "normal")
+                await wait_for(queue, job["job_id"], "failed")
+                assert len(runs) == 4 and queue.get(job["job_id"])["error"] == "Processing failed"
+            finally:
+                await queue.stop()
+
+        try:
+            asyncio.run(scenario())
+        finally:
+            memory.close()
+
+
+if __name__ == "__main__":
+    test_startup_fails_jobs_of_dead_processes()
+    test_prune_covers_stale_unfinished_jobs()
+    test_saturated_jobs_are_requeued_not_failed()
+    print("Job tests passed")
@@ -0,0 +1,116 @@
+import os
+import time
+import tempfile
+import contextvars
+from agents.action_router import ActionRouter, CircuitBreaker
+from agents.email_parser_agent import EmailParserAgent
+from agents.json_agent import JSONAgent
+from memory.shared_memory import SharedMemory
+
+
+def open_memory(workdir, **kwargs):
+    return SharedMemory(os.path.join(workdir, "memory.db"), **kwargs)
+
+
+def outbox_rows(memory):
+    return memory._reader().execute("SELECT COUNT(*) FROM action_outbox").fetchone()[0]
+
+
+def recording_router(memory):
+    """A durable router whose notify() records how many outbox rows were committed when it was called."""
+    router = ActionRouter(memory, outbox=True)
+    router.notified = []
+    router.notify = lambda: router.notified.append(outbox_rows(memory))
+    return router
+
+
+EMAIL = "From: Ann <ann@example.com>\nSubject: complaint about order\nConversation-ID: T-9\nThis is unacceptable."
+
+
+def test_actions_are_stored_with_the_output():
+    with tempfile.TemporaryDirectory() as workdir:
+        memory = open_memory(workdir)
+        router = recording_router(memory)
+        try:
+            EmailParserAgent(memory, action_router=router).process(EMAIL)
+            assert outbox_rows(memory) == 1 and router.notified == [1]
+            claimed = memory.claim_actions()
+            assert len(claimed) == 1 and claimed[0]["payload"]["sender"] == "Ann"
+        finally:
+            memory.close()
+
+
+def test_notify_waits_for_the_write_group_to_commit():
+    with tempfile.TemporaryDirectory() as workdir:
+        memory = open_memory(workdir, write_behind=True, flush_interval=5)
+        router = recording_router(memory)
+        agent = EmailParserAgent(memory, action_router=router)
+        group = memory.write_group()
+
+        def process_in_group():
+            group.activate()
+            agent.process(EMAIL)
+
+        try:
+            contextvars.copy_context().run(process_in_group)
+            # Still collected in the group: the drainer would find nothing to claim
+            assert router.notified == []
+            memory.commit_group(group)
+            memory.flush()
+            assert router.notified == [1]
+        finally:
+            memory.close()
+
+
+def test_notify_waits_for_write_behind():
+    with tempfile.TemporaryDirectory() as workdir:
+        memory = open_memory(workdir, write_behind=True, flush_interval=5)
+        router = recording_router(memory)
+        try:
+            agent = JSONAgent(memory, action_router=router)
+            # A document missing its type, and a record stream with an anomalous record
+            agent.process('{"id": "1"}')
+            agent.process('[{"id": "2", "type": "order"}, {"id": "3"}]')
+            assert router.notified == []
+            memory.flush()
+            assert router.notified == [2, 2] and outbox_rows(memory) == 2
+        finally:
+            memory.close()
+
+
+def test_trigger_action_wakes_the_drainer_after_commit():
+    with tempfile.TemporaryDirectory() as workdir:
+        memory = open_memory(workdir, write_behind=True, flush_interval=5)
+        router = recording_router(memory)
+        try:
+            assert router.trigger_action("crm_log", {"sender": "ann"})["status"] == "queued"
+            assert router.notified == []
+            memory.flush()
+            assert router.notified == [1]
+        finally:
+            # trigger_action started the router's threads
+            router.shutdown()
+            memory.close()
+
+
+def test_blocked_actions_wait_while_a_trial_is_in_flight():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    assert not breaker.allow() and 29 < breaker.retry_in() <= 30
+    # The reset timeout passed: one trial goes through, everything else waits for its outcome
+    breaker.opened_at -= 30
+    assert breaker.allow() and breaker.state == "half_open"
+    assert not breaker.allow()
+    assert breaker.retry_in() == 30
+    due = breaker.probe_due()
+    assert due is not None and due - time.monotonic() > 29
+    assert breaker.probe_due() is None
+
+
+if __name__ == "__main__":
+    test_actions_are_stored_with_the_output()
+    test_notify_waits_for_the_write_group_to_commit()
+    test_notify_waits_for_write_behind()
+    test_trigger_action_wakes_the_drainer_after_commit()
+    test_blocked_actions_wait_while_a_trial_is_in_flight()
+    print("Outbox tests passed")
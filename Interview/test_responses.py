@@ -0,0 +1,71 @@
+import json
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from responses import CompressResponse, FastJSONResponse, parse_paths, project
+
+RESULT = {
+    "classification": {"format": "Email", "intent": "RFQ"},
+    "extraction": {
+        "messages": [
+            {"sender": "Ann", "intent": "RFQ", "attachments": [{"filename": "a.pdf", "size": 10}]},
+            {"sender": "Bob", "intent": "Complaint", "attachments": []}
+        ],
+        "message_count": 2
+    }
+}
+
+
+def test_parse_paths():
+    assert parse_paths(None) is None and parse_paths(" , ") is None
+    assert parse_paths("flags, extraction.messages.sender") == [("flags",), ("extraction", "messages", "sender")]
+
+
+def test_fields_select_through_lists():
+    projected = project(RESULT, fields=parse_paths("classification.intent,extraction.messages.sender"))
+    assert projected == {
+        "classification": {"intent": "RFQ"},
+        "extraction": {"messages": [{"sender": "Ann"}, {"sender": "Bob"}]}
+    }
+
+
+def test_exclude_drops_nested_fields():
+    projected = project(RESULT, exclude=parse_paths("classification,extraction.messages.attachments"))
+    assert projected == {"extraction": {"messages": [{"sender": "Ann", "intent": "RFQ"},
+                                                     {"sender": "Bob", "intent": "Complaint"}],
+                                        "message_count": 2}}
+    # The original result is left as it was
+    assert RESULT["extraction"]["messages"][0]["attachments"]
+
+
+def test_missing_paths_are_ignored():
+    assert project(RESULT, fields=parse_paths("nothing,classification.nothing")) == {"classification": {}}
+
+
+def test_large_responses_are_compressed():
+    app = FastAPI(default_response_class=FastJSONResponse)
+
+    @app.get("/result")
+    async def result():
+        return {"text": "invoice " * 1000}
+
+    @app.get("/small")
+    async def small():
+        return {"text": "invoice"}
+
+    client = TestClient(CompressResponse(app, minimum_size=1024))
+    response = client.get("/result", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json() == {"text": "invoice " * 1000}
+    raw = client.get("/result", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in raw.headers and json.loads(raw.content)["text"].startswith("invoice")
+    # Small bodies are sent as they are
+    assert "content-encoding" not in client.get("/small", headers={"Accept-Encoding": "gzip"}).headers
+
+
+if __name__ == "__main__":
+    test_parse_paths()
+    test_fields_select_through_lists()
+    test_exclude_drops_nested_fields()
+    test_missing_paths_are_ignored()
+    test_large_responses_are_compressed()
+    print("Response tests passed")
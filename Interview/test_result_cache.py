@@ -0,0 +1,57 @@
+import os
+import tempfile
+from memory.result_cache import ResultCache
+from memory.shared_memory import SharedMemory
+
+
+def pdf_result(text):
+    return {
+        "classification": {"format": "PDF", "intent": "Invoice"},
+        "extraction": {"extracted_text": text, "pages": 40}
+    }
+
+
+def test_large_cached_extraction_is_stored_as_a_blob():
+    for partition in (None, "day"):
+        check_blob_round_trip(partition)
+
+
+def check_blob_round_trip(partition):
+    with tempfile.TemporaryDirectory() as workdir:
+        # With partitioning the blob goes to the period's file while result_cache stays in main
+        memory = SharedMemory(os.path.join(workdir, "memory.db"), partition=partition)
+        try:
+            text = "Invoice total 42.00\n" * 100000
+            cache = ResultCache(memory, version="v1")
+            key = cache.key(text.encode())
+            cache.put(key, pdf_result(text))
+            memory.flush()
+
+            serialized, _ = memory._reader().execute(
+                'SELECT value, created_at FROM result_cache WHERE key = ?', (key,)).fetchone()
+            assert len(serialized) < 1024 and '"$blob"' in serialized
+            # A fresh cache (another worker, or after a restart) reads the full text back
+            value = ResultCache(memory, version="v1").get(key)
+            assert value == pdf_result(text)
+            assert cache.stats()["bytes"] > len(text)
+        finally:
+            memory.close()
+
+
+def test_small_cached_extraction_stays_inline():
+    with tempfile.TemporaryDirectory() as workdir:
+        memory = SharedMemory(os.path.join(workdir, "memory.db"))
+        try:
+            cache = ResultCache(memory, version="v1")
+            cache.put("k", pdf_result("short"))
+            memory.flush()
+            assert ResultCache(memory, version="v1").get("k") == pdf_result("short")
+            assert memory._reader().execute('SELECT COUNT(*) FROM blobs').fetchone()[0] == 0
+        finally:
+            memory.close()
+
+
+if __name__ == "__main__":
+    test_large_cached_extraction_is_stored_as_a_blob()
+    test_small_cached_extraction_stays_inline()
+    print("Result cache tests passed")
@@ -0,0 +1,140 @@
+import os
+import sqlite3
+import contextvars
+import tempfile
+from datetime import datetime, timedelta
+from memory.shared_memory import SharedMemory
+from memory.writer_service import WriterService
+
+
+def metadata(source, intent="General"):
+    return {"source": source, "type": "JSON", "intent": intent, "timestamp": "2024-01-15T10:00:00"}
+
+
+def sources(memory, **filters):
+    return [item["source"] for item in memory.query_metadata(**filters)["items"]]
+
+
+def test_write_behind_commits_on_flush_and_close():
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "memory.db")
+        memory = SharedMemory(path, write_behind=True, flush_interval=5)
+        memory.add_metadata(metadata("a"))
+        # Queued, not committed yet
+        assert sources(memory) == []
+        memory.flush()
+        assert sources(memory) == ["a"]
+        memory.add_metadata(metadata("b"))
+        memory.close()
+
+        memory = SharedMemory(path)
+        try:
+            assert sources(memory) == ["b", "a"]
+        finally:
+            memory.close()
+
+
+def test_failed_write_does_not_drop_its_batch():
+    with tempfile.TemporaryDirectory() as workdir:
+        memory = SharedMemory(os.path.join(workdir, "memory.db"), write_behind=True, flush_interval=5)
+        try:
+            memory.add_metadata(metadata("a"))
+            memory.enqueue_writes([[("INSERT INTO missing_table VALUES (?)", (1,))]])
+            memory.add_metadata(metadata("b"))
+            memory.flush()
+            assert sources(memory) == ["b", "a"]
+        finally:
+            memory.close()
+
+
+def test_write_group_commits_in_one_transaction():
+    with tempfile.TemporaryDirectory() as workdir:
+        memory = SharedMemory(os.path.join(workdir, "memory.db"))
+        group = memory.write_group()
+
+        def write_in_group():
+            group.activate()
+            memory.add_metadata(metadata("a"))
+            memory.add_extracted_fields("JSONAgent", {"id": "1"})
+
+        try:
+            contextvars.copy_context().run(write_in_group)
+            assert sources(memory) == []
+            memory.commit_group(group)
+            assert sources(memory) == ["a"]
+            assert [row["agent"] for row in memory.query_extracted_fields()["items"]] == ["JSONAgent"]
+        finally:
+            memory.close()
+
+
+def test_partitions_roll_and_keep_the_newest():
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "memory.db")
+        memory = SharedMemory(path, partition="day", retention=2)
+        try:
+            # The partition for today is created on open, so the test moves forward from there
+            today = datetime.utcnow().date()
+            first, second, third = [(today + timedelta(days=n)).isoformat() for n in (1, 2, 3)]
+            for day in (first, second, third):
+                # Write as if on that day: the next write rolls to its partition
+                memory._partitions.key_for = lambda when, day=day: day
+                memory._partition_expires = 0
+                memory.add_metadata(metadata(day))
+            assert memory.partitions() == [second, third]
+            assert not os.path.exists(os.path.join(workdir, f"memory.{first}.db"))
+            assert os.path.exists(os.path.join(workdir, f"memory.{third}.db"))
+
+            # Newest first across partitions, with cursors crossing partition boundaries
+            assert sources(memory) == [third, second]
+            page = memory.query_metadata(limit=1)
+            assert [item["source"] for item in page["items"]] == [third]
+            page = memory.query_metadata(limit=1, before_id=page["next_cursor"])
+            assert [item["source"] for item in page["items"]] == [second]
+
+            # Jobs stay in the main database
+            memory.put_job({"job_id": "j", "status": "done", "created_at": "x", "updated_at": "x"})
+            assert memory.get_job("j")["status"] == "done"
+        finally:
+            memory.close()
+
+
+def test_writer_service_commits_for_its_clients():
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "memory.db")
+        address = os.path.join(workdir, "memory.sock")
+        service = WriterService(SharedMemory(path, write_behind=True), address, authkey=b"secret").start()
+        clients = [SharedMemory(path, writer_address=address, writer_authkey=b"secret") for _ in range(2)]
+        try:
+            committed = []
+
+            def stored_rows():
+                with sqlite3.connect(path) as conn:
+                    return conn.execute("SELECT COUNT(*) FROM action_outbox").fetchone()[0]
+
+            for n, client in enumerate(clients):
+                client.add_metadata(metadata(f"worker-{n}"))
+                client.add_extracted_fields("JSONAgent_Alert", {"alert_type": "JSON Anomaly"},
+                                            actions=[("risk_alert", {"worker": n})],
+                                            on_commit=lambda n=n: committed.append((n, stored_rows())))
+            for client in clients:
+                client.flush()
+            # Commit hooks run in the client once the service has committed its writes
+            assert sorted(n for n, _ in committed) == [0, 1]
+            assert all(rows >= 1 for _, rows in committed) and max(rows for _, rows in committed) == 2
+            assert sorted(sources(clients[0])) == ["worker-0", "worker-1"]
+            # Outbox claims are made by the service, so one action is never claimed twice
+            claimed = clients[0].claim_actions() + clients[1].claim_actions()
+            assert sorted(action["payload"]["worker"] for action in claimed) == [0, 1]
+        finally:
+            for client in clients:
+                client.close()
+            service.stop()
+
+
+if __name__ == "__main__":
+    test_write_behind_commits_on_flush_and_close()
+    test_failed_write_does_not_drop_its_batch()
+    test_write_group_commits_in_one_transaction()
+    test_partitions_roll_and_keep_the_newest()
+    test_writer_service_commits_for_its_clients()
+    print("SharedMemory tests passed")
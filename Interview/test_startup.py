@@ -0,0 +1,45 @@
+import os
+import sys
+import json
+import tempfile
+import subprocess
+
+# Seconds a fresh worker may take to import the app and to serve its first JSON and email requests
+IMPORT_BUDGET = float(os.getenv("STARTUP_IMPORT_BUDGET", "1.5"))
+READY_BUDGET = float(os.getenv("STARTUP_READY_BUDGET", "2.5"))
+
+CHILD = """
+import sys, json, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter() - started
+from fastapi.testclient import TestClient
+with TestClient(main.app) as client:
+    client.post("/intake/", data={"json_body": '{"id": "1", "type": "order"}'}).raise_for_status()
+    client.post("/intake/", data={"email_body": "From: a@example.com\\nSubject: RFQ for pens"}).raise_for_status()
+    ready = time.perf_counter() - started
+    pdf_loaded = "pypdf" in sys.modules or main.agents.is_loaded("PDFAgent")
+print(json.dumps({"import": imported, "ready": ready, "pdf_loaded": pdf_loaded}))
+"""
+
+
+def measure_startup():
+    """Start a fresh interpreter without agent prewarming and time its cold start."""
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ, DATABASE_PATH=os.path.join(workdir, "memory.db"), PREWARM_AGENTS="")
+        output = subprocess.run([sys.executable, "-c", CHILD], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                env=env, capture_output=True, text=True, timeout=60, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def test_startup_budget():
+    timings = measure_startup()
+    print("Startup timings:", timings)
+    assert timings["import"] < IMPORT_BUDGET
+    assert timings["ready"] < READY_BUDGET
+    # JSON and email traffic must not pay for the PDF stack
+    assert not timings["pdf_loaded"]
+
+
+if __name__ == "__main__":
+    test_startup_budget()
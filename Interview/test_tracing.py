@@ -0,0 +1,16 @@
+from tracing import Tracer
+
+
+def test_client_ids_are_sampled_like_generated_ones():
+    tracer = Tracer(memory=None, sample_rate=0, force_header="X-Trace-Sampled")
+    assert not tracer.start("POST /intake/", "client-chosen-id").sampled
+    assert tracer.start("POST /intake/", "client-chosen-id").trace_id == "client-chosen-id"
+    # Only the configured header, sent with 1, forces sampling
+    assert tracer.start("POST /intake/", sampled=tracer.forced({"x-trace-sampled": "1"})).sampled
+    assert not tracer.start("POST /intake/", sampled=tracer.forced({"x-trace-sampled": "0"})).sampled
+    assert Tracer(memory=None, sample_rate=0).forced({"x-trace-sampled": "1"}) is None
+
+
+if __name__ == "__main__":
+    test_client_ids_are_sampled_like_generated_ones()
+    print("Tracing tests passed")
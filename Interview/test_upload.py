@@ -0,0 +1,90 @@
+import io
+import os
+import tempfile
+from fastapi import FastAPI, File, UploadFile
+from fastapi.testclient import TestClient
+from agents.intake_context import IntakeContext, InputTooLarge
+from main import UploadSizeLimit
+
+MB = 1024 * 1024
+
+
+def spooled_upload(size):
+    """An upload as Starlette hands it over: a SpooledTemporaryFile rolled over to disk past 1 MB."""
+    upload = tempfile.SpooledTemporaryFile(max_size=MB)
+    upload.write(b"%PDF" + b"x" * (size - 4))
+    upload.seek(0)
+    return upload
+
+
+def test_spooled_upload_is_used_in_place():
+    upload = spooled_upload(3 * MB)
+    spooled_before = set(os.listdir(tempfile.gettempdir()))
+    ctx = IntakeContext.from_stream(upload, max_bytes=50 * MB)
+    # Not copied to a temp file of its own, and still readable once the upload is closed
+    assert set(os.listdir(tempfile.gettempdir())) == spooled_before
+    upload.close()
+    try:
+        assert ctx.size == 3 * MB and ctx.prefix.startswith(b"%PDF")
+        with open(ctx.path, 'rb') as f:
+            assert len(f.read()) == 3 * MB
+    finally:
+        ctx.close()
+    assert ctx.path is None
+
+
+def test_small_and_in_memory_uploads():
+    upload = spooled_upload(1000)
+    assert IntakeContext.from_stream(upload).raw_bytes.startswith(b"%PDF")
+    # A stream that isn't a file on disk is still spooled to a temp file
+    ctx = IntakeContext.from_stream(io.BytesIO(b"x" * (2 * MB)))
+    try:
+        assert os.path.isfile(ctx.path) and ctx.size == 2 * MB
+    finally:
+        ctx.close()
+
+
+def test_spooled_upload_over_the_limit():
+    try:
+        IntakeContext.from_stream(spooled_upload(3 * MB), max_bytes=2 * MB)
+    except InputTooLarge:
+        pass
+    else:
+        raise AssertionError("expected InputTooLarge")
+
+
+def limited_client(max_bytes):
+    app = FastAPI()
+
+    @app.post("/intake/")
+    async def intake(file: UploadFile = File(...)):
+        return {"size": len(await file.read())}
+
+    return TestClient(UploadSizeLimit(app, max_bytes=max_bytes))
+
+
+def multipart(size, boundary="b0undary"):
+    yield (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.bin\"\r\n"
+           "Content-Type: application/octet-stream\r\n\r\n").encode()
+    for _ in range(size // 1024):
+        yield b"x" * 1024
+    yield f"\r\n--{boundary}--\r\n".encode()
+
+
+def test_upload_limit_applies_to_chunked_bodies():
+    client = limited_client(64 * 1024)
+    headers = {"Content-Type": "multipart/form-data; boundary=b0undary"}
+    # A generator body is sent chunked, without Content-Length
+    response = client.post("/intake/", content=multipart(256 * 1024), headers=headers)
+    assert response.status_code == 413 and "error" in response.json()
+    assert client.post("/intake/", content=multipart(16 * 1024), headers=headers).json() == {"size": 16 * 1024}
+    response = client.post("/intake/", content=b"".join(multipart(256 * 1024)), headers=headers)
+    assert response.status_code == 413
+
+
+if __name__ == "__main__":
+    test_spooled_upload_is_used_in_place()
+    test_small_and_in_memory_uploads()
+    test_spooled_upload_over_the_limit()
+    test_upload_limit_applies_to_chunked_bodies()
+    print("Upload tests passed")
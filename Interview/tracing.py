@@ -0,0 +1,178 @@
+import re
+import time
+import uuid
+import random
+import threading
+import contextvars
+from datetime import datetime, timedelta
+
+# Trace of the request being handled in the current context (asyncio task, or a
+# thread started through AgentExecutor.run, which copies the caller's context)
+_current_trace = contextvars.ContextVar("trace", default=None)
+
+# Trace ids accepted from clients (X-Request-ID); anything else gets a generated id
+_VALID_TRACE_ID = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
+
+
+class Trace:
+    def __init__(self, name, trace_id=None, sampled=True):
+        """
+        Timeline of one request (or of one async job run for it):
+        - trace_id is written with every SharedMemory row and action of the request
+        - spans are (name, offset from the start, duration, attributes), recorded from any
+          thread or task that shares the trace's context
+        - sampled marks the trace for storage when it finishes (see Tracer.should_store)
+        """
+        self.name = name
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.sampled = sampled
+        self.started_at = datetime.utcnow()
+        self.status = None
+        self.duration = None
+        self._started = time.perf_counter()
+        self._spans = []
+        self._lock = threading.Lock()
+
+    def add_span(self, name, started, duration, attributes=None):
+        """Record a span from perf_counter() start and duration in seconds."""
+        span = {"name": name, "offset": round(started - self._started, 6), "duration": round(duration, 6)}
+        if attributes:
+            span["attributes"] = attributes
+        with self._lock:
+            self._spans.append(span)
+
+    def finish(self, status):
+        self.status = status
+        self.duration = time.perf_counter() - self._started
+
+    def record(self):
+        """The stored form of the trace, spans in start order."""
+        with self._lock:
+            spans = sorted(self._spans, key=lambda span: span["offset"])
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "status": self.status,
+            "started_at": self.started_at.isoformat(),
+            "duration": round(self.duration, 6) if self.duration is not None else None,
+            "spans": spans
+        }
+
+
+def activate(trace):
+    """Make trace current in this context; returns the token for deactivate()."""
+    return _current_trace.set(trace)
+
+
+def deactivate(token):
+    _current_trace.reset(token)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def current_trace_id():
+    trace = _current_trace.get()
+    return trace.trace_id if trace is not None else None
+
+
+def record_span(name, started, duration, **attributes):
+    """Add a span to the current trace, if any (for timings already measured elsewhere)."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(name, started, duration, attributes)
+
+
+class span:
+    """Context manager recording its block as a span of the current trace; a no-op without one."""
+    __slots__ = ("name", "attributes", "trace", "started")
+
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.trace = _current_trace.get()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.trace is not None:
+            if exc_type is not None:
+                self.attributes["error"] = exc_type.__name__
+            self.trace.add_span(self.name, self.started, time.perf_counter() - self.started, self.attributes)
+        return False
+
+
+class Tracer:
+    def __init__(self, memory, sample_rate=1.0, slow_seconds=None, ttl=86400, force_header=None):
+        """
+        Starts request traces and decides which are stored in SharedMemory:
+        - a sample_rate fraction of traces, chosen when they start
+        - every trace slower than slow_seconds or ending with a 5xx status, sampled or
+          not, so tail latency and failures are always kept
+        - requests sending force_header: 1, when a force_header is configured (a client-chosen
+          X-Request-ID is sampled like any other id), and async jobs of stored traces
+        Trace ids are written with every row either way; sampling only governs spans.
+        Stored traces are pruned after ttl seconds.
+        """
+        self.memory = memory
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.ttl = ttl
+        self.force_header = force_header.lower() if force_header else None
+        self._last_prune = 0
+
+    def start(self, name, trace_id=None, sampled=None):
+        """New trace; a client-supplied trace_id is kept only if it is a safe token."""
+        if trace_id is not None and not _VALID_TRACE_ID.match(trace_id):
+            trace_id = None
+        if sampled is None:
+            sampled = random.random() < self.sample_rate
+        return Trace(name, trace_id, sampled)
+
+    def forced(self, headers):
+        """True when a request opts into sampling with force_header: 1, None (sampled at sample_rate) otherwise."""
+        if self.force_header is not None and headers.get(self.force_header) == "1":
+            return True
+        return None
+
+    def should_store(self, trace):
+        if trace.sampled:
+            return True
+        if trace.status is not None and trace.status >= 500:
+            return True
+        return self.slow_seconds is not None and trace.duration >= self.slow_seconds
+
+    def store(self, trace):
+        """Write a finished trace, pruning expired ones at most once a minute. Blocking: run it off the event loop."""
+        self.memory.put_trace(trace.record())
+        now = time.time()
+        if now - self._last_prune >= 60:
+            self._last_prune = now
+            self.memory.prune_traces((datetime.utcnow() - timedelta(seconds=self.ttl)).isoformat())
+
+
+def timeline(found):
+    """
+    Merge what SharedMemory.get_trace() found for one trace id into a single list ordered by time:
+    spans (with absolute start times), then rows of every table, each tagged with its kind.
+    """
+    events = []
+    for segment in found["traces"]:
+        started_at = datetime.fromisoformat(segment["started_at"])
+        events.append({"at": segment["started_at"], "kind": "trace", "name": segment["name"],
+                       "status": segment["status"], "duration": segment["duration"]})
+        for item in segment["spans"]:
+            at = (started_at + timedelta(seconds=item["offset"])).isoformat()
+            events.append(dict(item, at=at, kind="span", trace=segment["name"]))
+    for kind in ("metadata", "extracted_fields", "conversations"):
+        for row in found[kind]:
+            events.append(dict(row, at=row["timestamp"], kind=kind))
+    for row in found["actions"]:
+        events.append(dict(row, at=row["created_at"], kind="action"))
+    for row in found["jobs"]:
+        events.append(dict(row, at=row["created_at"], kind="job"))
+    events.sort(key=lambda event: event["at"] or "")
+    return events